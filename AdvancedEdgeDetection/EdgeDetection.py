@@ -1,7 +1,17 @@
-import cv2
+import os
+import sys
+
 import numpy as np
 from PIL import Image, ImageOps
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Core.Backends import switchable
+from Core.Cache import cached
+from Core.Lazy import lazy_import
+from Core.Profiling import profiled
+
+cv2 = lazy_import('cv2')
+
 blurring_mask_7x7 = np.array([
     [0, 0, -1, -1, -1, 0, 0],
     [0, -2, -3, -3, -3, -2, 0],
@@ -24,6 +34,9 @@ blurring_mask_9x9 = np.array([
     [0, 0, 0, -1, -1, -1, 0, 0, 0],
 ], dtype=np.float32)
 
+@profiled
+@switchable('contrast-edge')
+@cached('contrast-edge')
 def contrast_based_edge(image):
     image = np.array(image, dtype=np.float32)
 
@@ -44,10 +57,17 @@ def contrast_based_edge(image):
 
     return Image.fromarray(contrast_image.astype(np.uint8))
 
-def difference_of_gaussians(image):
-    image = np.array(image)
+@profiled
+def difference_of_gaussians_array(image):
     blurred_1 = cv2.filter2D(image, -1, blurring_mask_7x7)
     blurred_2 = cv2.filter2D(image, -1, blurring_mask_9x9)
 
     dog_result = blurred_1 - blurred_2
-    return Image.fromarray(dog_result.astype(np.uint8)), Image.fromarray(blurred_1.astype(np.uint8)), Image.fromarray(blurred_2.astype(np.uint8))
+    return dog_result.astype(np.uint8), blurred_1.astype(np.uint8), blurred_2.astype(np.uint8)
+
+@profiled
+@switchable('dog')
+@cached('dog')
+def difference_of_gaussians(image):
+    image = np.array(image)
+    return tuple(Image.fromarray(result) for result in difference_of_gaussians_array(image))
@@ -1,79 +1,126 @@
+import os
+import sys
+
 import numpy as np
 from PIL import Image
 
-def homogeneity_operator(image, threshold=5):
-    image = np.array(image, dtype=np.float32)
-    height, width = image.shape
-    homogeneity_image = np.zeros_like(image)
-
-    for x in range(1, height - 1):
-        for y in range(1, width - 1):
-            center_pixel = image[x, y]
-
-            neighborhood = [
-                image[x - 1, y - 1], image[x - 1, y], image[x - 1, y + 1],
-                image[x, y - 1], image[x, y + 1],
-                image[x + 1, y - 1], image[x + 1, y], image[x + 1, y + 1],
-            ]
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Core.Backends import switchable
+from Core.Cache import cached
+from Core.Profiling import profiled
 
-            differences = np.array([abs(center_pixel - neighbor) for neighbor in neighborhood])
-            homogeneity_value = max(differences)
+NEIGHBOR_OFFSETS = [(-1, -1), (-1, 0), (-1, 1),
+                    (0, -1),           (0, 1),
+                    (1, -1),  (1, 0),  (1, 1)]
 
-            if homogeneity_value > threshold:
-                homogeneity_image[x, y] = homogeneity_value
-
-    return Image.fromarray(homogeneity_image.astype(np.uint8))
-
-def difference_operator(image, threshold=5):
-    image = np.array(image, dtype=np.float32)
+def _neighbor_views(image):
+    # Views of the 8 neighbours of every interior pixel, no copies.
     height, width = image.shape
-    difference_image = np.zeros_like(image)
-
-    for i in range(1, height - 1):
-        for j in range(1, width - 1):
-            differences = np.array(
-                [
-                    abs(image[(i + 1), j] - image[(i - 1), j]),
-                    abs(image[i, (j - 1)] - image[i, (j + 1)]),
-                    abs(image[(i + 1), (j - 1)] - image[(i - 1), (j + 1)]),
-                    abs(image[(i + 1), (j + 1)] - image[(i - 1), (j - 1)]),
-                ]
-            )
+    return {(dy, dx): image[1 + dy:height - 1 + dy, 1 + dx:width - 1 + dx]
+            for dy in (-1, 0, 1) for dx in (-1, 0, 1)}
+
+def _neighborhood_maps(image, threshold, operators):
+    """
+    Compute the requested 3x3 neighbourhood maps of the interior pixels in one
+    sweep over the shifted views, sharing them between operators.
+    """
+    views = _neighbor_views(image)
+    center = views[(0, 0)]
+    maps = {}
+
+    if 'homogeneity' in operators or 'range' in operators or 'variance' in operators:
+        homogeneity = np.zeros_like(center)
+        maximum = center.copy()
+        minimum = center.copy()
+        total = center.copy()
+        for offset in NEIGHBOR_OFFSETS:
+            neighbor = views[offset]
+            np.maximum(homogeneity, np.abs(center - neighbor), out=homogeneity)
+            np.maximum(maximum, neighbor, out=maximum)
+            np.minimum(minimum, neighbor, out=minimum)
+            total += neighbor
+
+        if 'homogeneity' in operators:
+            maps['homogeneity'] = np.where(homogeneity > threshold, homogeneity, 0)
+        if 'range' in operators:
+            maps['range'] = maximum - minimum
+        if 'variance' in operators:
+            mean = total / 9
+            variance = (center - mean) ** 2
+            for offset in NEIGHBOR_OFFSETS:
+                variance += (views[offset] - mean) ** 2
+            maps['variance'] = variance / 9
+
+    if 'difference' in operators:
+        difference = np.abs(views[(1, 0)] - views[(-1, 0)])
+        for first, second in (((0, -1), (0, 1)), ((1, -1), (-1, 1)), ((1, 1), (-1, -1))):
+            np.maximum(difference, np.abs(views[first] - views[second]), out=difference)
+        maps['difference'] = np.where(difference > threshold, difference, 0)
+
+    return maps
+
+def _to_array(interior, shape):
+    # Border pixels have no full neighbourhood and stay 0.
+    result = np.zeros(shape, dtype=np.uint8)
+    result[1:-1, 1:-1] = np.clip(interior, 0, 255)
+    return result
+
+@profiled
+def neighborhood_operators_array(image, threshold=5):
+    image = np.asarray(image, dtype=np.float32)
+    maps = _neighborhood_maps(image, threshold, ('homogeneity', 'difference', 'variance', 'range'))
+    return {name: _to_array(values, image.shape) for name, values in maps.items()}
+
+@profiled
+@cached('neighborhood')
+def neighborhood_operators(image, threshold=5):
+    """
+    Homogeneity, difference, variance and range maps computed together.
+    Returns a dict of images keyed by operator name.
+    """
+    maps = neighborhood_operators_array(image, threshold)
+    return {name: Image.fromarray(values) for name, values in maps.items()}
+
+@profiled
+def homogeneity_operator_array(image, threshold=5):
+    image = np.asarray(image, dtype=np.float32)
+    return _to_array(_neighborhood_maps(image, threshold, ('homogeneity',))['homogeneity'], image.shape)
+
+@profiled
+@switchable('homogeneity')
+@cached('homogeneity')
+def homogeneity_operator(image, threshold=5):
+    return Image.fromarray(homogeneity_operator_array(image, threshold))
 
-            difference_value = max(differences)
+@profiled
+def difference_operator_array(image, threshold=5):
+    image = np.asarray(image, dtype=np.float32)
+    return _to_array(_neighborhood_maps(image, threshold, ('difference',))['difference'], image.shape)
 
-            if difference_value > threshold:
-                difference_image[i, j] = difference_value
+@profiled
+@switchable('difference')
+@cached('difference')
+def difference_operator(image, threshold=5):
+    return Image.fromarray(difference_operator_array(image, threshold))
 
-    return Image.fromarray(difference_image.astype(np.uint8))
+@profiled
+def variance_operator_array(image):
+    image = np.asarray(image, dtype=np.float32)
+    return _to_array(_neighborhood_maps(image, None, ('variance',))['variance'], image.shape)
 
+@profiled
+@switchable('variance')
+@cached('variance')
 def variance_operator(image):
-    image = np.array(image, dtype=np.float32)
-    height, width = image.shape
-
-    np_image = np.array(image, dtype=np.float32)
-    variance_result = np.zeros_like(np_image)
+    return Image.fromarray(variance_operator_array(image))
 
-    for x in range(1, height):
-        for y in range(1, width):
-            neighborhood = image[x - 1: x + 1, y - 1: y + 1]
-            mean = np.mean(neighborhood)
-            variance = np.sum((neighborhood - mean) ** 2) / 9
-            variance_result[x, y] = variance
-
-    return Image.fromarray(variance_result.astype(np.uint8))
+@profiled
+def range_operator_array(image):
+    image = np.asarray(image, dtype=np.float32)
+    return _to_array(_neighborhood_maps(image, None, ('range',))['range'], image.shape)
 
+@profiled
+@switchable('range')
+@cached('range')
 def range_operator(image):
-    image = np.array(image, dtype=np.float32)
-    height, width = image.shape
-    range_image = np.zeros_like(image)
-
-    for i in range(1, height):
-        for j in range(1, width):
-            neighborhood = image[i - 1: i + 1, j - 1: j + 1]
-            max_pixel = np.max(neighborhood)
-            min_pixel = np.min(neighborhood)
-            range_value = max_pixel - min_pixel
-            range_image[i, j] = range_value
-
-    return Image.fromarray(range_image.astype(np.uint8))
+    return Image.fromarray(range_operator_array(image))
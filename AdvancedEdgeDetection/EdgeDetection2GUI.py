@@ -1,11 +1,16 @@
+import os
+import sys
 import tkinter as tk
 from tkinter import filedialog
 from PIL import Image, ImageTk, ImageOps
-from EdgeDetection2 import homogeneity_operator, difference_operator, variance_operator, range_operator
-import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AdvancedEdgeDetection.EdgeDetection2 import homogeneity_operator, difference_operator, variance_operator, range_operator, neighborhood_operators
+from Core.Session import Session
+from Core.Statistics import image_statistics
+from Core.Worker import Worker
 
 class EdgeDetectionGUI:
-    def __init__(self, master):
+    def __init__(self, master, session=None):
         self.master = master
         self.master.title("Advanced Edge Detection")
 
@@ -34,6 +39,9 @@ class EdgeDetectionGUI:
         self.range_btn = tk.Button(self.controls, text="Range Operator", command=self.apply_range, state=tk.DISABLED)
         self.range_btn.pack(pady=5)
 
+        self.compare_btn = tk.Button(self.controls, text="Compare All Operators", command=self.compare_all, state=tk.DISABLED)
+        self.compare_btn.pack(pady=5)
+
         self.threshold_btn = tk.Button(self.controls, text="Calculate Threshold", command=self.calculate_threshold, state=tk.DISABLED)
         self.threshold_btn.pack(pady=5)
 
@@ -43,18 +51,26 @@ class EdgeDetectionGUI:
         self.threshold_label = tk.Label(self.controls, text="Threshold: N/A", font=("Arial", 12))
         self.threshold_label.pack(pady=5)
 
+        self.worker = Worker(master, self.controls, self.display_image)
+
         self.image = None
         self.gray_image = None
+        self.session = session or Session()
+        self.session.subscribe(self.show_image)
 
     def upload_image(self):
         file_path = filedialog.askopenfilename(filetypes=[("Image Files", "*.png *.jpg *.jpeg *.bmp")])
         if file_path:
-            img = Image.open(file_path)
-            img.thumbnail((400, 400))
-            self.image = img
-            self.display_image(img)
-            self.grayscale_btn.config(state=tk.NORMAL)
-            self.reset_btn.config(state=tk.NORMAL)
+            self.session.open(file_path)
+
+    def show_image(self, session):
+        self.worker.reset()
+        self.source = session.source
+        img = session.thumbnail
+        self.image = img
+        self.display_image(img)
+        self.grayscale_btn.config(state=tk.NORMAL)
+        self.reset_btn.config(state=tk.NORMAL)
 
     def display_image(self, img):
         img_tk = ImageTk.PhotoImage(img)
@@ -65,41 +81,55 @@ class EdgeDetectionGUI:
         if self.image:
             gray = ImageOps.grayscale(self.image)
             self.gray_image = gray
+            self.gray_source = self.session.grayscale()
             self.display_image(gray)
             self.homogeneity_btn.config(state=tk.NORMAL)
             self.difference_btn.config(state=tk.NORMAL)
             self.variance_btn.config(state=tk.NORMAL)
             self.range_btn.config(state=tk.NORMAL)
+            self.compare_btn.config(state=tk.NORMAL)
             self.threshold_btn.config(state=tk.NORMAL)
 
     def apply_homogeneity(self):
         if self.gray_image:
-            homogeneity = homogeneity_operator(self.gray_image)
-            self.display_image(homogeneity)
+            self.worker.run_progressive(homogeneity_operator, self.gray_image, self.gray_source, self.display_image)
 
     def apply_difference(self):
         if self.gray_image:
-            difference = difference_operator(self.gray_image)
-            self.display_image(difference)
+            self.worker.run_progressive(difference_operator, self.gray_image, self.gray_source, self.display_image)
 
     def apply_variance(self):
         if self.gray_image:
-            variance = variance_operator(self.gray_image)
-            self.display_image(variance)
+            self.worker.run_progressive(variance_operator, self.gray_image, self.gray_source, self.display_image)
 
     def apply_range(self):
         if self.gray_image:
-            range_image = range_operator(self.gray_image)
-            self.display_image(range_image)
+            self.worker.run_progressive(range_operator, self.gray_image, self.gray_source, self.display_image)
+
+    def compare_all(self):
+        if self.gray_image:
+            # Homogeneity | Difference on top, Variance | Range below. Only
+            # shown, so the next operator still runs on the current result.
+            self.worker.show_preview(neighborhood_operators, self.gray_image, self.gray_source, self.display_image,
+                                     select=self.comparison_grid)
+
+    def comparison_grid(self, maps):
+        width, height = maps["homogeneity"].size
+        grid = Image.new("L", (width, height))
+        half = (width // 2, height // 2)
+        for name, position in (("homogeneity", (0, 0)), ("difference", (half[0], 0)),
+                               ("variance", (0, half[1])), ("range", half)):
+            grid.paste(maps[name].resize(half), position)
+        return grid
 
     def calculate_threshold(self):
         if self.gray_image:
-            np_image = np.array(self.gray_image)
-            threshold = np.mean(np_image)
+            threshold = image_statistics(self.gray_image).mean
             optimal = "Optimal" if threshold > 127 else "Not Optimal"
             self.threshold_label.config(text=f"Threshold: {threshold:.2f} ({optimal})")
 
     def reset_to_original(self):
+        self.worker.reset()
         if self.image:
             self.display_image(self.image)
             self.gray_image = None
@@ -107,6 +137,7 @@ class EdgeDetectionGUI:
             self.difference_btn.config(state=tk.DISABLED)
             self.variance_btn.config(state=tk.DISABLED)
             self.range_btn.config(state=tk.DISABLED)
+            self.compare_btn.config(state=tk.DISABLED)
             self.threshold_btn.config(state=tk.DISABLED)
             self.threshold_label.config(text="Threshold: N/A")
 
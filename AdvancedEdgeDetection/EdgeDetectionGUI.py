@@ -1,11 +1,16 @@
+import os
+import sys
 import tkinter as tk
 from tkinter import filedialog
 from PIL import Image, ImageTk, ImageOps
-from EdgeDetection import contrast_based_edge, difference_of_gaussians
-import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AdvancedEdgeDetection.EdgeDetection import contrast_based_edge, difference_of_gaussians
+from Core.Session import Session
+from Core.Statistics import image_statistics
+from Core.Worker import Worker
 
 class EdgeDetectionGUI:
-    def __init__(self, master):
+    def __init__(self, master, session=None):
         self.master = master
         self.master.title("Advanced Edge Detection")
 
@@ -43,18 +48,26 @@ class EdgeDetectionGUI:
         self.threshold_label = tk.Label(self.controls, text="Threshold: N/A", font=("Arial", 12))
         self.threshold_label.pack(pady=5)
 
+        self.worker = Worker(master, self.controls, self.display_image)
+
         self.image = None
         self.gray_image = None
+        self.session = session or Session()
+        self.session.subscribe(self.show_image)
 
     def upload_image(self):
         file_path = filedialog.askopenfilename(filetypes=[("Image Files", "*.png *.jpg *.jpeg *.bmp")])
         if file_path:
-            img = Image.open(file_path)
-            img.thumbnail((400, 400))
-            self.image = img
-            self.display_image(img)
-            self.grayscale_btn.config(state=tk.NORMAL)
-            self.reset_btn.config(state=tk.NORMAL)
+            self.session.open(file_path)
+
+    def show_image(self, session):
+        self.worker.reset()
+        self.source = session.source
+        img = session.thumbnail
+        self.image = img
+        self.display_image(img)
+        self.grayscale_btn.config(state=tk.NORMAL)
+        self.reset_btn.config(state=tk.NORMAL)
 
     def display_image(self, img):
         img_tk = ImageTk.PhotoImage(img)
@@ -65,6 +78,7 @@ class EdgeDetectionGUI:
         if self.image:
             gray = ImageOps.grayscale(self.image)
             self.gray_image = gray
+            self.gray_source = self.session.grayscale()
             self.display_image(gray)
             self.contrast_btn.config(state=tk.NORMAL)
             self.dog_7x7_btn.config(state=tk.NORMAL)
@@ -74,32 +88,31 @@ class EdgeDetectionGUI:
 
     def apply_contrast_based_edge(self):
         if self.gray_image:
-            contrast_edge = contrast_based_edge(self.gray_image)
-            self.display_image(contrast_edge)
+            self.worker.run_progressive(contrast_based_edge, self.gray_image, self.gray_source, self.display_image)
 
     def apply_dog_7x7(self):
         if self.gray_image:
-            dog, dog_7x7, dog_9x9 = difference_of_gaussians(self.gray_image)
-            self.display_image(dog_7x7)
+            self.worker.run_progressive(difference_of_gaussians, self.gray_image, self.gray_source, self.display_image,
+                                        select=lambda results: results[1])
 
     def apply_dog_9x9(self):
         if self.gray_image:
-            dog, dog_7x7, dog_9x9 = difference_of_gaussians(self.gray_image)
-            self.display_image(dog_9x9)
+            self.worker.run_progressive(difference_of_gaussians, self.gray_image, self.gray_source, self.display_image,
+                                        select=lambda results: results[2])
 
     def apply_dog(self):
         if self.gray_image:
-            dog, dog_7x7, dog_9x9 = difference_of_gaussians(self.gray_image)
-            self.display_image(dog)
+            self.worker.run_progressive(difference_of_gaussians, self.gray_image, self.gray_source, self.display_image,
+                                        select=lambda results: results[0])
 
     def calculate_threshold(self):
         if self.gray_image:
-            np_image = np.array(self.gray_image)
-            threshold = np.mean(np_image)
+            threshold = image_statistics(self.gray_image).mean
             optimal = "Optimal" if threshold > 127 else "Not Optimal"
             self.threshold_label.config(text=f"Threshold: {threshold:.2f} ({optimal})")
 
     def reset_to_original(self):
+        self.worker.reset()
         if self.image:
             self.display_image(self.image)
             self.gray_image = None
@@ -1,10 +1,15 @@
+import os
+import sys
 import tkinter as tk
 from tkinter import filedialog
 from PIL import Image, ImageTk, ImageOps
 import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Core.Session import Session
+from Core.Statistics import image_statistics
 
 class BasicGUI:
-    def __init__(self, master):
+    def __init__(self, master, session=None):
         self.master = master
         self.master.title("Basic Operations")
         
@@ -32,17 +37,21 @@ class BasicGUI:
         
         self.image = None
         self.gray_image = None
+        self.session = session or Session()
+        self.session.subscribe(self.show_image)
 
     def upload_image(self):
         file_path = filedialog.askopenfilename(filetypes=[("Image Files", "*.png *.jpg *.jpeg *.bmp")])
         if file_path:
-            img = Image.open(file_path)
-            img.thumbnail((400, 400))  # Resize to fit the canvas
-            self.image = img
-            self.display_image(img)
-            self.grayscale_btn.config(state=tk.NORMAL)
-            self.threshold_btn.config(state=tk.NORMAL)
-            self.reset_btn.config(state=tk.NORMAL)
+            self.session.open(file_path)
+
+    def show_image(self, session):
+        img = session.thumbnail
+        self.image = img
+        self.display_image(img)
+        self.grayscale_btn.config(state=tk.NORMAL)
+        self.threshold_btn.config(state=tk.NORMAL)
+        self.reset_btn.config(state=tk.NORMAL)
 
     def display_image(self, img):
         img_tk = ImageTk.PhotoImage(img)
@@ -69,37 +78,8 @@ class BasicGUI:
 
     def calculate_threshold(self):
         if self.gray_image:
-            np_image = np.array(self.gray_image)
-            
-            # Calculate threshold using iterative method (Basic Otsu's method)
-            hist = np.histogram(np_image, bins=256, range=(0,256))[0]
-            total = np_image.size
-            current_max = -float('inf')
-            threshold = 0
-            
-            sum_all = sum(i * h for i, h in enumerate(hist))
-            w_b = 0
-            sum_b = 0
-            
-            for i in range(256):
-                w_b += hist[i]
-                if w_b == 0:
-                    continue
-                    
-                w_f = total - w_b
-                if w_f == 0:
-                    break
-                
-                sum_b += i * hist[i]
-                mean_b = sum_b / w_b
-                mean_f = (sum_all - sum_b) / w_f
-                
-                # Calculate between class variance
-                variance = w_b * w_f * (mean_b - mean_f) ** 2
-                
-                if variance > current_max:
-                    current_max = variance
-                    threshold = i
+            # Otsu's method on the shared histogram
+            threshold = image_statistics(self.gray_image).otsu
             
             optimal = "Optimal" if threshold > 127 else "Not Optimal"
             self.threshold_label.config(text=f"Threshold: {threshold:.2f} ({optimal})")
@@ -0,0 +1,144 @@
+import argparse
+import ast
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image
+
+from Core.Operators import OPERATORS, apply_operator
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp', '.pgm')
+
+# Pillow format name and the extension written for each --format choice.
+OUTPUT_FORMATS = {
+    'png': ('PNG', '.png'),
+    'jpeg': ('JPEG', '.jpg'),
+    'tiff': ('TIFF', '.tif'),
+    'bmp': ('BMP', '.bmp'),
+    'webp': ('WEBP', '.webp'),
+}
+
+
+def parse_step(spec):
+    """
+    Parse 'name' or 'name:key=value,key=value' into (name, params).
+    Values are Python literals where possible and strings otherwise.
+    """
+    name, _, arguments = spec.partition(':')
+    if name not in OPERATORS:
+        raise argparse.ArgumentTypeError(f"unknown operator '{name}' (choose from {', '.join(OPERATORS)})")
+
+    params = {}
+    for argument in filter(None, arguments.split(',')):
+        key, separator, value = argument.partition('=')
+        if not separator:
+            raise argparse.ArgumentTypeError(f"expected key=value in '{spec}'")
+        try:
+            params[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            params[key] = value
+    return name, params
+
+
+def collect_inputs(patterns):
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [os.path.join(pattern, name) for name in sorted(os.listdir(pattern))]
+        else:
+            matches = sorted(glob.glob(pattern))
+        paths.extend(path for path in matches
+                     if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS))
+    return list(dict.fromkeys(paths))
+
+
+def output_paths(paths, output, extension):
+    """
+    Output path for each input: its path relative to the inputs' common
+    directory, under `output`, with `extension`. Raises ValueError if two
+    inputs would be written to the same file (a.png and a.jpg).
+    """
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+    outputs = {}
+    for path in paths:
+        relative = os.path.relpath(os.path.abspath(path), root)
+        output_path = os.path.join(output, os.path.splitext(relative)[0] + extension)
+        if output_path in outputs:
+            raise ValueError(f"{outputs[output_path]} and {path} would both be written to {output_path}")
+        outputs[output_path] = path
+    return {path: output_path for output_path, path in outputs.items()}
+
+
+def process_file(path, steps, output_path, output_format, quality):
+    start = time.perf_counter()
+    image = Image.open(path)
+    image.load()
+    width, height = image.size
+
+    for name, params in steps:
+        image = apply_operator(name, image, **params)
+
+    if image.mode not in ('1', 'L', 'RGB', 'RGBA'):
+        image = image.convert('L')
+    save_options = {'quality': quality} if output_format in ('JPEG', 'WEBP') else {}
+    image.save(output_path, output_format, **save_options)
+
+    return width * height, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply a chain of toolkit operators to many images without the GUI.")
+    parser.add_argument('inputs', nargs='+', help="image files, directories or glob patterns")
+    parser.add_argument('-s', '--step', dest='steps', action='append', type=parse_step, required=True,
+                        help="operator to apply, as name or name:key=value,...; repeat to chain")
+    parser.add_argument('-o', '--output', required=True,
+                        help="output directory, mirroring the inputs' directories below their common one")
+    parser.add_argument('-f', '--format', choices=OUTPUT_FORMATS, default='png', help="output format (default: png)")
+    parser.add_argument('-q', '--quality', type=int, default=95, help="JPEG/WebP quality (default: 95)")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help="worker processes (default: number of CPUs)")
+    args = parser.parse_args(argv)
+
+    paths = collect_inputs(args.inputs)
+    if not paths:
+        parser.error("no input images found")
+    output_format, extension = OUTPUT_FORMATS[args.format]
+    try:
+        outputs = output_paths(paths, args.output, extension)
+    except ValueError as error:
+        parser.error(str(error))
+    for directory in sorted({os.path.dirname(output_path) for output_path in outputs.values()}):
+        os.makedirs(directory, exist_ok=True)
+
+    total_pixels = 0
+    failures = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {}
+        for path in paths:
+            future = executor.submit(process_file, path, args.steps, outputs[path], output_format, args.quality)
+            futures[future] = path
+
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                pixels, seconds = future.result()
+            except Exception as error:
+                failures += 1
+                print(f"{path}: FAILED ({error})", file=sys.stderr)
+                continue
+            total_pixels += pixels
+            print(f"{path}: {pixels / 1e6:.2f} MP in {seconds:.3f} s ({pixels / 1e6 / seconds:.2f} MP/s)")
+
+    elapsed = time.perf_counter() - start
+    done = len(paths) - failures
+    print(f"{done} of {len(paths)} images, {total_pixels / 1e6:.2f} MP in {elapsed:.2f} s "
+          f"({done / elapsed:.2f} images/s, {total_pixels / 1e6 / elapsed:.2f} MP/s, {args.workers} workers)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
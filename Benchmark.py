@@ -0,0 +1,337 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from Core.Backends import differential, differential_images
+from Core.Cache import RESULTS
+from Core.Lazy import LOAD_TIMES
+from Core.Operators import OPERATORS, apply_operator
+from Core.Statistics import clear_cache
+
+DEFAULT_SIZES = (0.25, 1, 4, 16)
+ASSETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Img', '*.jp*g')
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Modules whose cold import time is reported: the headless entry points,
+# every operator module and the one GUI with a heavy dependency, along
+# with which of the optional dependencies each one pulls in at import.
+IMPORT_MODULES = ['Batch', 'Core.Operators', 'Core.Pipeline'] + \
+    sorted({module for module, _, _ in OPERATORS.values()}) + ['Histogram.HistogramGUI']
+HEAVY_DEPENDENCIES = ('cv2', 'matplotlib')
+
+# Benchmarks of the generic apply_filter with fixed kernels, one per
+# strategy that the 3x3 high-pass and low-pass wrappers never reach: a
+# 15x15 box is rank-1 and runs as two 1-D passes, and a full-rank 15x15
+# kernel is past FFT_KERNEL_SIZE and runs through the FFT. Grayscale input.
+FILTER_BENCHMARKS = {
+    'filter-separable': np.ones((15, 15)) / 225,
+    'filter-fft': np.random.default_rng(0).random((15, 15)) / 112.5,
+}
+
+
+def parse_sizes(text):
+    try:
+        return [float(size) for size in text.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected comma-separated megapixel counts, got '{text}'")
+
+
+def resize_to(image, megapixels):
+    # Keep the aspect ratio of the asset and hit the pixel count as closely as possible.
+    scale = (megapixels * 1e6 / (image.width * image.height)) ** 0.5
+    size = (max(round(image.width * scale), 1), max(round(image.height * scale), 1))
+    return image.resize(size, Image.BICUBIC)
+
+
+def _runner(name, image):
+    if name in FILTER_BENCHMARKS:
+        from Filtering.Filter import apply_filter
+        return lambda: apply_filter(image, FILTER_BENCHMARKS[name])
+    return lambda: apply_operator(name, image)
+
+
+def time_operator(name, image, repeats):
+    """
+    Best wall time over `repeats` runs after an untimed warm-up (which pays
+    for imports and first-call setup), then one extra run under tracemalloc
+    for the peak of Python and NumPy allocations (OpenCV's own buffers are
+    not traced). The statistics and result caches are cleared before every
+    run so each one computes from scratch.
+    """
+    run = _runner(name, image)
+    run()
+
+    best = float('inf')
+    for _ in range(repeats):
+        clear_cache()
+        RESULTS.clear()
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+
+    clear_cache()
+    RESULTS.clear()
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def import_times(modules):
+    """
+    Import each module in a fresh interpreter and return its import time in
+    seconds and the heavy dependencies it loaded, or None if it failed.
+    """
+    times = {}
+    for module in modules:
+        code = (f"import sys, time; start = time.perf_counter(); import {module}; "
+                f"print(time.perf_counter() - start, *[name for name in {HEAVY_DEPENDENCIES!r} if name in sys.modules])")
+        completed = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"{'import ' + module:<48} FAILED ({completed.stderr.strip().splitlines()[-1]})", file=sys.stderr)
+            times[module] = None
+            continue
+        seconds, *loaded = completed.stdout.split()
+        times[module] = {'seconds': float(seconds), 'loads': loaded}
+        print(f"{'import ' + module:<48} {float(seconds) * 1000:10.1f} ms   {' '.join(loaded)}")
+    return times
+
+
+def run_benchmarks(image_paths, operators, sizes, repeats, budget):
+    results = {}
+    for image_path in image_paths:
+        asset = os.path.splitext(os.path.basename(image_path))[0]
+        source = Image.open(image_path)
+        source.load()
+        source = source.convert('RGB')
+
+        slow = set()
+        for megapixels in sizes:
+            color = resize_to(source, megapixels)
+            gray = ImageOps.grayscale(color)
+            pixels = color.width * color.height
+
+            for name in operators:
+                key = f"{asset}/{name}@{megapixels:g}MP"
+                if name in slow:
+                    print(f"{key:<48} skipped (over the {budget:g} s budget at a smaller size)")
+                    continue
+
+                # Grayscale operators get their input pre-converted, so only the operator is timed.
+                image = gray if name in FILTER_BENCHMARKS or OPERATORS[name][2] == 'L' else color
+                try:
+                    seconds, peak = time_operator(name, image, repeats)
+                except Exception as error:
+                    print(f"{key:<48} FAILED ({error})", file=sys.stderr)
+                    continue
+                if budget and seconds > budget:
+                    slow.add(name)
+
+                results[key] = {
+                    'image': os.path.basename(image_path),
+                    'operator': name,
+                    'megapixels': pixels / 1e6,
+                    'seconds': seconds,
+                    'mp_per_s': pixels / 1e6 / seconds,
+                    'peak_bytes': peak,
+                }
+                print(f"{key:<48} {seconds * 1000:10.1f} ms {pixels / 1e6 / seconds:10.2f} MP/s "
+                      f"{peak / 2 ** 20:10.1f} MiB peak")
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the throughput change of every benchmark also in `baseline` and
+    return the keys that slowed down by more than `threshold` percent.
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        before = baseline[key]['mp_per_s']
+        change = (result['mp_per_s'] - before) / before * 100
+        regressed = change < -threshold
+        if regressed:
+            regressions.append(key)
+        print(f"{key:<48} {before:10.2f} -> {result['mp_per_s']:10.2f} MP/s {change:+8.1f}%"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def run_differential(operators, tolerance):
+    """
+    Check every operator's fast backend against its reference loop on small
+    random and bundled images. Returns the operators whose outputs differ by
+    more than `tolerance` grey levels.
+    """
+    images = differential_images(sorted(glob.glob(ASSETS)))
+    mismatches = []
+    for name in operators:
+        try:
+            report = differential(name, images)
+        except Exception as error:
+            print(f"{name:<20} FAILED ({error})", file=sys.stderr)
+            mismatches.append(name)
+            continue
+        difference = max(difference for _, difference, _ in report)
+        speedups = sorted(speedup for _, _, speedup in report)
+        if difference > tolerance:
+            mismatches.append(name)
+        worst = [label for label, image_difference, _ in report if image_difference == difference]
+        print(f"{name:<20} max diff {difference:6g} (on {worst[0]}) {speedups[len(speedups) // 2]:10.1f}x faster"
+              f"{'  MISMATCH' if difference > tolerance else ''}")
+    return mismatches
+
+
+def filter_method_kernels(seed=0):
+    # Odd and even, rank-1 and full-rank kernels on both sides of FFT_KERNEL_SIZE.
+    rng = np.random.default_rng(seed)
+    return {
+        '3x3': rng.random((3, 3)),
+        '4x4 box': np.ones((4, 4)),
+        '6x9 rank-1': np.outer(rng.random(6), rng.random(9)),
+        '12x12': rng.random((12, 12)),
+        '13x13': rng.random((13, 13)),
+        '11x14': rng.random((11, 14)),
+    }
+
+
+def run_filter_methods(tolerance, seed=0):
+    """
+    Check that the direct, separable and FFT correlation strategies agree,
+    so the result of apply_filter does not change when method='auto' picks
+    a different one. Returns the kernels on which they differ by more than
+    `tolerance`.
+    """
+    from Filtering.Filter import _separable_factors, correlate
+    rng = np.random.default_rng(seed)
+    images = {'gray': rng.random((64, 70)) * 255, 'rgb': rng.random((40, 50, 3)) * 255}
+    mismatches = []
+    for label, kernel in filter_method_kernels(seed).items():
+        methods = ['fft'] + (['separable'] if _separable_factors(kernel) is not None else [])
+        difference = max(float(np.abs(correlate(image, kernel, method) - correlate(image, kernel, 'direct')).max())
+                         for image in images.values() for method in methods)
+        if difference > tolerance:
+            mismatches.append(f"filter {label}")
+        print(f"{'filter ' + label:<20} max diff {difference:6.2g} ({', '.join(methods)} vs direct)"
+              f"{'  MISMATCH' if difference > tolerance else ''}")
+    return mismatches
+
+
+def run_statistics_inputs(seed=0):
+    """
+    Check that image statistics accept pixels that are not uint8 (float and
+    32-bit arrays, PIL 'F' and 'I' images), counting them at the 8-bit
+    level they clip to, and that calculate_threshold keeps their exact
+    mean. Returns the inputs on which either check fails.
+    """
+    from Core.Statistics import image_statistics
+    from Segmentation.Segmentation import calculate_threshold
+    values = np.random.default_rng(seed).random((48, 64)) * 300 - 20
+    inputs = {
+        'float64': values,
+        'int32': values.astype(np.int32),
+        "PIL 'F'": Image.fromarray(values.astype(np.float32)),
+        "PIL 'I'": Image.fromarray(values.astype(np.int32)),
+    }
+    mismatches = []
+    for label, image in inputs.items():
+        pixels = np.asarray(image)
+        expected = np.bincount(np.clip(pixels, 0, 255).astype(np.uint8).reshape(-1), minlength=256)
+        try:
+            counted = np.array_equal(image_statistics(image).histogram, expected)
+            exact = bool(np.isclose(calculate_threshold(image), pixels.mean()))
+        except Exception as error:
+            print(f"{'statistics ' + label:<20} FAILED ({error})", file=sys.stderr)
+            mismatches.append(f"statistics {label}")
+            continue
+        if not (counted and exact):
+            mismatches.append(f"statistics {label}")
+        print(f"{'statistics ' + label:<20} histogram {'ok' if counted else 'WRONG'}, "
+              f"mean threshold {'ok' if exact else 'WRONG'}")
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time every toolkit operator over a range of image sizes.")
+    parser.add_argument('-i', '--images', nargs='+', default=None,
+                        help="source assets (default: every JPEG in Img/, as --differential uses)")
+    parser.add_argument('-s', '--sizes', type=parse_sizes, default=list(DEFAULT_SIZES),
+                        help="comma-separated sizes in megapixels (default: 0.25,1,4,16)")
+    parser.add_argument('-p', '--operators', nargs='+', choices=list(OPERATORS) + list(FILTER_BENCHMARKS),
+                        default=list(OPERATORS) + list(FILTER_BENCHMARKS),
+                        metavar='OPERATOR', help="operators to time, plus apply_filter's separable and FFT "
+                        f"paths as {' and '.join(FILTER_BENCHMARKS)} (default: all)")
+    parser.add_argument('-r', '--repeats', type=int, default=3, help="runs per benchmark, best is kept (default: 3)")
+    parser.add_argument('-b', '--budget', type=float, default=60.0,
+                        help="skip larger sizes of an operator once a run takes longer than this many "
+                             "seconds, 0 to never skip (default: 60)")
+    parser.add_argument('-o', '--output', help="write the results to this JSON file")
+    parser.add_argument('-c', '--compare', metavar='BASELINE', help="JSON results to compare against")
+    parser.add_argument('-t', '--threshold', type=float, default=10.0,
+                        help="throughput drop in percent that counts as a regression (default: 10)")
+    parser.add_argument('--no-imports', action='store_true', help="skip the import time report")
+    parser.add_argument('-d', '--differential', action='store_true',
+                        help="instead of timing, compare each fast backend with its reference loop")
+    parser.add_argument('--tolerance', type=float, default=1.0,
+                        help="largest pixel difference --differential accepts (default: 1)")
+    args = parser.parse_args(argv)
+
+    if args.differential:
+        mismatches = run_differential([name for name in args.operators if name in OPERATORS], args.tolerance)
+        if {'high-pass', 'low-pass', *FILTER_BENCHMARKS} & set(args.operators):
+            mismatches += run_filter_methods(args.tolerance)
+        if any(name.endswith('-threshold') for name in args.operators):
+            mismatches += run_statistics_inputs()
+        if mismatches:
+            print(f"{len(mismatches)} operator(s) differ from their reference: {', '.join(mismatches)}")
+            return 1
+        return 0
+
+    imports = {} if args.no_imports else import_times(IMPORT_MODULES)
+    if imports:
+        print()
+    images = args.images or sorted(glob.glob(ASSETS))
+    results = run_benchmarks(images, args.operators, args.sizes, args.repeats, args.budget)
+
+    if args.output:
+        report = {
+            'images': [os.path.basename(image) for image in images],
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'imports': imports,
+            # Dependencies deferred until an operator first used them, and how long that took.
+            'deferred_imports': dict(LOAD_TIMES),
+            'results': results,
+        }
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+        print()
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:g}%: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
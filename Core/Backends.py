@@ -0,0 +1,149 @@
+import functools
+import importlib
+import os
+import time
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from Core.Operators import OPERATORS
+
+# The backend operators run with unless a call asks for another one. It
+# starts as IMAGE_TOOLKIT_BACKEND if that is set.
+BACKEND_ENV = 'IMAGE_TOOLKIT_BACKEND'
+FAST = 'fast'
+REFERENCE = 'reference'
+
+# Operator -> backend -> (module, function). 'fast' is the operator's public
+# function in its feature module, 'reference' the per-pixel loop in
+# Core.Reference it has to reproduce. Register more with register_backend().
+_FUNCTIONS = {
+    'filter': ('Filtering.Filter', 'apply_filter'),
+    'high-pass': ('Filtering.Filter', 'high_pass_filter'),
+    'low-pass': ('Filtering.Filter', 'low_pass_filter'),
+    'median': ('Filtering.Filter', 'median_filter_function'),
+    'manual-threshold': ('Segmentation.Segmentation', 'manual_threshold'),
+    'peak-threshold': ('Segmentation.Segmentation', 'histogram_peak_threshold'),
+    'valley-threshold': ('Segmentation.Segmentation', 'histogram_valley_threshold'),
+    'otsu-threshold': ('Segmentation.Segmentation', 'otsu_threshold'),
+    'adaptive-threshold': ('Segmentation.Segmentation', 'adaptive_histogram_threshold'),
+    'equalize': ('Histogram.Histogram', 'histogram_equalization'),
+    'clahe': ('Histogram.Histogram', 'clahe'),
+    'simple-halftone': ('Halftoning.Halftoning', 'apply_simple_halftone'),
+    'advanced-halftone': ('Halftoning.Halftoning', 'apply_advanced_halftone'),
+    'ordered-dither': ('Halftoning.Halftoning', 'apply_ordered_dither'),
+    'add': ('ImageOperations.ImageOperations', 'add_images'),
+    'subtract': ('ImageOperations.ImageOperations', 'subtract_images'),
+    'absdiff': ('ImageOperations.ImageOperations', 'absdiff_images'),
+    'multiply': ('ImageOperations.ImageOperations', 'multiply_images'),
+    'blend': ('ImageOperations.ImageOperations', 'blend_images'),
+    'invert': ('ImageOperations.ImageOperations', 'invert_image'),
+    'sobel': ('SimpleEdgeDetection.EdgeDetection', 'sobel_operator'),
+    'prewitt': ('SimpleEdgeDetection.EdgeDetection', 'prewitt_operator'),
+    'kirsch': ('SimpleEdgeDetection.EdgeDetection', 'kirsch_compass_masks'),
+    'contrast-edge': ('AdvancedEdgeDetection.EdgeDetection', 'contrast_based_edge'),
+    'dog': ('AdvancedEdgeDetection.EdgeDetection', 'difference_of_gaussians'),
+    'homogeneity': ('AdvancedEdgeDetection.EdgeDetection2', 'homogeneity_operator'),
+    'difference': ('AdvancedEdgeDetection.EdgeDetection2', 'difference_operator'),
+    'variance': ('AdvancedEdgeDetection.EdgeDetection2', 'variance_operator'),
+    'range': ('AdvancedEdgeDetection.EdgeDetection2', 'range_operator'),
+}
+BACKENDS = {name: {FAST: (module, function), REFERENCE: ('Core.Reference', function)}
+            for name, (module, function) in _FUNCTIONS.items()}
+
+_backend = os.environ.get(BACKEND_ENV, FAST)
+
+
+def set_backend(name):
+    """
+    Select the backend every switchable operator uses by default. Operators
+    without that backend keep running their fast implementation.
+    """
+    global _backend
+    _backend = name
+
+
+def get_backend():
+    return _backend
+
+
+def register_backend(operator, backend, module, function):
+    BACKENDS.setdefault(operator, {})[backend] = (module, function)
+
+
+def load_backend(operator, backend):
+    if backend not in BACKENDS.get(operator, {}):
+        raise ValueError(f"Operator '{operator}' has no '{backend}' backend")
+    module_name, function_name = BACKENDS[operator][backend]
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def switchable(operator):
+    """
+    Let calls to the decorated fast implementation of `operator` run another
+    registered backend instead, chosen per call with a `backend=` keyword or
+    globally with set_backend().
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, backend=None, **kwargs):
+            if backend is None:
+                # The global choice falls back to fast where it has no implementation.
+                backend = _backend if _backend in BACKENDS.get(operator, {}) else FAST
+            if backend == FAST:
+                return function(*args, **kwargs)
+            return load_backend(operator, backend)(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _first_image(result):
+    return result[0] if isinstance(result, tuple) else result
+
+
+def differential(operator, images, backends=(REFERENCE, FAST), **params):
+    """
+    Run `operator` on every image with two backends and compare them.
+    Returns a list of (label, maximum absolute pixel difference, speedup of
+    the second backend over the first) per image.
+    """
+    function = load_backend(operator, FAST)
+    grayscale = operator not in OPERATORS or OPERATORS[operator][2] == 'L'
+
+    report = []
+    for label, image in images:
+        if grayscale and image.mode != 'L':
+            image = ImageOps.grayscale(image)
+        outputs, seconds = [], []
+        for backend in backends:
+            start = time.perf_counter()
+            outputs.append(np.asarray(_first_image(function(image, backend=backend, **params)), dtype=np.float64))
+            seconds.append(time.perf_counter() - start)
+
+        if outputs[0].shape != outputs[1].shape:
+            difference = float('inf')
+        else:
+            difference = float(np.max(np.abs(outputs[0] - outputs[1]), initial=0))
+        report.append((label, difference, seconds[0] / max(seconds[1], 1e-9)))
+    return report
+
+
+def differential_images(paths=(), size=(96, 72), seed=0):
+    """
+    Small test images for differential runs: random noise, a gradient and
+    flat images that exercise the edge cases, plus each bundled asset in
+    `paths` shrunk to `size`.
+    """
+    width, height = size
+    rng = np.random.default_rng(seed)
+    images = [
+        ('random', Image.fromarray(rng.integers(0, 256, (height, width), dtype=np.uint8))),
+        ('random-rgb', Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))),
+        ('gradient', Image.fromarray(np.tile(np.linspace(0, 255, width).astype(np.uint8), (height, 1)))),
+        ('flat', Image.fromarray(np.full((height, width), 128, dtype=np.uint8))),
+    ]
+    for path in paths:
+        asset = Image.open(path).convert('RGB')
+        asset.thumbnail(size, Image.BICUBIC)
+        images.append((os.path.basename(path), asset))
+    return images
@@ -0,0 +1,258 @@
+import functools
+import hashlib
+import inspect
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from Core.Fingerprint import fingerprint
+
+# Bytes of operator results kept in memory (0 turns the cache off), and a
+# directory that also keeps them on disk across runs and processes. The
+# cache is off unless one of these is set or the GUI enables it: hashing
+# every input and copying every result only pays off when the same image
+# is processed again, which one-shot callers like Batch never do.
+CACHE_BYTES_ENV = 'IMAGE_TOOLKIT_CACHE_BYTES'
+CACHE_DIR_ENV = 'IMAGE_TOOLKIT_CACHE_DIR'
+DEFAULT_CACHE_BYTES = 256 * 2 ** 20
+
+# Bytes per pixel PIL stores for each mode; the rest use four.
+_BYTES_PER_PIXEL = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2}
+
+
+def result_bytes(result):
+    """
+    Approximate memory held by an operator result: images and arrays, alone
+    or in a tuple, list or dict.
+    """
+    if isinstance(result, Image.Image):
+        return result.width * result.height * _BYTES_PER_PIXEL.get(result.mode, 4)
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if isinstance(result, (tuple, list)):
+        return sum(result_bytes(item) for item in result)
+    if isinstance(result, dict):
+        return sum(result_bytes(item) for item in result.values())
+    return 0
+
+
+def _describe(value):
+    # Stable text for a key: images and arrays by content, anything else by repr.
+    if isinstance(value, Image.Image):
+        palette = value.getpalette() if value.mode in ('P', 'PA') else None
+        if palette is not None:
+            return f"{value.mode}:{fingerprint(np.asarray(value))}:{fingerprint(np.asarray(palette, dtype=np.uint8))}"
+        return f"{value.mode}:{fingerprint(np.asarray(value))}"
+    if isinstance(value, np.ndarray):
+        return fingerprint(value)
+    if isinstance(value, (tuple, list)):
+        return f"({','.join(_describe(item) for item in value)})"
+    return repr(value)
+
+
+def cache_key(operator, arguments):
+    text = '|'.join([operator] + [f"{name}={_describe(value)}" for name, value in arguments.items()])
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def _copy(result):
+    # A copy of every image and array in a result, so neither the caller
+    # nor the cache sees the other's in-place changes.
+    if isinstance(result, Image.Image):
+        return result.copy()
+    if isinstance(result, np.ndarray):
+        return result.copy()
+    if isinstance(result, tuple):
+        return tuple(_copy(item) for item in result)
+    if isinstance(result, list):
+        return [_copy(item) for item in result]
+    if isinstance(result, dict):
+        return {name: _copy(item) for name, item in result.items()}
+    return result
+
+
+def _leaves(result):
+    # (name, image or array) for every part of a result, or None if a part
+    # cannot be written as an .npy file.
+    if isinstance(result, (Image.Image, np.ndarray)):
+        return [('result', result)]
+    if isinstance(result, tuple):
+        items = [(f"item-{index}", item) for index, item in enumerate(result)]
+    elif isinstance(result, dict) and all(isinstance(name, str) for name in result):
+        items = [(f"key-{name}", item) for name, item in result.items()]
+    else:
+        return None
+    if not all(isinstance(item, (Image.Image, np.ndarray)) for _, item in items):
+        return None
+    return items
+
+
+class ResultCache:
+    """
+    Operator results by input fingerprint, operator name and parameters.
+    Keeps the most recently used results in memory up to `max_bytes`, and
+    with a `directory` also writes every result there as .npy files that
+    later runs read back on a memory miss. Results are copied on the way
+    in and out, so callers may modify what they get.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.bytes = 0
+        self.hits = self.disk_hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 or self.directory is not None
+
+    def get(self, key):
+        """
+        The cached result for `key`, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _copy(entry[0])
+
+        result = self._read(key) if self.directory else None
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._remember(key, result)
+        return _copy(result)
+
+    def put(self, key, result):
+        self._remember(key, _copy(result))
+        if self.directory:
+            self._write(key, result)
+
+    def _remember(self, key, result):
+        size = result_bytes(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (result, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def _write(self, key, result):
+        leaves = _leaves(result)
+        if leaves is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, key)
+        if os.path.isdir(path):
+            return
+        # Written next to the final path and renamed, so readers in other
+        # processes never see an entry with only some of its files.
+        staging = tempfile.mkdtemp(dir=self.directory, prefix=f".{key}-")
+        try:
+            for name, item in leaves:
+                kind = 'image' if isinstance(item, Image.Image) else 'array'
+                np.save(os.path.join(staging, f"{name}.{kind}.npy"), np.asarray(item))
+            os.rename(staging, path)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def _read(self, key):
+        path = os.path.join(self.directory, key)
+        try:
+            files = os.listdir(path)
+            leaves = {}
+            for file in files:
+                name, kind, _ = file.rsplit('.', 2)
+                item = np.load(os.path.join(path, file))
+                leaves[name] = Image.fromarray(item) if kind == 'image' else item
+        except (OSError, ValueError):
+            return None
+
+        if 'result' in leaves:
+            return leaves['result']
+        if all(name.startswith('item-') for name in leaves):
+            return tuple(leaves[f"item-{index}"] for index in range(len(leaves)))
+        return {name[len('key-'):]: item for name, item in leaves.items()}
+
+    def clear(self, disk=False):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+        if disk and self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+# Set while a cached operator runs, so the cached operators it calls in turn
+# compute directly instead of storing the same result under a second key.
+_active = threading.local()
+
+RESULTS = ResultCache(int(os.environ.get(CACHE_BYTES_ENV, 0)), os.environ.get(CACHE_DIR_ENV) or None)
+
+
+def enable_cache(max_bytes=DEFAULT_CACHE_BYTES):
+    """
+    Keep up to `max_bytes` of results in memory, for interactive sessions
+    that apply operators to the same image again and again. A size set
+    through IMAGE_TOOLKIT_CACHE_BYTES takes precedence.
+    """
+    if CACHE_BYTES_ENV not in os.environ:
+        RESULTS.max_bytes = max_bytes
+
+
+def cached(operator):
+    """
+    Serve repeated calls of the decorated operator with the same input
+    pixels and parameters from RESULTS instead of recomputing them. Only
+    the outermost cached call is looked up and stored.
+    """
+    def decorate(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not RESULTS.enabled or getattr(_active, 'running', False):
+                return function(*args, **kwargs)
+            # Defaults are filled in so passing one explicitly hits the same entry.
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            key = cache_key(operator, arguments.arguments)
+            result = RESULTS.get(key)
+            if result is None:
+                _active.running = True
+                try:
+                    result = function(*args, **kwargs)
+                finally:
+                    _active.running = False
+                RESULTS.put(key, result)
+            return result
+        return wrapper
+    return decorate
@@ -0,0 +1,15 @@
+import hashlib
+
+import numpy as np
+
+
+def fingerprint(array):
+    """
+    Content hash of an image buffer: its shape, dtype and every byte of data.
+    Two arrays with the same fingerprint hold the same pixels.
+    """
+    array = np.ascontiguousarray(array)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{array.shape}{array.dtype.str}".encode())
+    digest.update(memoryview(array).cast('B'))
+    return digest.hexdigest()
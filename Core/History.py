@@ -0,0 +1,227 @@
+import os
+import zlib
+
+import numpy as np
+from PIL import Image
+
+# Bytes of compressed frames a history keeps before dropping its oldest steps.
+HISTORY_BYTES_ENV = 'IMAGE_TOOLKIT_HISTORY_BYTES'
+DEFAULT_HISTORY_BYTES = 128 * 2 ** 20
+
+# Every this many steps a frame is stored whole rather than as a delta, so
+# reaching any step replays at most this many deltas.
+KEYFRAME_INTERVAL = 8
+
+# Compression level of zlib frames: the fastest, since frames are written
+# on every operation and most of their size goes away at any level.
+ZLIB_LEVEL = 1
+
+# Modes whose frames can be stored as a byte difference from their parent.
+DELTA_MODES = ('L', 'RGB', 'RGBA')
+
+
+def _is_binary(image, array):
+    if image.mode == '1':
+        return True
+    return image.mode == 'L' and not np.any((array != 0) & (array != 255))
+
+
+class Frame:
+    """
+    One image of a history in compressed form. Two-level images (mode '1'
+    or black and white 'L') are bit-packed. Anything else is zlib-compressed,
+    either whole or, given a `parent` of the same size and mode, as its
+    wrapping byte difference from the parent, which is mostly zeros after
+    a local operator.
+    """
+
+    def __init__(self, image, parent=None, keyframe=False):
+        array = np.asarray(image)
+        self.mode = image.mode
+        self.shape = array.shape
+        self.dtype = array.dtype
+
+        if _is_binary(image, array):
+            self.kind = 'bits'
+            self.data = np.packbits(array.reshape(-1) != 0).tobytes()
+        elif (not keyframe and parent is not None and parent.mode == image.mode and
+              image.mode in DELTA_MODES and parent.size == image.size):
+            self.kind = 'delta'
+            # uint8 subtraction wraps around, so the difference is exact.
+            self.data = zlib.compress(array - np.asarray(parent), ZLIB_LEVEL)
+        else:
+            self.kind = 'whole'
+            self.data = zlib.compress(np.ascontiguousarray(array), ZLIB_LEVEL)
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+    @property
+    def is_delta(self):
+        return self.kind == 'delta'
+
+    def _array(self):
+        if self.kind == 'bits':
+            count = int(np.prod(self.shape))
+            return np.unpackbits(np.frombuffer(self.data, dtype=np.uint8), count=count).reshape(self.shape)
+        return np.frombuffer(zlib.decompress(self.data), dtype=self.dtype).reshape(self.shape)
+
+    def decode(self, parent=None):
+        """
+        The image, given the decoded parent frame if this one is a delta.
+        """
+        array = self._array()
+        if self.kind == 'bits':
+            return Image.fromarray(array.astype(bool) if self.mode == '1' else array * np.uint8(255))
+        if self.kind == 'delta':
+            array = np.asarray(parent) + array
+        return Image.fromarray(array)
+
+    def revert(self, image):
+        """
+        The parent of this delta frame, given the decoded frame itself.
+        """
+        return Image.fromarray(np.asarray(image) - self._array())
+
+
+class Step:
+    """
+    An operation applied in a history: the operator and its parameters,
+    how to show its result, and its preview and full-resolution frames.
+    The full-resolution frame is None until it has been computed.
+    """
+
+    def __init__(self, function, params, select, on_preview):
+        self.function = function
+        self.params = params
+        self.select = select
+        self.on_preview = on_preview
+        self.preview = None
+        self.full = None
+
+    def apply(self, image, mode, **params):
+        # Results feed the next operation in the mode of the original input.
+        if image.mode != mode:
+            image = image.convert(mode)
+        return self.select(self.function(image, **(params or self.params)))
+
+
+def replay(base, steps, index, which):
+    """
+    Decode the `which` ('preview' or 'full') frame at `index` by applying
+    deltas forward from the nearest whole frame. Index 0 is `base`, index i
+    the result of steps[i - 1]. Returns None if a frame on the way has not
+    been computed.
+    """
+    start = index
+    while start > 0:
+        frame = getattr(steps[start - 1], which)
+        if frame is None:
+            return None
+        if not frame.is_delta:
+            break
+        start -= 1
+    image = base if start == 0 else getattr(steps[start - 1], which).decode()
+    for position in range(start + 1, index + 1):
+        image = getattr(steps[position - 1], which).decode(image)
+    return image
+
+
+class History:
+    """
+    Undo and redo over a chain of operations that starts at `base`, a
+    (preview, full-resolution) pair of images. Only the frames at the
+    current position are kept decoded. Once the compressed frames exceed
+    `max_bytes`, the oldest steps are dropped and the next one becomes the
+    new base.
+    """
+
+    def __init__(self, base_preview, base_full, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(os.environ.get(HISTORY_BYTES_ENV, DEFAULT_HISTORY_BYTES))
+        self.max_bytes = max_bytes
+        self.base = {'preview': base_preview, 'full': base_full}
+        self.steps = []
+        self.index = 0
+        self.current = dict(self.base)
+
+    @property
+    def bytes(self):
+        return sum(step.preview.nbytes + (step.full.nbytes if step.full is not None else 0) for step in self.steps)
+
+    @property
+    def can_undo(self):
+        return self.index > 0
+
+    @property
+    def can_redo(self):
+        return self.index < len(self.steps)
+
+    @property
+    def step(self):
+        return self.steps[self.index - 1] if self.index else None
+
+    def push(self, step, preview):
+        """
+        Add `step`, whose decoded preview frame is `preview`, after the
+        current position, discarding any steps that were undone.
+        """
+        del self.steps[self.index:]
+        self.steps.append(step)
+        self.index += 1
+        self.current = {'preview': preview, 'full': None}
+        self.trim()
+
+    def set_full(self, step, frame, image=None):
+        """
+        Record the full-resolution frame of `step`, and its decoded `image`
+        if `step` is at the current position.
+        """
+        if step not in self.steps:
+            return
+        step.full = frame
+        if image is not None and step is self.step:
+            self.current['full'] = image
+        self.trim()
+
+    def move(self, index):
+        """
+        Make `index` the current position and decode its frames.
+        """
+        for which in ('preview', 'full'):
+            self.current[which] = self._decode_near(index, which)
+        self.index = index
+
+    def _decode_near(self, index, which):
+        # A neighbouring delta frame is applied to, or reverted from, the
+        # current frame instead of replaying from the last whole one.
+        current = self.current[which]
+        if current is not None and index == self.index - 1:
+            frame = getattr(self.steps[self.index - 1], which)
+            if frame is not None and frame.is_delta:
+                return frame.revert(current)
+        if current is not None and index == self.index + 1:
+            frame = getattr(self.steps[index - 1], which)
+            if frame is not None and frame.is_delta:
+                return frame.decode(current)
+        return replay(self.base[which], self.steps, index, which)
+
+    def full_plan(self):
+        """
+        What the current full-resolution frame is computed from: the last
+        position at or before it with a full frame, and the steps to apply
+        from there.
+        """
+        start = self.index
+        while start > 0 and self.steps[start - 1].full is None:
+            start -= 1
+        return start, self.steps[start:self.index]
+
+    def trim(self):
+        # The oldest step can only become the base once its full-resolution
+        # frame exists, and the current position is never dropped.
+        while self.bytes > self.max_bytes and self.index > 1 and self.steps[0].full is not None:
+            self.base = {which: replay(self.base[which], self.steps, 1, which) for which in ('preview', 'full')}
+            del self.steps[0]
+            self.index -= 1
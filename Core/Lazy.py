@@ -0,0 +1,46 @@
+import importlib
+import threading
+import time
+
+# Module name -> seconds its deferred import took, for the modules loaded so far.
+LOAD_TIMES = {}
+_lock = threading.Lock()
+
+
+class LazyModule:
+    """
+    Stands in for a module until one of its attributes is used, then
+    imports it. Attributes are cached on the proxy after the first lookup,
+    so later accesses cost the same as on the module itself.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        with _lock:
+            if self._module is None:
+                start = time.perf_counter()
+                self._module = importlib.import_module(self._name)
+                LOAD_TIMES[self._name] = time.perf_counter() - start
+        return self._module
+
+    def __getattr__(self, attribute):
+        value = getattr(self._module or self._load(), attribute)
+        setattr(self, attribute, value)
+        return value
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name):
+    """
+    Import `name` on first use instead of now. For the large optional
+    dependencies (OpenCV, matplotlib) that only some operators need:
+
+        cv2 = lazy_import('cv2')
+    """
+    return LazyModule(name)
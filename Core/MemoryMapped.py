@@ -0,0 +1,243 @@
+import importlib
+import os
+import struct
+
+import numpy as np
+from PIL import Image
+
+from Core.Tiling import TILE_OPERATORS, run_tiled_function
+
+# Extensions open_array and create_array can map without decoding.
+MAPPABLE_EXTENSIONS = ('.npy', '.raw', '.pgm', '.tif', '.tiff')
+
+_TIFF_TYPES = {3: 'H', 4: 'I', 16: 'Q'}  # SHORT, LONG, LONG8
+_TIFF_TAGS = {
+    'width': 256, 'height': 257, 'bits': 258, 'compression': 259, 'photometric': 262,
+    'strip_offsets': 273, 'samples': 277, 'rows_per_strip': 278, 'strip_byte_counts': 279,
+    'planar': 284, 'sample_format': 339, 'tile_offsets': 324,
+}
+
+
+def _extension(path):
+    return os.path.splitext(path)[1].lower()
+
+
+def _read_pgm_header(file):
+    tokens = []
+    while len(tokens) < 4:
+        line = file.readline()
+        if not line:
+            raise ValueError("Truncated PGM header")
+        tokens.extend(line.split(b'#')[0].split())
+    magic, width, height, maxval = tokens[0], int(tokens[1]), int(tokens[2]), int(tokens[3])
+    if magic != b'P5':
+        raise ValueError("Only binary PGM (P5) files can be memory-mapped")
+    return (height, width), np.dtype(np.uint8 if maxval < 256 else '>u2'), file.tell()
+
+
+def _read_tiff_layout(file):
+    header = file.read(16)
+    order = {b'II': '<', b'MM': '>'}.get(header[:2])
+    if order is None:
+        raise ValueError("Not a TIFF file")
+    version = struct.unpack(order + 'H', header[2:4])[0]
+    if version == 42:
+        ifd_offset = struct.unpack(order + 'I', header[4:8])[0]
+        count_format, entry_format, inline_size = 'H', 'HHI4s', 4
+    elif version == 43:
+        ifd_offset = struct.unpack(order + 'Q', header[8:16])[0]
+        count_format, entry_format, inline_size = 'Q', 'HHQ8s', 8
+    else:
+        raise ValueError("Not a TIFF file")
+
+    file.seek(ifd_offset)
+    count = struct.unpack(order + count_format, file.read(struct.calcsize(count_format)))[0]
+    entry_size = struct.calcsize(order + entry_format)
+    tags = {}
+    for _ in range(count):
+        tag, kind, length, data = struct.unpack(order + entry_format, file.read(entry_size))
+        if kind not in _TIFF_TYPES:
+            continue
+        value_format = order + _TIFF_TYPES[kind] * length
+        size = struct.calcsize(value_format)
+        if size > inline_size:
+            position = file.tell()
+            file.seek(struct.unpack(order + ('I' if inline_size == 4 else 'Q'), data)[0])
+            data = file.read(size)
+            file.seek(position)
+        tags[tag] = struct.unpack(value_format, data[:size])
+
+    def tag(name, default=None):
+        values = tags.get(_TIFF_TAGS[name])
+        return default if values is None else values
+
+    if tag('tile_offsets') is not None:
+        raise ValueError("Tiled TIFF files cannot be memory-mapped")
+    if tag('compression', (1,))[0] != 1:
+        raise ValueError("Compressed TIFF files cannot be memory-mapped")
+    samples = tag('samples', (1,))[0]
+    if samples > 1 and tag('planar', (1,))[0] != 1:
+        raise ValueError("Planar TIFF files cannot be memory-mapped")
+
+    bits = tag('bits', (8,))[0]
+    kind = {1: 'u', 2: 'i', 3: 'f'}[tag('sample_format', (1,))[0]]
+    dtype = np.dtype(f"{order}{kind}{bits // 8}")
+
+    offsets, counts = tag('strip_offsets'), tag('strip_byte_counts')
+    if any(offsets[i] + counts[i] != offsets[i + 1] for i in range(len(offsets) - 1)):
+        raise ValueError("TIFF strips are not contiguous")
+
+    shape = (tag('height')[0], tag('width')[0]) + ((samples,) if samples > 1 else ())
+    return shape, dtype, offsets[0]
+
+
+def open_array(path, mode='r', shape=None, dtype=np.uint8, offset=0):
+    """
+    Memory-map an image file as an ndarray without decoding it into RAM.
+    Supports .npy, binary PGM, uncompressed strip TIFF (classic and BigTIFF)
+    and headerless .raw files, for which `shape`, `dtype` and `offset` give
+    the layout. Raises ValueError for anything that cannot be mapped.
+    """
+    extension = _extension(path)
+    if extension == '.npy':
+        return np.load(path, mmap_mode=mode)
+    if extension == '.raw':
+        if shape is None:
+            raise ValueError("Raw files need an explicit shape")
+        return np.memmap(path, dtype=dtype, mode=mode, offset=offset, shape=shape)
+    if extension not in MAPPABLE_EXTENSIONS:
+        raise ValueError(f"Cannot memory-map '{extension}' files")
+
+    with open(path, 'rb') as file:
+        if extension == '.pgm':
+            shape, dtype, offset = _read_pgm_header(file)
+        else:
+            shape, dtype, offset = _read_tiff_layout(file)
+    return np.memmap(path, dtype=dtype, mode=mode, offset=offset, shape=shape)
+
+
+def _tiff_header(shape, dtype):
+    height, width = shape[:2]
+    samples = shape[2] if len(shape) == 3 else 1
+    data_size = height * width * samples * dtype.itemsize
+    big = data_size > 2 ** 32 - 4096
+
+    entries = [
+        (256, 4, width), (257, 4, height), (258, 3, dtype.itemsize * 8), (259, 3, 1),
+        (262, 3, 2 if samples == 3 else 1), (273, 16 if big else 4, 0), (277, 3, samples),
+        (278, 4, height), (279, 16 if big else 4, data_size), (284, 3, 1),
+        (339, 3, {'u': 1, 'i': 2, 'f': 3}[dtype.kind]),
+    ]
+    if big:
+        header_size = 16 + 8 + 20 * len(entries) + 8
+    else:
+        header_size = 8 + 2 + 12 * len(entries) + 4
+    data_offset = -(-header_size // 16) * 16
+    entries[5] = (273, entries[5][1], data_offset)
+
+    if big:
+        header = b'II' + struct.pack('<HHHQ', 43, 8, 0, 16) + struct.pack('<Q', len(entries))
+        for tag, kind, value in entries:
+            header += struct.pack('<HHQ', tag, kind, 1) + struct.pack('<' + _TIFF_TYPES[kind], value).ljust(8, b'\0')
+        header += struct.pack('<Q', 0)
+    else:
+        header = b'II' + struct.pack('<HI', 42, 8) + struct.pack('<H', len(entries))
+        for tag, kind, value in entries:
+            header += struct.pack('<HHI', tag, kind, 1) + struct.pack('<' + _TIFF_TYPES[kind], value).ljust(4, b'\0')
+        header += struct.pack('<I', 0)
+    return header.ljust(data_offset, b'\0')
+
+
+def create_array(path, shape, dtype=np.uint8):
+    """
+    Create an image file of the given shape and dtype and return it as a
+    writable memory map. .npy, .raw, .pgm (8/16-bit grayscale) and
+    uncompressed TIFF (BigTIFF past 4 GB) are supported.
+    """
+    extension = _extension(path)
+    dtype = np.dtype(dtype)
+    shape = tuple(shape)
+    if extension == '.npy':
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    if extension == '.raw':
+        return np.memmap(path, dtype=dtype, mode='w+', shape=shape)
+
+    if extension == '.pgm':
+        if len(shape) != 2 or dtype not in (np.uint8, np.uint16):
+            raise ValueError("PGM files hold 8 or 16-bit grayscale only")
+        dtype = np.dtype(np.uint8 if dtype == np.uint8 else '>u2')
+        header = b'P5\n%d %d\n%d\n' % (shape[1], shape[0], 255 if dtype == np.uint8 else 65535)
+    elif extension in ('.tif', '.tiff'):
+        if len(shape) == 3 and shape[2] != 3:
+            raise ValueError("TIFF output holds grayscale or RGB only")
+        dtype = dtype.newbyteorder('<') if dtype.itemsize > 1 else dtype
+        header = _tiff_header(shape, dtype)
+    else:
+        raise ValueError(f"Cannot memory-map '{extension}' files")
+
+    with open(path, 'wb') as file:
+        file.write(header)
+        file.truncate(len(header) + int(np.prod(shape)) * dtype.itemsize)
+    return np.memmap(path, dtype=dtype, mode='r+', offset=len(header), shape=shape)
+
+
+def map_bands(function, source, out=None, band_height=1024, halo=0):
+    """
+    Apply an array function to `source` in full-width row bands, reading
+    `halo` extra rows above and below each band, and write into `out`
+    (allocated from the first band if not given). With memory-mapped
+    `source` and `out` only one band is ever in RAM.
+    """
+    return run_tiled_function(function, source, halo, (band_height, source.shape[1]), out)
+
+
+def open_gray(path, shape=None, offset=0):
+    """
+    8-bit grayscale pixels of an image file: memory-mapped when open_array
+    can map the file as such, otherwise decoded by PIL. Raw input needs its
+    (height, width) `shape`; raw and .npy input must already be 8-bit
+    grayscale, since PIL cannot decode them.
+    """
+    extension = _extension(path)
+    try:
+        gray = open_array(path, shape=shape, offset=offset)
+    except ValueError:
+        if extension == '.raw':
+            raise ValueError("Raw input needs its dimensions: pass shape=(height, width)") from None
+        gray = None
+    if gray is not None and (gray.ndim != 2 or gray.dtype != np.uint8):
+        if extension in ('.raw', '.npy'):
+            raise ValueError("Only 8-bit grayscale raw and .npy input can be read")
+        gray = None
+    if gray is None:
+        gray = np.array(Image.open(path).convert('L'))
+    return gray
+
+
+def map_file(function, input_path, output_path, band_height=1024, halo=0, shape=None):
+    """
+    Apply a uint8 array function from `input_path` to `output_path` with
+    map_bands. Mappable input (see open_gray) and output are paged in and
+    written one band at a time; any other output format is assembled in
+    memory and saved by PIL.
+    """
+    source = open_gray(input_path, shape=shape)
+    if _extension(output_path) in MAPPABLE_EXTENSIONS:
+        out = create_array(output_path, source.shape)
+        map_bands(function, source, out, band_height, halo)
+        out.flush()
+    else:
+        Image.fromarray(map_bands(function, source, None, band_height, halo)).save(output_path)
+
+
+def map_operator_file(name, input_path, output_path, band_height=1024, shape=None, **params):
+    """
+    Run operator `name` from TILE_OPERATORS from file to file with map_file,
+    reading the operator's halo around every band, so the output equals
+    the operator applied to the whole image.
+    """
+    if name not in TILE_OPERATORS:
+        raise ValueError(f"Operator '{name}' cannot be run in bands")
+    module_name, function_name, halo_for, _ = TILE_OPERATORS[name]
+    function = getattr(importlib.import_module(module_name), function_name)
+    map_file(lambda band: function(band, **params), input_path, output_path, band_height, halo_for(params), shape)
@@ -0,0 +1,117 @@
+import importlib
+
+import numpy as np
+from PIL import Image
+
+# Stage name -> (module, array function, input dtype, output dtype, accepts out=).
+# An input dtype of None accepts any array. Stages that accept `out` keep the
+# shape of their input and have a fixed output dtype, so the pipeline can hand
+# them a reusable buffer.
+STAGES = {
+    'grayscale': (__name__, 'grayscale_array', np.uint8, np.uint8, False),
+    'astype': (__name__, 'astype_array', None, None, False),
+    'filter': ('Filtering.Filter', 'apply_filter_array', None, np.uint8, True),
+    'high-pass': ('Filtering.Filter', 'high_pass_filter_array', None, np.uint8, True),
+    'low-pass': ('Filtering.Filter', 'low_pass_filter_array', None, np.uint8, True),
+    'median': ('Filtering.Filter', 'median_filter_array', np.uint8, np.uint8, False),
+    'manual-threshold': ('Segmentation.Segmentation', 'manual_threshold_array', None, np.uint8, True),
+    'peak-threshold': ('Segmentation.Segmentation', 'histogram_peak_threshold_array', np.uint8, np.uint8, True),
+    'valley-threshold': ('Segmentation.Segmentation', 'histogram_valley_threshold_array', np.uint8, np.uint8, True),
+    'otsu-threshold': ('Segmentation.Segmentation', 'otsu_threshold_array', np.uint8, np.uint8, True),
+    'adaptive-threshold': ('Segmentation.Segmentation', 'adaptive_histogram_threshold_array', np.uint8, np.uint8, False),
+    'equalize': ('Histogram.Histogram', 'histogram_equalization_array', np.uint8, np.uint8, True),
+    'clahe': ('Histogram.Histogram', 'clahe_array', np.uint8, np.uint8, False),
+    'simple-halftone': ('Halftoning.Halftoning', 'simple_halftone_array', None, np.uint8, False),
+    'advanced-halftone': ('Halftoning.Halftoning', 'advanced_halftone_array', None, np.uint8, True),
+    'ordered-dither': ('Halftoning.Halftoning', 'ordered_dither_array', np.uint8, np.uint8, False),
+    'gradient-magnitude': (__name__, 'gradient_magnitude_array', None, np.float32, False),
+    'threshold-magnitude': ('SimpleEdgeDetection.EdgeDetection', 'threshold_magnitude_array', np.float32, np.uint8, True),
+    'sobel': ('SimpleEdgeDetection.EdgeDetection', 'sobel_operator_array', None, np.uint8, True),
+    'prewitt': ('SimpleEdgeDetection.EdgeDetection', 'prewitt_operator_array', None, np.uint8, True),
+    'kirsch': ('SimpleEdgeDetection.EdgeDetection', 'kirsch_compass_masks_array', np.uint8, np.uint8, True),
+    'homogeneity': ('AdvancedEdgeDetection.EdgeDetection2', 'homogeneity_operator_array', None, np.uint8, False),
+    'difference': ('AdvancedEdgeDetection.EdgeDetection2', 'difference_operator_array', None, np.uint8, False),
+    'variance': ('AdvancedEdgeDetection.EdgeDetection2', 'variance_operator_array', None, np.uint8, False),
+    'range': ('AdvancedEdgeDetection.EdgeDetection2', 'range_operator_array', None, np.uint8, False),
+}
+
+
+def grayscale_array(image):
+    # ITU-R 601-2 luma in the fixed point PIL's convert('L') uses, rounding
+    # like ImageOps.grayscale in the tools and Batch.
+    if image.ndim == 2:
+        return image.copy()
+    luma = image[:, :, 0].astype(np.uint32)
+    luma *= 19595
+    luma += image[:, :, 1] * np.uint32(38470)
+    luma += image[:, :, 2] * np.uint32(7471)
+    luma += 0x8000
+    luma >>= 16
+    return luma.astype(np.uint8)
+
+
+def astype_array(image, dtype):
+    return image.astype(dtype)
+
+
+def gradient_magnitude_array(image, operator='sobel', norm='l2'):
+    from SimpleEdgeDetection.EdgeDetection import compute_gradients
+    return compute_gradients(image, operator, norm).magnitude
+
+
+def _stage_function(name):
+    module_name, function_name = STAGES[name][:2]
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+class Pipeline:
+    """
+    Chain of array operators. Stages pass ndarrays to each other directly,
+    each stage checks the dtype it is given, and stages that accept an `out`
+    buffer write into buffers the pipeline keeps between stages and runs.
+    PIL images are only touched by run_image.
+
+        Pipeline().add('grayscale').add('median', size=5).add('equalize').add('otsu-threshold')
+    """
+
+    def __init__(self):
+        self.stages = []
+        self._buffers = {}
+
+    def add(self, name, **params):
+        if name not in STAGES:
+            raise ValueError(f"Unknown pipeline stage: {name}")
+        self.stages.append((name, params))
+        return self
+
+    def _buffer(self, shape, dtype, in_use):
+        buffers = self._buffers.setdefault((shape, np.dtype(dtype).str), [])
+        for buffer in buffers:
+            if not np.shares_memory(buffer, in_use):
+                return buffer
+        buffer = np.empty(shape, dtype=dtype)
+        buffers.append(buffer)
+        return buffer
+
+    def run(self, array):
+        """
+        Run every stage on `array` and return the result. The input is never
+        written to, and the result is a fresh array that later runs leave alone.
+        """
+        array = np.asarray(array)
+        for index, (name, params) in enumerate(self.stages):
+            input_dtype, output_dtype, accepts_out = STAGES[name][2:]
+            if input_dtype is not None and array.dtype != input_dtype:
+                raise TypeError(f"Stage '{name}' expects {np.dtype(input_dtype)} input, got {array.dtype}; "
+                                f"add an 'astype' stage before it")
+
+            function = _stage_function(name)
+            if accepts_out and index < len(self.stages) - 1:
+                out = self._buffer(array.shape, output_dtype, array)
+                array = function(array, out=out, **params)
+            else:
+                array = function(array, **params)
+        return array
+
+    def run_image(self, image):
+        return Image.fromarray(self.run(np.asarray(image)))
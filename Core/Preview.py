@@ -0,0 +1,24 @@
+import inspect
+
+# Parameters that are lengths in pixels, per operator function, with the
+# smallest value each accepts. On a downscaled proxy they shrink with the
+# image so the preview shows what the full-resolution result will look like.
+SCALED_PARAMETERS = {
+    'adaptive_histogram_threshold': {'window_size': 3},
+    'adaptive_histogram_threshold_array': {'window_size': 3},
+    'median_filter_function': {'size': 3},
+    'median_filter_array': {'size': 3},
+}
+
+
+def scale_parameters(function, scale, params):
+    """
+    `params` for running `function` on an image `scale` times the size of
+    the one they were chosen for. Window sizes are scaled and kept odd;
+    everything else is passed through unchanged.
+    """
+    scaled = dict(params)
+    for name, minimum in SCALED_PARAMETERS.get(function.__name__, {}).items():
+        value = params.get(name, inspect.signature(function).parameters[name].default)
+        scaled[name] = max(minimum, int(round(value * scale)) | 1)
+    return scaled
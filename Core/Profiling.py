@@ -0,0 +1,202 @@
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Setting this to 1 profiles the whole process, 'memory' also tracks
+# allocations. The report goes to PROFILE_OUTPUT_ENV at exit: a *.trace.json
+# path gets Chrome trace events, any other *.json path the JSON report, and
+# without a path the summary table is printed to stderr.
+PROFILE_ENV = 'IMAGE_TOOLKIT_PROFILE'
+PROFILE_OUTPUT_ENV = 'IMAGE_TOOLKIT_PROFILE_OUTPUT'
+
+# The profile calls are recorded into, or None when profiling is off.
+_active = None
+_local = threading.local()
+
+
+def _describe(image):
+    # Shape and dtype of an ndarray, or the equivalent for a PIL image.
+    if hasattr(image, 'shape') and hasattr(image, 'dtype'):
+        return list(image.shape), str(image.dtype)
+    if hasattr(image, 'mode') and hasattr(image, 'getbands'):
+        bands = len(image.getbands())
+        return [image.height, image.width] + ([bands] if bands > 1 else []), image.mode
+    return None, type(image).__name__
+
+
+class Profile:
+    """
+    Calls recorded while profiling is on: one event per operator call with
+    its wall and CPU time, input shape and dtype, thread, nesting depth and,
+    with `memory`, the peak bytes allocated above what was live at entry.
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.events = []
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def call(self, name, function, args, kwargs):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        shape, dtype = _describe(args[0]) if args else (None, None)
+
+        if self.memory:
+            baseline = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, 'reset_peak'):  # Python 3.9+
+                tracemalloc.reset_peak()
+        # Each frame carries the highest absolute peak seen by its children,
+        # since their reset_peak calls hide it from the parent.
+        stack.append(0)
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            child_peak = stack.pop()
+            event = {
+                'name': name,
+                'start': start_wall - self.origin,
+                'wall': wall,
+                'cpu': cpu,
+                'shape': shape,
+                'dtype': dtype,
+                'thread': threading.get_ident(),
+                'depth': len(stack),
+            }
+            if self.memory:
+                peak = max(tracemalloc.get_traced_memory()[1], child_peak)
+                event['bytes'] = max(peak - baseline, 0)
+                if stack:
+                    stack[-1] = max(stack[-1], peak)
+            with self._lock:
+                self.events.append(event)
+
+    def summary(self):
+        """
+        Per-operator totals, slowest first: calls, wall and CPU seconds (nested
+        calls included), and the largest allocation peak of any call.
+        """
+        totals = {}
+        for event in self.events:
+            total = totals.setdefault(event['name'], {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'max_bytes': 0})
+            total['calls'] += 1
+            total['wall'] += event['wall']
+            total['cpu'] += event['cpu']
+            total['max_bytes'] = max(total['max_bytes'], event.get('bytes', 0))
+        return dict(sorted(totals.items(), key=lambda item: item[1]['wall'], reverse=True))
+
+    def format(self):
+        lines = [f"{'operator':<60} {'calls':>7} {'wall ms':>11} {'cpu ms':>11} {'peak MiB':>9}"]
+        for name, total in self.summary().items():
+            lines.append(f"{name:<60} {total['calls']:>7} {total['wall'] * 1000:>11.1f} "
+                         f"{total['cpu'] * 1000:>11.1f} {total['max_bytes'] / 2 ** 20:>9.1f}")
+        return '\n'.join(lines)
+
+    def print(self, file=None):
+        print(self.format(), file=file or sys.stderr)
+
+    def to_json(self, path):
+        with open(path, 'w') as file:
+            json.dump({'summary': self.summary(), 'events': self.events}, file, indent=2)
+
+    def to_chrome_trace(self, path):
+        """
+        Write the calls as Chrome trace events, viewable in chrome://tracing
+        or Perfetto, with nested calls stacked under their callers.
+        """
+        trace = []
+        for event in self.events:
+            arguments = {'shape': event['shape'], 'dtype': event['dtype'], 'cpu_ms': event['cpu'] * 1000}
+            if 'bytes' in event:
+                arguments['bytes'] = event['bytes']
+            trace.append({
+                'name': event['name'], 'cat': 'operator', 'ph': 'X',
+                'ts': event['start'] * 1e6, 'dur': event['wall'] * 1e6,
+                'pid': os.getpid(), 'tid': event['thread'], 'args': arguments,
+            })
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, file)
+
+
+def profiled(function):
+    """
+    Record calls to `function` in the active profile. When profiling is off
+    the wrapper costs a single global lookup per call.
+    """
+    name = f"{function.__module__}.{function.__qualname__}"
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _active is None:
+            return function(*args, **kwargs)
+        return _active.call(name, function, args, kwargs)
+    return wrapper
+
+
+def enable(memory=False):
+    """
+    Start recording into a new Profile and return it.
+    """
+    global _active
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _active = Profile(memory)
+    return _active
+
+
+def disable():
+    global _active
+    profile_, _active = _active, None
+    if profile_ is not None and profile_.memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return profile_
+
+
+@contextmanager
+def profile(memory=False):
+    """
+    Profile the calls made inside the block:
+
+        with profile() as report:
+            pipeline.run(array)
+        report.print()
+    """
+    global _active
+    previous = _active
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _active = Profile(memory or (previous is not None and previous.memory))
+    try:
+        yield _active
+    finally:
+        _active = previous
+        if started_tracing:
+            tracemalloc.stop()
+
+
+def _report_at_exit():
+    if _active is None:
+        return
+    path = os.environ.get(PROFILE_OUTPUT_ENV)
+    if not path:
+        _active.print()
+    elif path.endswith('.trace.json'):
+        _active.to_chrome_trace(path)
+    else:
+        _active.to_json(path)
+
+
+if os.environ.get(PROFILE_ENV, '0').lower() not in ('', '0', 'false', 'off'):
+    enable(memory=os.environ[PROFILE_ENV].lower() == 'memory')
+    atexit.register(_report_at_exit)
@@ -0,0 +1,64 @@
+import threading
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+class Cancelled(Exception):
+    """
+    Raised inside an operator at its next progress report once its task has
+    been cancelled.
+    """
+
+
+class Task:
+    """
+    Progress and cancellation state of one operator run. `callback` is
+    called from the running thread with the completed fraction (0 to 1)
+    whenever it advances by at least a percent.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self._cancelled = threading.Event()
+        self._percent = -1
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def report(self, done, total):
+        if self._cancelled.is_set():
+            raise Cancelled()
+        fraction = done / total if total else 1.0
+        if self.callback is not None and int(fraction * 100) != self._percent:
+            self._percent = int(fraction * 100)
+            self.callback(fraction)
+
+
+@contextmanager
+def running(task):
+    """
+    Make `task` receive the progress reports of everything called on this
+    thread inside the block.
+    """
+    previous = getattr(_local, 'task', None)
+    _local.task = task
+    try:
+        yield task
+    finally:
+        _local.task = previous
+
+
+def report(done, total):
+    """
+    Progress hook for the row and tile loops of the core functions: `done`
+    of `total` steps are finished. Outside a running task this is a no-op;
+    inside a cancelled one it raises Cancelled.
+    """
+    task = getattr(_local, 'task', None)
+    if task is not None:
+        task.report(done, total)
@@ -0,0 +1,493 @@
+"""
+Reference backends: every operator written as a plain per-pixel loop.
+They are slow, and meant to be read as the specification the fast
+implementations in the feature modules have to reproduce. Core.Backends
+runs the two against each other. Masks, kernels and threshold maps are
+taken from the feature modules so both sides share the same data.
+"""
+import numpy as np
+from PIL import Image
+
+from Core.Progress import report
+
+
+def _gray(image, dtype=np.float32):
+    return np.array(image, dtype=dtype)
+
+
+def _correlate_reflect(image, kernel):
+    # Correlation with reflect-101 borders, as cv2.filter2D does by default.
+    kernel = np.asarray(kernel, dtype=np.float64)
+    pad_y, pad_x = kernel.shape[0] // 2, kernel.shape[1] // 2
+    padded_image = np.pad(image.astype(np.float64), ((pad_y, pad_y), (pad_x, pad_x)), mode='reflect')
+    height, width = image.shape
+    result = np.zeros((height, width), dtype=np.float64)
+
+    for i in range(height):
+        for j in range(width):
+            region = padded_image[i:i + kernel.shape[0], j:j + kernel.shape[1]]
+            result[i, j] = np.sum(region * kernel)
+        report(i + 1, height)
+    return result
+
+
+def _threshold_image(np_image, threshold):
+    segmented_image = np.zeros(np_image.shape, dtype=np.uint8)
+    for index, value in np.ndenumerate(np_image):
+        if value > threshold:
+            segmented_image[index] = 255
+    return Image.fromarray(segmented_image)
+
+
+def _histogram(np_image):
+    hist = np.zeros(256)
+    for pixel in np_image.flatten():
+        hist[pixel] += 1
+    return hist
+
+
+# Filtering
+
+def apply_filter(image, kernel, method='auto'):
+    np_image = np.array(image, dtype=np.float32)
+    kernel = np.asarray(kernel, dtype=np.float64)
+    pad_y, pad_x = kernel.shape[0] // 2, kernel.shape[1] // 2
+
+    # Zero padding so the kernel covers the edges.
+    pad_width = [(pad_y, pad_y), (pad_x, pad_x)] + [(0, 0)] * (np_image.ndim - 2)
+    padded_image = np.pad(np_image, pad_width, mode='constant', constant_values=0)
+    result = np.zeros_like(np_image)
+
+    for i in range(np_image.shape[0]):
+        for j in range(np_image.shape[1]):
+            region = padded_image[i:i + kernel.shape[0], j:j + kernel.shape[1]]
+            if np_image.ndim == 3:
+                result[i, j] = np.tensordot(region, kernel, axes=([0, 1], [0, 1]))
+            else:
+                result[i, j] = np.sum(region * kernel)
+        report(i + 1, np_image.shape[0])
+
+    result = np.clip(result, 0, 255)
+    return Image.fromarray(result.astype(np.uint8))
+
+
+def high_pass_filter(image):
+    from Filtering.Filter import HIGH_PASS_MASK
+    return apply_filter(image, HIGH_PASS_MASK)
+
+
+def low_pass_filter(image, mask_type=1):
+    from Filtering.Filter import LOW_PASS_MASKS
+    if mask_type not in LOW_PASS_MASKS:
+        raise ValueError(f"Unknown low-pass mask type: {mask_type}")
+    return apply_filter(image, LOW_PASS_MASKS[mask_type])
+
+
+def median_filter_function(image, size=3, border='reflect'):
+    np_image = np.array(image)
+    padding = size // 2
+    pad_width = [(padding, padding), (padding, padding)] + [(0, 0)] * (np_image.ndim - 2)
+    padded_image = np.pad(np_image, pad_width, mode=border)
+    result = np.zeros_like(np_image)
+
+    for i in range(np_image.shape[0]):
+        for j in range(np_image.shape[1]):
+            neighborhood = padded_image[i:i + size, j:j + size]
+            result[i, j] = np.median(neighborhood.reshape(size * size, -1), axis=0).squeeze()
+        report(i + 1, np_image.shape[0])
+
+    return Image.fromarray(result.astype(np.uint8))
+
+
+# Segmentation
+
+def manual_threshold(image, threshold=128):
+    return _threshold_image(np.array(image), threshold)
+
+
+def histogram_peak_threshold(image):
+    np_image = np.array(image)
+    hist = _histogram(np_image)
+
+    peak = 0
+    max_count = 0
+    for i in range(256):
+        if hist[i] > max_count:
+            max_count = hist[i]
+            peak = i
+
+    return _threshold_image(np_image, peak)
+
+
+def histogram_valley_threshold(image):
+    np_image = np.array(image)
+    hist = _histogram(np_image)
+
+    # Smooth histogram to reduce noise
+    window_size = 5
+    smoothed_hist = np.zeros(256)
+    for i in range(256):
+        start = max(0, i - window_size // 2)
+        end = min(256, i + window_size // 2 + 1)
+        smoothed_hist[i] = np.mean(hist[start:end])
+
+    valleys = []
+    for i in range(1, 255):
+        if smoothed_hist[i - 1] > smoothed_hist[i] < smoothed_hist[i + 1]:
+            valleys.append(i)
+
+    return _threshold_image(np_image, valleys[0] if valleys else 0)
+
+
+def otsu_threshold(image):
+    np_image = np.array(image)
+    hist = _histogram(np_image)
+    total = np.sum(hist)
+    sum_all = np.sum(np.arange(256) * hist)
+
+    best_threshold, best_variance = 0, -1.0
+    weight_background, sum_background = 0.0, 0.0
+    for t in range(256):
+        weight_background += hist[t]
+        sum_background += t * hist[t]
+        weight_foreground = total - weight_background
+        if weight_background == 0 or weight_foreground == 0:
+            continue
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = t, variance
+
+    return _threshold_image(np_image, best_threshold)
+
+
+def adaptive_histogram_threshold(image, window_size=35, offset=-10, method='mean', k=None, r=128):
+    np_image = np.array(image)
+    channels = np_image[:, :, np.newaxis] if np_image.ndim == 2 else np_image
+    height, width = channels.shape[:2]
+    padding = window_size // 2
+    segmented_image = np.zeros_like(channels)
+
+    # Process each channel separately
+    for channel in range(channels.shape[2]):
+        channel_data = channels[:, :, channel]
+        padded_channel = np.pad(channel_data, padding, mode='reflect').astype(np.float64)
+
+        for y in range(height):
+            for x in range(width):
+                window = padded_channel[y:y + window_size, x:x + window_size]
+                mean = np.mean(window)
+                if method == 'mean':
+                    threshold = mean
+                elif method == 'niblack':
+                    threshold = mean + (-0.2 if k is None else k) * np.std(window)
+                elif method == 'sauvola':
+                    threshold = mean * (1 + (0.5 if k is None else k) * (np.std(window) / r - 1))
+                else:
+                    raise ValueError(f"Unknown adaptive threshold method: {method}")
+                # Keep original pixel value if above threshold
+                if channel_data[y, x] > threshold + offset:
+                    segmented_image[y, x, channel] = channel_data[y, x]
+            report(channel * height + y + 1, channels.shape[2] * height)
+
+    return Image.fromarray(segmented_image.reshape(np_image.shape).astype(np.uint8))
+
+
+# Histogram
+
+def histogram_equalization(image):
+    np_image = np.array(image)
+    channels = np_image[:, :, np.newaxis] if np_image.ndim == 2 else np_image
+    height, width = channels.shape[:2]
+    area = width * height
+    maximum_gray_level_value = 255
+    equalized_image = np.zeros_like(channels, dtype=np.uint8)
+
+    for channel in range(channels.shape[2]):
+        cdf = np.cumsum(_histogram(channels[:, :, channel]))
+        for x in range(height):
+            for y in range(width):
+                current_pixel = channels[x, y, channel]
+                equalized_image[x, y, channel] = int(round(maximum_gray_level_value * cdf[current_pixel] / area))
+            report(channel * height + x + 1, channels.shape[2] * height)
+
+    return Image.fromarray(equalized_image.reshape(np_image.shape))
+
+
+def clahe(image, tiles=(8, 8), clip_limit=2.0):
+    np_image = np.array(image)
+    height, width = np_image.shape
+    tile_rows, tile_cols = tiles
+    row_edges = [int(i * height / tile_rows) for i in range(tile_rows + 1)]
+    col_edges = [int(j * width / tile_cols) for j in range(tile_cols + 1)]
+    row_centers = [(row_edges[i] + row_edges[i + 1] - 1) / 2 for i in range(tile_rows)]
+    col_centers = [(col_edges[j] + col_edges[j + 1] - 1) / 2 for j in range(tile_cols)]
+
+    # Clipped equalization LUT of every tile.
+    luts = {}
+    for i in range(tile_rows):
+        for j in range(tile_cols):
+            hist = _histogram(np_image[row_edges[i]:row_edges[i + 1], col_edges[j]:col_edges[j + 1]])
+            area = np.sum(hist)
+            if clip_limit is not None:
+                limit = max(clip_limit * area / 256, 1)
+                excess = sum(max(count - limit, 0) for count in hist)
+                hist = np.array([min(count, limit) + excess / 256 for count in hist])
+            luts[i, j] = np.cumsum(hist) * 255 / max(area, 1)
+
+    def neighbours(position, centers):
+        # Tile centres on either side of a position and the weight of the second.
+        lower = max(sum(center <= position for center in centers) - 1, 0)
+        upper = min(lower + 1, len(centers) - 1)
+        if upper == lower:
+            return lower, upper, 0.0
+        return lower, upper, min(max((position - centers[lower]) / (centers[upper] - centers[lower]), 0), 1)
+
+    result = np.zeros_like(np_image, dtype=np.uint8)
+    for y in range(height):
+        top, bottom, wy = neighbours(y, row_centers)
+        for x in range(width):
+            left, right, wx = neighbours(x, col_centers)
+            pixel = np_image[y, x]
+            value = ((1 - wy) * ((1 - wx) * luts[top, left][pixel] + wx * luts[top, right][pixel])
+                     + wy * ((1 - wx) * luts[bottom, left][pixel] + wx * luts[bottom, right][pixel]))
+            result[y, x] = min(max(round(value), 0), 255)
+        report(y + 1, height)
+
+    return Image.fromarray(result)
+
+
+# Halftoning
+
+def apply_simple_halftone(image, threshold=128):
+    image = np.array(image, dtype=np.float32)
+    height, width = image.shape
+    result_image = np.zeros_like(image, dtype=np.float32)
+
+    for x in range(height):
+        for y in range(width):
+            if image[x, y] > threshold:
+                result_image[x, y] = 255
+        report(x + 1, height)
+
+    return Image.fromarray(result_image)
+
+
+def apply_advanced_halftone(image, kernel='floyd-steinberg', serpentine=False):
+    from Halftoning.Halftoning import DIFFUSION_KERNELS
+    if kernel not in DIFFUSION_KERNELS:
+        raise ValueError(f"Unknown diffusion kernel: {kernel}")
+    divisor, taps = DIFFUSION_KERNELS[kernel]
+
+    image = np.array(image, dtype=np.float64)
+    height, width = image.shape
+    result_image = np.zeros((height, width), dtype=np.uint8)
+
+    for x in range(height):
+        reverse = serpentine and x % 2 == 1
+        step = -1 if reverse else 1
+        for y in (range(width - 1, -1, -1) if reverse else range(width)):
+            old_pixel = image[x, y]
+            new_pixel = 255 if old_pixel > 127 else 0
+            result_image[x, y] = new_pixel
+
+            # Error pushed past the image edges is dropped.
+            error = old_pixel - new_pixel
+            for dy, dx, weight in taps:
+                if x + dy < height and 0 <= y + dx * step < width:
+                    image[x + dy, y + dx * step] += error * weight / divisor
+        report(x + 1, height)
+
+    return Image.fromarray(result_image)
+
+
+def apply_ordered_dither(image, method='bayer', size=8, packed=False):
+    from Halftoning.Halftoning import threshold_map
+    image = np.array(image, dtype=np.uint8)
+    thresholds = threshold_map(method, size)
+    height, width = image.shape
+    result_image = np.zeros((height, width), dtype=np.uint8)
+
+    for x in range(height):
+        for y in range(width):
+            if image[x, y] > thresholds[x % thresholds.shape[0], y % thresholds.shape[1]]:
+                result_image[x, y] = 255
+        report(x + 1, height)
+
+    if packed:
+        return Image.fromarray(result_image).convert('1')
+    return Image.fromarray(result_image)
+
+
+# Image operations
+
+def _combine(image, other, combine):
+    # The operands as the fast path sees them, then one channel value at a time.
+    from ImageOperations.ImageOperations import _image_operands
+    first, second = (operand.astype(np.int64) for operand in _image_operands(image, other))
+    if first.ndim == 2 and second.ndim == 3:
+        first = np.repeat(first[:, :, np.newaxis], second.shape[2], axis=2)
+    elif second.ndim == 2 and first.ndim == 3:
+        second = np.repeat(second[:, :, np.newaxis], first.shape[2], axis=2)
+    result = np.zeros(first.shape, dtype=np.uint8)
+    for y in range(first.shape[0]):
+        for index in np.ndindex(first.shape[1:]):
+            result[(y,) + index] = combine(first[(y,) + index], second[(y,) + index])
+        report(y + 1, first.shape[0])
+    return Image.fromarray(result)
+
+
+def add_images(image, other=None):
+    return _combine(image, other, lambda a, b: min(a + b, 255))
+
+
+def subtract_images(image, other=None):
+    return _combine(image, other, lambda a, b: max(a - b, 0))
+
+
+def absdiff_images(image, other=None):
+    return _combine(image, other, lambda a, b: abs(a - b))
+
+
+def multiply_images(image, other=None):
+    return _combine(image, other, lambda a, b: round(a * b / 255))
+
+
+def blend_images(image, other=None, alpha=0.5):
+    weight = round(alpha * 255)
+    return _combine(image, other, lambda a, b: round(((255 - weight) * a + weight * b) / 255))
+
+
+def invert_image(image):
+    from ImageOperations.ImageOperations import _as_array
+    np_image = _as_array(image)
+    result = np.zeros_like(np_image)
+    for index, value in np.ndenumerate(np_image):
+        result[index] = 255 - value
+    return Image.fromarray(result)
+
+
+# Simple edge detection
+
+def _gradient_operator(image, operator):
+    from SimpleEdgeDetection.EdgeDetection import GRADIENT_MASKS
+    image = _gray(image)
+    height, width = image.shape
+    x_mask, y_mask = GRADIENT_MASKS[operator]
+
+    ix = _correlate_reflect(image, x_mask)
+    iy = _correlate_reflect(image, y_mask)
+    magnitude = np.sqrt(ix ** 2 + iy ** 2).astype(np.float32)
+    threshold = np.mean(magnitude)
+
+    result_image = np.zeros((height, width), dtype=np.uint8)
+    for x in range(height):
+        for y in range(width):
+            if int(magnitude[x, y]) > threshold:
+                result_image[x, y] = 255
+    return Image.fromarray(result_image)
+
+
+def sobel_operator(image):
+    return _gradient_operator(image, 'sobel')
+
+
+def prewitt_operator(image):
+    return _gradient_operator(image, 'prewitt')
+
+
+def kirsch_compass_masks(image, return_direction=False):
+    from SimpleEdgeDetection.EdgeDetection import _KIRSCH_RING
+    image = _gray(image)
+    height, width = image.shape
+
+    # Mask k weights ring positions k, k + 1 and k + 2 with 5, the rest with -3.
+    kirsch_masks = []
+    for k in range(8):
+        mask = np.zeros((3, 3))
+        for position, (dy, dx) in enumerate(_KIRSCH_RING):
+            mask[1 + dy, 1 + dx] = 5 if (position - k) % 8 < 3 else -3
+        kirsch_masks.append(mask)
+
+    edges = np.array([_correlate_reflect(image, mask) for mask in kirsch_masks])
+    magnitude = np.max(edges, axis=0).astype(np.float32)
+    direction = np.argmax(edges, axis=0).astype(np.uint8)
+    threshold = np.mean(magnitude)
+
+    result_image = np.zeros((height, width), dtype=np.uint8)
+    for x in range(height):
+        for y in range(width):
+            if int(magnitude[x, y]) > threshold:
+                result_image[x, y] = 255
+
+    if return_direction:
+        return Image.fromarray(result_image), direction
+    return Image.fromarray(result_image)
+
+
+# Advanced edge detection
+
+def contrast_based_edge(image):
+    image = _gray(image)
+    edge_mask = np.array([
+        [-1, 0, -1],
+        [0, 4, 0],
+        [-1, 0, -1]
+    ])
+
+    edge_result = _correlate_reflect(image, edge_mask).astype(np.float32)
+    smoothed_result = _correlate_reflect(image, np.ones((3, 3)) / 9).astype(np.float32)
+    smoothed_result += 1e-10
+
+    contrast_image = edge_result / smoothed_result
+    contrast_image = np.clip(contrast_image * 255 / np.max(contrast_image), 0, 255)
+    return Image.fromarray(contrast_image.astype(np.uint8))
+
+
+def difference_of_gaussians(image):
+    from AdvancedEdgeDetection.EdgeDetection import blurring_mask_7x7, blurring_mask_9x9
+    image = np.array(image)
+
+    # Each blur is rounded and saturated to uint8 before the subtraction,
+    # which wraps around like the uint8 arithmetic it stands for.
+    blurred_1 = np.clip(np.rint(_correlate_reflect(image, blurring_mask_7x7)), 0, 255).astype(np.uint8)
+    blurred_2 = np.clip(np.rint(_correlate_reflect(image, blurring_mask_9x9)), 0, 255).astype(np.uint8)
+    dog_result = blurred_1 - blurred_2
+    return Image.fromarray(dog_result), Image.fromarray(blurred_1), Image.fromarray(blurred_2)
+
+
+def _neighborhood_operator(image, measure):
+    image = _gray(image)
+    height, width = image.shape
+    result = np.zeros_like(image)
+
+    for x in range(1, height - 1):
+        for y in range(1, width - 1):
+            result[x, y] = min(max(measure(image[x - 1:x + 2, y - 1:y + 2]), 0), 255)
+        report(x + 1, height - 1)
+
+    return Image.fromarray(result.astype(np.uint8))
+
+
+def homogeneity_operator(image, threshold=5):
+    def measure(window):
+        homogeneity_value = max(abs(window[1, 1] - neighbor) for neighbor in window.flatten())
+        return homogeneity_value if homogeneity_value > threshold else 0
+    return _neighborhood_operator(image, measure)
+
+
+def difference_operator(image, threshold=5):
+    def measure(window):
+        difference_value = max(abs(window[2, 1] - window[0, 1]), abs(window[1, 0] - window[1, 2]),
+                               abs(window[2, 0] - window[0, 2]), abs(window[2, 2] - window[0, 0]))
+        return difference_value if difference_value > threshold else 0
+    return _neighborhood_operator(image, measure)
+
+
+def variance_operator(image):
+    return _neighborhood_operator(image, lambda window: np.sum((window - np.mean(window)) ** 2) / 9)
+
+
+def range_operator(image):
+    return _neighborhood_operator(image, lambda window: np.max(window) - np.min(window))
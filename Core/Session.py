@@ -0,0 +1,56 @@
+from PIL import Image, ImageOps
+
+from Core.Cache import enable_cache
+
+# Longest side of the preview every tool works on interactively.
+THUMBNAIL_SIZE = (400, 400)
+
+
+class Session:
+    """
+    The image the tools work on. Opening a file shows it in every tool
+    subscribed to the session, and they all share one copy of the
+    full-resolution pixels, its thumbnail and its grayscale conversion.
+    Creating a session turns on the operator result cache, since the tools
+    apply operators to the same image repeatedly.
+    """
+
+    def __init__(self):
+        enable_cache()
+        self.path = None
+        self.source = None
+        self.thumbnail = None
+        self._gray_source = None
+        self._listeners = []
+
+    def open(self, path):
+        source = Image.open(path)
+        source.load()
+        thumbnail = source.copy()
+        thumbnail.thumbnail(THUMBNAIL_SIZE)
+
+        self.path, self.source, self.thumbnail = path, source, thumbnail
+        self._gray_source = None
+        for listener in list(self._listeners):
+            listener(self)
+
+    def grayscale(self):
+        """
+        The full-resolution image in grayscale, converted on first use.
+        """
+        if self._gray_source is None:
+            self._gray_source = ImageOps.grayscale(self.source)
+        return self._gray_source
+
+    def subscribe(self, listener):
+        """
+        Call listener(session) whenever an image is opened, and right away
+        if one already is.
+        """
+        self._listeners.append(listener)
+        if self.source is not None:
+            listener(self)
+
+    def unsubscribe(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
@@ -0,0 +1,133 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from Core.Fingerprint import fingerprint
+
+# Number of images whose statistics are kept around.
+CACHE_SIZE = 8
+
+# Pixels counted per bincount call, so memory-mapped images are histogrammed
+# without materialising them (bincount copies its input to intp).
+HISTOGRAM_CHUNK = 2 ** 22
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class ImageStatistics:
+    """
+    Intensity statistics of one 8-bit image, all derived from a single
+    256-bin histogram over every pixel (and every channel). Each value is
+    computed on first access and kept.
+    """
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self._values = {}
+
+    def _memoized(self, name, compute):
+        if name not in self._values:
+            self._values[name] = compute()
+        return self._values[name]
+
+    @property
+    def total(self):
+        return self._memoized('total', lambda: int(self.histogram.sum()))
+
+    @property
+    def cdf(self):
+        return self._memoized('cdf', lambda: np.cumsum(self.histogram))
+
+    @property
+    def mean(self):
+        return self._memoized('mean', lambda: float(np.dot(np.arange(256), self.histogram) / self.total))
+
+    @property
+    def variance(self):
+        def compute():
+            levels = np.arange(256)
+            return float(np.dot((levels - self.mean) ** 2, self.histogram) / self.total)
+        return self._memoized('variance', compute)
+
+    @property
+    def std(self):
+        return self.variance ** 0.5
+
+    def percentile(self, q):
+        """Smallest intensity with at least `q` percent of pixels at or below it."""
+        return int(np.searchsorted(self.cdf, q / 100 * self.total))
+
+    @property
+    def peak(self):
+        return self._memoized('peak', lambda: int(np.argmax(self.histogram)))
+
+    @property
+    def valley(self):
+        def compute():
+            # Mean over a 5-bin window, truncated at both ends of the histogram.
+            window_size = 5
+            half = window_size // 2
+            sums = np.concatenate(([0], np.cumsum(self.histogram)))
+            starts = np.maximum(np.arange(256) - half, 0)
+            ends = np.minimum(np.arange(256) + half + 1, 256)
+            smoothed = (sums[ends] - sums[starts]) / (ends - starts)
+
+            valleys = np.nonzero((smoothed[:-2] > smoothed[1:-1]) & (smoothed[1:-1] < smoothed[2:]))[0] + 1
+            return int(valleys[0]) if len(valleys) else 0
+        return self._memoized('valley', compute)
+
+    @property
+    def otsu(self):
+        def compute():
+            weight_background = self.cdf
+            weight_foreground = self.total - weight_background
+            sum_background = np.cumsum(np.arange(256) * self.histogram)
+            sum_all = sum_background[-1]
+
+            valid = (weight_background > 0) & (weight_foreground > 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean_background = sum_background / weight_background
+                mean_foreground = (sum_all - sum_background) / weight_foreground
+                variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+            return int(np.argmax(np.where(valid, variance, -np.inf)))
+        return self._memoized('otsu', compute)
+
+
+def image_statistics(image):
+    """
+    Statistics for `image` (PIL image or array), shared by every caller that
+    passes the same pixels. Results are cached by content fingerprint.
+    Pixels that are not uint8 are clipped to 0-255 and truncated first.
+    """
+    np_image = np.asarray(image)
+    key = fingerprint(np_image)
+
+    with _cache_lock:
+        statistics = _cache.get(key)
+        if statistics is not None:
+            _cache.move_to_end(key)
+            return statistics
+
+    pixels = np_image.reshape(-1)
+    histogram = np.zeros(256, dtype=np.int64)
+    for start in range(0, pixels.size, HISTOGRAM_CHUNK):
+        chunk = pixels[start:start + HISTOGRAM_CHUNK]
+        if chunk.dtype != np.uint8:
+            # Float, 32-bit and 16-bit pixels ('F' and 'I' images, unclipped
+            # filter output) are counted at the 8-bit level they clip to.
+            chunk = np.clip(chunk, 0, 255).astype(np.uint8)
+        histogram += np.bincount(chunk, minlength=256)
+    statistics = ImageStatistics(histogram)
+
+    with _cache_lock:
+        _cache[key] = statistics
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return statistics
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,151 @@
+import importlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from Core.Progress import report
+
+DEFAULT_MAX_MEMORY = 256 * 2 ** 20
+
+# Operator -> (module, array function, halo for the given params, working
+# bytes per tile pixel). The halo is the neighbourhood radius the operator
+# reads around each output pixel; the byte estimate covers the operator's
+# temporaries and sizes tiles under a memory cap. Only operators whose output
+# depends on a bounded neighbourhood (no global statistics or scan order)
+# can be tiled exactly.
+TILE_OPERATORS = {
+    'filter': ('Filtering.Filter', 'apply_filter_array',
+               lambda params: max(np.shape(params['kernel'])) // 2, 40),
+    'high-pass': ('Filtering.Filter', 'high_pass_filter_array', lambda params: 1, 40),
+    'low-pass': ('Filtering.Filter', 'low_pass_filter_array', lambda params: 1, 40),
+    'median': ('Filtering.Filter', 'median_filter_array', lambda params: params.get('size', 3) // 2, 4),
+    'manual-threshold': ('Segmentation.Segmentation', 'manual_threshold_array', lambda params: 0, 2),
+    'adaptive-threshold': ('Segmentation.Segmentation', 'adaptive_histogram_threshold_array',
+                           lambda params: params.get('window_size', 35) // 2, 72),
+    'simple-halftone': ('Halftoning.Halftoning', 'simple_halftone_array', lambda params: 0, 10),
+    'gradient-magnitude': ('Core.Pipeline', 'gradient_magnitude_array', lambda params: 1, 16),
+    'kirsch-response': ('SimpleEdgeDetection.EdgeDetection', 'kirsch_compass_response', lambda params: 1, 24),
+    'dog': ('AdvancedEdgeDetection.EdgeDetection', 'difference_of_gaussians_array', lambda params: 4, 8),
+    'homogeneity': ('AdvancedEdgeDetection.EdgeDetection2', 'homogeneity_operator_array', lambda params: 1, 32),
+    'difference': ('AdvancedEdgeDetection.EdgeDetection2', 'difference_operator_array', lambda params: 1, 32),
+    'variance': ('AdvancedEdgeDetection.EdgeDetection2', 'variance_operator_array', lambda params: 1, 32),
+    'range': ('AdvancedEdgeDetection.EdgeDetection2', 'range_operator_array', lambda params: 1, 32),
+}
+
+
+def tile_size_for(max_memory, halo, bytes_per_pixel):
+    """
+    Largest square tile whose haloed working set fits in `max_memory` bytes.
+    """
+    side = int((max_memory / bytes_per_pixel) ** 0.5) - 2 * halo
+    if side < 1:
+        raise ValueError(f"A {max_memory} byte memory cap leaves no room for a {halo} pixel halo")
+    return side
+
+
+def run_tiled_function(function, source, halo, tile_size, out=None):
+    """
+    Apply `function` to `source` one tile at a time, with square tiles of
+    side `tile_size` or (rows, columns) tiles. Each tile is read with
+    `halo` extra pixels on every side that lie inside the image, and only
+    its centre is written to `out`. As long as `halo` covers the function's
+    neighbourhood, the stitched result equals function(source).
+    `source` and `out` may be memory-mapped arrays; only one haloed tile is
+    loaded at a time.
+    """
+    height, width = source.shape[:2]
+    tile_rows, tile_cols = tile_size if isinstance(tile_size, tuple) else (tile_size, tile_size)
+    for top in range(0, height, tile_rows):
+        bottom = min(top + tile_rows, height)
+        for left in range(0, width, tile_cols):
+            right = min(left + tile_cols, width)
+            read_top, read_left = max(top - halo, 0), max(left - halo, 0)
+            read_bottom, read_right = min(bottom + halo, height), min(right + halo, width)
+
+            tile = np.array(source[read_top:read_bottom, read_left:read_right])
+            result = function(tile)
+            if isinstance(result, tuple):
+                result = result[0]
+
+            if out is None:
+                out = np.empty(source.shape[:2] + result.shape[2:], dtype=result.dtype)
+            out[top:bottom, left:right] = result[top - read_top:bottom - read_top,
+                                                 left - read_left:right - read_left]
+            report(top * width + (bottom - top) * right, height * width)
+    return out
+
+
+def run_threaded_function(function, source, halo, band_height, threads=None, out=None):
+    """
+    Apply `function` to full-width horizontal bands of `source` concurrently
+    on a pool of `threads` threads. Each band is a view into `source` with
+    `halo` extra rows above and below, so nothing is copied or pickled, and
+    each thread writes only its band's centre rows into `out`. Only
+    functions that release the GIL (NumPy, OpenCV) actually run in parallel.
+    """
+    height = source.shape[0]
+
+    def run(top, bottom):
+        read_top, read_bottom = max(top - halo, 0), min(bottom + halo, height)
+        result = function(source[read_top:read_bottom])
+        if isinstance(result, tuple):
+            result = result[0]
+        return result[top - read_top:bottom - read_top]
+
+    if out is None:
+        # A few rows are enough to learn the output dtype and channels.
+        probe = run(0, min(height, halo + 1))
+        out = np.empty(source.shape[:2] + probe.shape[2:], dtype=probe.dtype)
+
+    def run_into(top):
+        bottom = min(top + band_height, height)
+        out[top:bottom] = run(top, bottom)
+
+    # Progress is reported from the calling thread as bands complete in
+    # order; on cancellation the bands not yet started are dropped.
+    tops = range(0, height, band_height)
+    pool = ThreadPoolExecutor(threads)
+    try:
+        for done, _ in enumerate(pool.map(run_into, tops), 1):
+            report(done, len(tops))
+    finally:
+        pool.shutdown(cancel_futures=True)
+    return out
+
+
+def run_threaded(name, source, out=None, threads=None, band_height=None, **params):
+    """
+    Run operator `name` from TILE_OPERATORS over `source` with
+    run_threaded_function. By default there is one thread per core and four
+    bands per thread, which keeps the cores busy when bands finish unevenly.
+    The result equals the untiled one exactly, as for run_tiled.
+    """
+    if name not in TILE_OPERATORS:
+        raise ValueError(f"Operator '{name}' cannot be tiled")
+    module_name, function_name, halo_for, _ = TILE_OPERATORS[name]
+    function = getattr(importlib.import_module(module_name), function_name)
+
+    threads = threads or os.cpu_count() or 1
+    if band_height is None:
+        band_height = max(-(-source.shape[0] // (4 * threads)), 1)
+    return run_threaded_function(lambda band: function(band, **params), source, halo_for(params),
+                                 band_height, threads, out)
+
+
+def run_tiled(name, source, out=None, max_memory=DEFAULT_MAX_MEMORY, tile_size=None, **params):
+    """
+    Run operator `name` from TILE_OPERATORS over `source` in tiles whose
+    working set stays under `max_memory` bytes, and return the stitched
+    result. 'filter' kernels large enough for the FFT path match the untiled
+    result only up to float rounding; everything else matches exactly.
+    """
+    if name not in TILE_OPERATORS:
+        raise ValueError(f"Operator '{name}' cannot be tiled")
+    module_name, function_name, halo_for, bytes_per_pixel = TILE_OPERATORS[name]
+    function = getattr(importlib.import_module(module_name), function_name)
+    halo = halo_for(params)
+
+    if tile_size is None:
+        tile_size = tile_size_for(max_memory, halo, bytes_per_pixel)
+    return run_tiled_function(lambda tile: function(tile, **params), source, halo, tile_size, out)
@@ -0,0 +1,241 @@
+import queue
+import threading
+import tkinter as tk
+from tkinter import filedialog, messagebox, ttk
+
+from Core.History import KEYFRAME_INTERVAL, Frame, History, Step, replay
+from Core.Preview import scale_parameters
+from Core.Progress import Cancelled, Task, running
+
+# Milliseconds between checks of the worker's message queue.
+POLL_INTERVAL = 50
+
+
+class Worker:
+    """
+    Runs operators off the Tk main thread. Adds a progress bar and Cancel,
+    Undo, Redo and Export Full Resolution buttons to `parent`. The worker
+    thread only posts progress and results to a queue, which the Tk event
+    loop polls, so widgets are only ever touched from the main thread.
+    Starting a new run cancels the previous one. `display` shows the
+    original image when every operation has been undone, and `on_move`,
+    if given, is called before the image is shown on every Undo and Redo.
+    """
+
+    def __init__(self, master, parent, display, on_move=None):
+        self.master = master
+        self.progress = ttk.Progressbar(parent, length=150, maximum=1.0)
+        self.progress.pack(pady=5)
+        self.cancel_btn = tk.Button(parent, text="Cancel", command=self.cancel, state=tk.DISABLED)
+        self.cancel_btn.pack(pady=5)
+        self.export_btn = tk.Button(parent, text="Export Full Resolution", command=self.export, state=tk.DISABLED)
+        self.export_btn.pack(pady=5)
+        self.undo_btn = tk.Button(parent, text="Undo", command=self.undo, state=tk.DISABLED)
+        self.undo_btn.pack(pady=5)
+        self.redo_btn = tk.Button(parent, text="Redo", command=self.redo, state=tk.DISABLED)
+        self.redo_btn.pack(pady=5)
+
+        self.display = display
+        self.on_move = on_move
+        self.history = None
+        self._origin = None
+        self.task = None
+        self._messages = queue.Queue()
+        self._poll_id = None
+
+    @property
+    def busy(self):
+        return self.task is not None
+
+    @property
+    def full_result(self):
+        return self.history.current['full'] if self.history is not None else None
+
+    def run(self, function, *args, on_done=None, **kwargs):
+        """
+        Call function(*args, **kwargs) on a background thread and pass its
+        result to `on_done` on the main thread. Operators report progress
+        through Core.Progress.report and stop at the next report after Cancel.
+        """
+        self.cancel()
+        task = Task(lambda fraction: self._messages.put((task, 'progress', fraction)))
+        task.on_done = on_done
+        self.task = task
+
+        def work():
+            try:
+                with running(task):
+                    result = function(*args, **kwargs)
+            except Cancelled:
+                self._messages.put((task, 'cancelled', None))
+            except Exception as error:
+                self._messages.put((task, 'error', error))
+            else:
+                self._messages.put((task, 'done', result))
+
+        self.progress['value'] = 0
+        self.cancel_btn.config(state=tk.NORMAL)
+        threading.Thread(target=work, daemon=True).start()
+        if self._poll_id is None:
+            self._poll_id = self.master.after(POLL_INTERVAL, self._poll)
+
+    def run_progressive(self, function, proxy, source, on_preview, select=None, **params):
+        """
+        Apply `function` to the current image, which is `proxy` and its
+        full-resolution `source` until an operation has been applied, and
+        the previous result after that. The result on the downscaled image
+        is shown right away; the full-resolution one is computed in the
+        background and offered for export. Both runs use the same `params`,
+        with window sizes scaled to the proxy. `select` picks the image to
+        show from the result of an operator that returns several.
+
+        Every call adds a step that Undo can take back. Passing a new
+        `proxy` starts a new history.
+        """
+        if self._origin is not proxy:
+            self._origin = proxy
+            self.history = History(proxy, source)
+        history = self.history
+
+        step = Step(function, params, select or (lambda result: result), on_preview)
+        parent = history.current['preview']
+        scale = proxy.width / source.width
+        preview = step.apply(parent, proxy.mode, **scale_parameters(function, scale, params))
+        step.preview = Frame(preview, parent, keyframe=(history.index + 1) % KEYFRAME_INTERVAL == 0)
+
+        known = (history.index, history.current['full'])
+        history.push(step, preview)
+        on_preview(preview)
+        self._compute_full(known)
+
+    def show_preview(self, function, proxy, source, on_preview, select=None, **params):
+        """
+        Show `function` applied to the current downscaled image, with the
+        same arguments as run_progressive, but without adding a step: for
+        views such as side-by-side comparisons that later operations should
+        not build on and Export should not save.
+        """
+        image = proxy
+        if self._origin is proxy and self.history is not None:
+            image = self.history.current['preview']
+        step = Step(function, params, select or (lambda result: result), on_preview)
+        on_preview(step.apply(image, proxy.mode, **scale_parameters(function, proxy.width / source.width, params)))
+
+    def _compute_full(self, known=None):
+        # Replays every step since the last full-resolution frame, so a step
+        # applied before the previous one finished still gets its frame.
+        # `known` is a (position, decoded full frame) pair that saves
+        # decoding the starting frame again.
+        self._update_buttons()
+        history = self.history
+        start, steps = history.full_plan()
+        if not steps:
+            return
+        base, all_steps, mode = history.base['full'], list(history.steps), self._origin.mode
+        start_image = known[1] if known is not None and known[0] == start else None
+
+        def compute():
+            image = start_image if start_image is not None else replay(base, all_steps, start, 'full')
+            frames = []
+            for position, step in enumerate(steps, start + 1):
+                result = step.apply(image, mode)
+                frames.append((step, Frame(result, image, keyframe=position % KEYFRAME_INTERVAL == 0)))
+                image = result
+            return frames, image
+
+        self.run(compute, on_done=self._store_full)
+
+    def _store_full(self, outcome):
+        frames, image = outcome
+        for step, frame in frames:
+            self.history.set_full(step, frame, image if step is frames[-1][0] else None)
+        self._update_buttons()
+
+    def undo(self):
+        if self.history is not None and self.history.can_undo:
+            self._move(self.history.index - 1)
+
+    def redo(self):
+        if self.history is not None and self.history.can_redo:
+            self._move(self.history.index + 1)
+
+    def _move(self, index):
+        history = self.history
+        history.move(index)
+        if self.on_move is not None:
+            self.on_move()
+        step = history.step
+        (step.on_preview if step is not None else self.display)(history.current['preview'])
+        if history.current['full'] is None:
+            self._compute_full()
+        else:
+            self._update_buttons()
+
+    def _update_buttons(self):
+        history = self.history
+        self.undo_btn.config(state=tk.NORMAL if history is not None and history.can_undo else tk.DISABLED)
+        self.redo_btn.config(state=tk.NORMAL if history is not None and history.can_redo else tk.DISABLED)
+        self.export_btn.config(state=tk.NORMAL if self.full_result is not None else tk.DISABLED)
+
+    def export(self):
+        if self.full_result is None:
+            return
+        file_path = filedialog.asksaveasfilename(defaultextension=".png", parent=self.master,
+                                                 filetypes=[("PNG", "*.png"), ("JPEG", "*.jpg"), ("TIFF", "*.tif")])
+        if file_path:
+            image = self.full_result
+            if image.mode not in ('1', 'L', 'RGB', 'RGBA'):
+                image = image.convert('L')
+            image.save(file_path)
+
+    def reset(self):
+        """
+        Cancel any run and drop the history.
+        """
+        self.cancel()
+        self.history = None
+        self._origin = None
+        self._update_buttons()
+
+    def close(self):
+        """
+        Cancel any run and stop polling, before the window is destroyed.
+        """
+        self.reset()
+        if self._poll_id is not None:
+            self.master.after_cancel(self._poll_id)
+            self._poll_id = None
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+            self._finish()
+
+    def _finish(self):
+        self.task = None
+        self.progress['value'] = 0
+        self.cancel_btn.config(state=tk.DISABLED)
+
+    def _poll(self):
+        while True:
+            try:
+                task, kind, value = self._messages.get_nowait()
+            except queue.Empty:
+                break
+            # Messages from cancelled or replaced runs are dropped.
+            if task is not self.task:
+                continue
+            if kind == 'progress':
+                self.progress['value'] = value
+                continue
+
+            self._finish()
+            if kind == 'done' and task.on_done is not None:
+                task.on_done(value)
+            elif kind == 'error':
+                messagebox.showerror("Operation failed", str(value), parent=self.master)
+
+        if self.task is None:
+            self._poll_id = None
+        else:
+            self._poll_id = self.master.after(POLL_INTERVAL, self._poll)
@@ -1,66 +1,239 @@
+import os
+import sys
+
 import numpy as np
 from PIL import Image
 
-def apply_filter(image, kernel):
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Core.Backends import switchable
+from Core.Cache import cached
+from Core.Lazy import lazy_import
+from Core.MemoryMapped import map_operator_file
+from Core.Profiling import profiled
+
+cv2 = lazy_import('cv2')
+
+# Kernels up to this many taps are applied directly as shifted views, larger
+# rank-1 kernels as two 1-D passes and anything bigger than FFT_KERNEL_SIZE
+# through the frequency domain.
+DIRECT_KERNEL_SIZE = 25
+FFT_KERNEL_SIZE = 121
+
+
+def _kernel_padding(kernel):
+    return kernel.shape[0] // 2, kernel.shape[1] // 2
+
+
+def _pad_image(np_image, pad_y, pad_x):
+    pad_width = [(pad_y, pad_y), (pad_x, pad_x)] + [(0, 0)] * (np_image.ndim - 2)
+    return np.pad(np_image, pad_width, mode='constant', constant_values=0)
+
+
+def _separable_factors(kernel):
+    # A rank-1 kernel is the outer product of one column and one row vector.
+    u, s, vt = np.linalg.svd(kernel)
+    if s[0] == 0 or (len(s) > 1 and s[1] > s[0] * 1e-10):
+        return None
+    scale = np.sqrt(s[0])
+    return u[:, 0] * scale, vt[0] * scale
+
+
+def _correlate_direct(np_image, kernel):
+    height, width = np_image.shape[:2]
+    pad_y, pad_x = _kernel_padding(kernel)
+    padded_image = _pad_image(np_image.astype(np.float64), pad_y, pad_x)
+    result = np.zeros(np_image.shape, dtype=np.float64)
+
+    for i in range(kernel.shape[0]):
+        for j in range(kernel.shape[1]):
+            if kernel[i, j] != 0:
+                result += kernel[i, j] * padded_image[i:i + height, j:j + width]
+
+    return result
+
+
+def _correlate_separable(np_image, column, row):
+    height, width = np_image.shape[:2]
+    pad_y, pad_x = len(column) // 2, len(row) // 2
+    padded_image = _pad_image(np_image.astype(np.float64), pad_y, pad_x)
+
+    # Row pass over every padded row, then column pass down the result.
+    rows = np.zeros((padded_image.shape[0], width) + np_image.shape[2:], dtype=np.float64)
+    for j, weight in enumerate(row):
+        if weight != 0:
+            rows += weight * padded_image[:, j:j + width]
+
+    result = np.zeros(np_image.shape, dtype=np.float64)
+    for i, weight in enumerate(column):
+        if weight != 0:
+            result += weight * rows[i:i + height]
+
+    return result
+
+
+def _correlate_fft(np_image, kernel):
+    height, width = np_image.shape[:2]
+    pad_y, pad_x = _kernel_padding(kernel)
+    # Correlation is convolution with the flipped kernel; the full linear
+    # convolution size keeps the zero padding from wrapping around.
+    shape = (height + kernel.shape[0] - 1, width + kernel.shape[1] - 1)
+    image_spectrum = np.fft.rfft2(np_image.astype(np.float64), s=shape, axes=(0, 1))
+    kernel_spectrum = np.fft.rfft2(kernel[::-1, ::-1], s=shape)
+    if np_image.ndim == 3:
+        kernel_spectrum = kernel_spectrum[:, :, np.newaxis]
+
+    full = np.fft.irfft2(image_spectrum * kernel_spectrum, s=shape, axes=(0, 1))
+    # Output pixel (y, x) lines up with kernel tap (pad_y, pad_x), as in the
+    # direct path; for even kernels that is past the kernel's centre.
+    top, left = kernel.shape[0] - 1 - pad_y, kernel.shape[1] - 1 - pad_x
+    return full[top:top + height, left:left + width]
+
+
+def choose_filter_method(kernel):
+    kernel = np.asarray(kernel, dtype=np.float64)
+    if kernel.size <= DIRECT_KERNEL_SIZE:
+        return 'direct'
+    if _separable_factors(kernel) is not None:
+        return 'separable'
+    if kernel.size > FFT_KERNEL_SIZE:
+        return 'fft'
+    return 'direct'
+
+
+@profiled
+def correlate(np_image, kernel, method='auto'):
+    """
+    Zero-padded correlation of a 2-D (or H x W x C) array with `kernel`.
+    `method` is 'direct', 'separable', 'fft' or 'auto' to pick by kernel.
+    Returns an unclipped float64 array the size of the input.
+    """
+    kernel = np.asarray(kernel, dtype=np.float64)
+    if method == 'auto':
+        method = choose_filter_method(kernel)
+
+    if method == 'direct':
+        return _correlate_direct(np_image, kernel)
+    if method == 'separable':
+        factors = _separable_factors(kernel)
+        if factors is None:
+            raise ValueError("Kernel is not separable")
+        return _correlate_separable(np_image, *factors)
+    if method == 'fft':
+        return _correlate_fft(np_image, kernel)
+    raise ValueError(f"Unknown filter method: {method}")
+
+
+@profiled
+def apply_filter_array(np_image, kernel, method='auto', out=None):
+    # Accumulate in float64 and store as float32 like the per-pixel loop did,
+    # so the clipped uint8 output is unchanged.
+    result = correlate(np_image, kernel, method).astype(np.float32)
+
+    np.clip(result, 0, 255, out=result)
+    if out is None:
+        return result.astype(np.uint8)
+    out[...] = result
+    return out
+
+
+@profiled
+@switchable('filter')
+@cached('filter')
+def apply_filter(image, kernel, method='auto'):
     np_image = np.array(image, dtype=np.float32)
-    kernel_size = kernel.shape[0]
-    padding = kernel_size // 2  # Calculate padding based on kernel size
+    return Image.fromarray(apply_filter_array(np_image, kernel, method))
+
+
+HIGH_PASS_MASK = np.array([[0, -1, 0], 
+                           [-1, 5, -1], 
+                           [0, -1, 0]])
 
-    # Pad the image to allow the kernel to cover edges
-    padded_image = np.pad(np_image, pad_width=padding, mode='constant', constant_values=0)
-    result = np.zeros_like(np_image)
+LOW_PASS_MASKS = {
+    1: np.array([[0, 1, 0], 
+                 [1/6, 2, 1], 
+                 [0, 1, 0]]),
+    2: np.array([[1, 1, 1], 
+                 [1/9, 1, 1], 
+                 [1, 1, 1]]),
+    3: np.array([[1, 1, 1], 
+                 [1/10, 2, 1], 
+                 [1, 1, 1]]),
+    4: np.array([[2, 4, 2], 
+                 [1/16, 2, 1], 
+                 [1, 2, 1]]),
+}
 
-    for i in range(padding, padded_image.shape[0] - padding):
-        for j in range(padding, padded_image.shape[1] - padding):
-            region = padded_image[i - padding:i + padding + 1, j - padding:j + padding + 1]
-            result[i - padding, j - padding] = np.sum(region * kernel)
 
-    result = np.clip(result, 0, 255)
-    return Image.fromarray(result.astype(np.uint8))
+@profiled
+def high_pass_filter_array(np_image, out=None):
+    return apply_filter_array(np_image, HIGH_PASS_MASK, out=out)
 
 
+@profiled
+@switchable('high-pass')
+@cached('high-pass')
 def high_pass_filter(image):
-    high_pass_mask = np.array([[0, -1, 0], 
-                               [-1, 5, -1], 
-                               [0, -1, 0]])
+    return apply_filter(image, HIGH_PASS_MASK)
 
-    return apply_filter(image, high_pass_mask)
 
+@profiled
+def low_pass_filter_array(np_image, mask_type=1, out=None):
+    if mask_type not in LOW_PASS_MASKS:
+        raise ValueError(f"Unknown low-pass mask type: {mask_type}")
+    return apply_filter_array(np_image, LOW_PASS_MASKS[mask_type], out=out)
 
+
+@profiled
+@switchable('low-pass')
+@cached('low-pass')
 def low_pass_filter(image, mask_type=1):
-    if mask_type == 1:
-        low_pass_mask = np.array([[0, 1, 0], 
-                                  [1/6, 2, 1], 
-                                  [0, 1, 0]])
-    elif mask_type == 2:
-        low_pass_mask = np.array([[1, 1, 1], 
-                                  [1/9, 1, 1], 
-                                  [1, 1, 1]])
-    elif mask_type == 3:
-        low_pass_mask = np.array([[1, 1, 1], 
-                                  [1/10, 2, 1], 
-                                  [1, 1, 1]])
-    elif mask_type == 4:
-        low_pass_mask = np.array([[2, 4, 2], 
-                                  [1/16, 2, 1], 
-                                  [1, 2, 1]])
-
-    return apply_filter(image, low_pass_mask)
-
-
-def median_filter_function(image):
-
-    np_image = np.array(image)
-    height, width = np_image.shape
-    result = np.zeros_like(np_image)
-    
-    # Apply 3x3 median filter
-    for i in range(1, height - 1):
-        for j in range(1, width - 1):
-            # Get 3x3 neighborhood
-            neighborhood = np_image[i-1:i+2, j-1:j+2]
-            # Calculate median value
-            median_value = np.median(neighborhood)
-            result[i, j] = median_value
-            
-    return Image.fromarray(result.astype(np.uint8))
+    return Image.fromarray(low_pass_filter_array(np.array(image, dtype=np.float32), mask_type))
+
+
+MEDIAN_SIZES = range(3, 32, 2)
+
+
+@profiled
+def median_filter_array(np_image, size=3, border='reflect'):
+    """
+    Median filter with an odd `size` x `size` window (3 to 31).
+    Borders are filled with np.pad's `border` mode ('reflect', 'symmetric',
+    'edge' or 'constant') instead of being left black.
+    """
+    if size not in MEDIAN_SIZES:
+        raise ValueError(f"Median window size must be odd and between 3 and 31, got {size}")
+
+    if np_image.dtype != np.uint8:
+        np_image = np.clip(np_image, 0, 255).astype(np.uint8)
+
+    padding = size // 2
+    pad_width = [(padding, padding), (padding, padding)] + [(0, 0)] * (np_image.ndim - 2)
+    padded_image = np.pad(np_image, pad_width, mode=border)
+
+    # OpenCV's uint8 median keeps a sliding histogram per column
+    # (Perreault-Hebert), so the cost per pixel does not grow with the window.
+    # Filtering the padded image and cropping makes our border mode the one used.
+    result = cv2.medianBlur(np.ascontiguousarray(padded_image), size)
+    return result[padding:padding + np_image.shape[0], padding:padding + np_image.shape[1]]
+
+
+@profiled
+@switchable('median')
+@cached('median')
+def median_filter_function(image, size=3, border='reflect'):
+    return Image.fromarray(median_filter_array(np.array(image), size, border))
+
+
+FILE_FILTERS = ('filter', 'high-pass', 'low-pass', 'median')
+
+
+def filter_file(input_path, output_path, operator='median', band_height=1024, shape=None, **params):
+    """
+    Apply filter `operator` ('filter', 'high-pass', 'low-pass' or 'median',
+    with its usual parameters) to an image file, writing `output_path`.
+    Memory-mapped input and output (see Core.MemoryMapped.open_gray) are
+    processed in row bands, so images larger than RAM can be filtered.
+    """
+    if operator not in FILE_FILTERS:
+        raise ValueError(f"Unknown filter '{operator}' (choose from {', '.join(FILE_FILTERS)})")
+    map_operator_file(operator, input_path, output_path, band_height, shape, **params)
@@ -1,11 +1,16 @@
+import os
+import sys
 import tkinter as tk
-import numpy as np 
 from tkinter import filedialog
 from PIL import Image, ImageTk, ImageOps
-from Filter import high_pass_filter, low_pass_filter, median_filter_function
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Filtering.Filter import high_pass_filter, low_pass_filter, median_filter_function
+from Core.Session import Session
+from Core.Statistics import image_statistics
+from Core.Worker import Worker
 
 class FilterGUI:
-    def __init__(self, master):
+    def __init__(self, master, session=None):
         self.master = master
         self.master.title("Filtering Operations")
 
@@ -31,6 +36,10 @@ class FilterGUI:
         self.median_btn = tk.Button(self.controls, text="Median Filter", command=self.apply_median_filter, state=tk.DISABLED)
         self.median_btn.pack(pady=5)
 
+        self.median_size = tk.IntVar(value=3)
+        self.median_size_spinbox = tk.Spinbox(self.controls, from_=3, to=31, increment=2, width=5, textvariable=self.median_size, state="readonly")
+        self.median_size_spinbox.pack(pady=5)
+
         self.reset_btn = tk.Button(self.controls, text="Reset to Original", bg="#000080", fg="white", command=self.reset_image, state=tk.DISABLED)
         self.reset_btn.pack(pady=5)
 
@@ -41,18 +50,26 @@ class FilterGUI:
         self.threshold_label.pack(pady=5)
 
 
+        self.worker = Worker(master, self.controls, self.display_image)
+
         self.image = None
         self.gray_image = None
+        self.session = session or Session()
+        self.session.subscribe(self.show_image)
 
     def upload_image(self):
         file_path = filedialog.askopenfilename(filetypes=[("Image Files", "*.png *.jpg *.jpeg *.bmp")])
         if file_path:
-            img = Image.open(file_path)
-            img.thumbnail((400, 400))
-            self.image = img
-            self.display_image(img)
-            self.grayscale_btn.config(state=tk.NORMAL)
-            self.reset_btn.config(state=tk.NORMAL)  # Enable reset button when image is uploaded
+            self.session.open(file_path)
+
+    def show_image(self, session):
+        self.worker.reset()
+        self.source = session.source
+        img = session.thumbnail
+        self.image = img
+        self.display_image(img)
+        self.grayscale_btn.config(state=tk.NORMAL)
+        self.reset_btn.config(state=tk.NORMAL)  # Enable reset button when image is uploaded
 
     def display_image(self, img):
         img_tk = ImageTk.PhotoImage(img)
@@ -63,6 +80,7 @@ class FilterGUI:
         if self.image:
             gray = ImageOps.grayscale(self.image)
             self.gray_image = gray
+            self.gray_source = self.session.grayscale()
             self.display_image(gray)
             self.high_pass_btn.config(state=tk.NORMAL)
             self.low_pass_btn.config(state=tk.NORMAL)
@@ -71,28 +89,27 @@ class FilterGUI:
 
     def apply_high_pass(self):
         if self.gray_image:
-            high_pass_image = high_pass_filter(self.gray_image)
-            self.display_image(high_pass_image)
+            self.worker.run_progressive(high_pass_filter, self.gray_image, self.gray_source, self.display_image)
 
     def apply_low_pass(self):
         if self.gray_image:
             # Choose mask type 1 for demonstration, can be changed to other mask types.
-            low_pass_image = low_pass_filter(self.gray_image, mask_type=1)
-            self.display_image(low_pass_image)
+            self.worker.run_progressive(low_pass_filter, self.gray_image, self.gray_source, self.display_image,
+                                        mask_type=1)
 
     def apply_median_filter(self):
         if self.gray_image:
-            median_image = median_filter_function(self.gray_image)
-            self.display_image(median_image)
+            self.worker.run_progressive(median_filter_function, self.gray_image, self.gray_source, self.display_image,
+                                        size=self.median_size.get())
 
     def calculate_threshold(self):
         if self.gray_image:
-            np_image = np.array(self.gray_image)
-            threshold = np.mean(np_image)
+            threshold = image_statistics(self.gray_image).mean
             optimal = "Optimal" if threshold > 127 else "Not Optimal"
             self.threshold_label.config(text=f"Threshold: {threshold:.2f} ({optimal})")
 
     def reset_image(self):
+        self.worker.reset()
         if self.image:
             self.display_image(self.image)
             self.gray_image = None
@@ -1,37 +1,274 @@
+import os
+import sys
+from functools import lru_cache
+
 import numpy as np
 from PIL import Image
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Core.Backends import switchable
+from Core.Cache import cached
+from Core.MemoryMapped import MAPPABLE_EXTENSIONS, create_array, open_gray
+from Core.Profiling import profiled
+from Core.Progress import report
+
+
+@profiled
+def simple_halftone_array(image, threshold=128):
+    return np.where(image > threshold, 255, 0).astype(np.uint8)
 
+
+@profiled
+@switchable('simple-halftone')
+@cached('simple-halftone')
 def apply_simple_halftone(image, threshold=128):
     image = np.array(image, dtype=np.float32)
+    result_image = simple_halftone_array(image, threshold).astype(np.float32)
+
+    return Image.fromarray(result_image)
+
+
+BAYER_SIZES = (2, 4, 8, 16)
+
+
+def bayer_matrix(size):
+    if size not in BAYER_SIZES:
+        raise ValueError(f"Bayer matrix size must be one of {BAYER_SIZES}, got {size}")
+    matrix = np.array([[0, 2], [3, 1]])
+    while matrix.shape[0] < size:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2],
+                           [4 * matrix + 3, 4 * matrix + 1]])
+    return matrix
+
+
+@lru_cache(maxsize=None)
+def blue_noise_matrix(size=64, sigma=1.5, seed=0):
+    """
+    Rank matrix of a tileable blue-noise pattern built with Ulichney's
+    void-and-cluster method. Energies are computed with a wrapped Gaussian,
+    so the pattern tiles without seams.
+    """
+    offsets = np.minimum(np.arange(size), size - np.arange(size))
+    gaussian = np.exp(-(offsets[:, None] ** 2 + offsets[None, :] ** 2) / (2 * sigma ** 2))
+
+    def energy_of(pattern):
+        return np.real(np.fft.ifft2(np.fft.fft2(pattern) * np.fft.fft2(gaussian)))
+
+    def tightest_cluster(pattern, energy):
+        return np.unravel_index(np.argmax(np.where(pattern, energy, -np.inf)), pattern.shape)
+
+    def largest_void(pattern, energy):
+        return np.unravel_index(np.argmin(np.where(pattern, np.inf, energy)), pattern.shape)
+
+    def toggle(pattern, energy, position, value):
+        pattern[position] = value
+        shifted = np.roll(gaussian, position, axis=(0, 1))
+        energy += shifted if value else -shifted
+
+    area = size * size
+    rng = np.random.default_rng(seed)
+    initial = np.zeros((size, size), dtype=bool)
+    initial.flat[rng.choice(area, area // 10, replace=False)] = True
+
+    # Move points from the tightest cluster to the largest void until stable.
+    energy = energy_of(initial)
+    while True:
+        cluster = tightest_cluster(initial, energy)
+        toggle(initial, energy, cluster, False)
+        void = largest_void(initial, energy)
+        if void == cluster:
+            toggle(initial, energy, cluster, True)
+            break
+        toggle(initial, energy, void, True)
+
+    ranks = np.zeros((size, size), dtype=np.int64)
+    ones = int(initial.sum())
+
+    pattern, energy = initial.copy(), energy_of(initial)
+    for rank in range(ones - 1, -1, -1):
+        cluster = tightest_cluster(pattern, energy)
+        toggle(pattern, energy, cluster, False)
+        ranks[cluster] = rank
+
+    # Past half full the tightest cluster of zeros is the largest void of ones,
+    # so filling voids ranks the remaining pixels as well.
+    pattern, energy = initial.copy(), energy_of(initial)
+    for rank in range(ones, area):
+        void = largest_void(pattern, energy)
+        toggle(pattern, energy, void, True)
+        ranks[void] = rank
+
+    return ranks
+
+
+def threshold_map(method='bayer', size=8):
+    if method == 'bayer':
+        ranks = bayer_matrix(size)
+    elif method == 'blue-noise':
+        ranks = blue_noise_matrix(size)
+    else:
+        raise ValueError(f"Unknown ordered dither method: {method}")
+    # Rank r of n levels thresholds at the centre of its 256 / n wide band.
+    return ((2 * ranks + 1) * 128 // ranks.size).astype(np.uint8)
+
+
+@profiled
+def ordered_dither_mask(image, method='bayer', size=8):
+    # Boolean "white" mask of the ordered dither.
     height, width = image.shape
-    result_image = np.zeros_like(image, dtype=np.float32)
+    thresholds = threshold_map(method, size)
 
-    for x in range(height):
-        for y in range(width):
-            pixel_value = image[x, y]
-            if pixel_value > threshold:
-                result_image[x, y] = 255
+    tiles = (-(-height // thresholds.shape[0]), -(-width // thresholds.shape[1]))
+    return image > np.tile(thresholds, tiles)[:height, :width]
 
-    return Image.fromarray(result_image)
 
+@profiled
+def ordered_dither_array(image, method='bayer', size=8):
+    return ordered_dither_mask(image, method, size).astype(np.uint8) * 255
 
-def apply_advanced_halftone(image):
-    image = np.array(image, dtype=np.float32)
+
+@profiled
+@switchable('ordered-dither')
+@cached('ordered-dither')
+def apply_ordered_dither(image, method='bayer', size=8, packed=False):
+    """
+    Ordered dithering against a tiled Bayer or blue-noise threshold map.
+    Returns a 0/255 grayscale image, or a bit-packed mode '1' image when
+    `packed` is set.
+    """
+    image = np.asarray(image, dtype=np.uint8)
+    if packed:
+        height, width = image.shape
+        result = ordered_dither_mask(image, method, size)
+        return Image.frombytes('1', (width, height), np.packbits(result, axis=1).tobytes())
+    return Image.fromarray(ordered_dither_array(image, method, size))
+
+
+# Error diffusion kernels as (divisor, [(row offset, column offset, weight), ...]).
+# Column offsets are for left-to-right scanning and are mirrored on reversed rows.
+DIFFUSION_KERNELS = {
+    'floyd-steinberg': (16, [
+        (0, 1, 7),
+        (1, -1, 3), (1, 0, 5), (1, 1, 1),
+    ]),
+    'jarvis-judice-ninke': (48, [
+        (0, 1, 7), (0, 2, 5),
+        (1, -2, 3), (1, -1, 5), (1, 0, 7), (1, 1, 5), (1, 2, 3),
+        (2, -2, 1), (2, -1, 3), (2, 0, 5), (2, 1, 3), (2, 2, 1),
+    ]),
+    'stucki': (42, [
+        (0, 1, 8), (0, 2, 4),
+        (1, -2, 2), (1, -1, 4), (1, 0, 8), (1, 1, 4), (1, 2, 2),
+        (2, -2, 1), (2, -1, 2), (2, 0, 4), (2, 1, 2), (2, 2, 1),
+    ]),
+    'atkinson': (8, [
+        (0, 1, 1), (0, 2, 1),
+        (1, -1, 1), (1, 0, 1), (1, 1, 1),
+        (2, 0, 1),
+    ]),
+    'sierra': (32, [
+        (0, 1, 5), (0, 2, 3),
+        (1, -2, 2), (1, -1, 4), (1, 0, 5), (1, 1, 4), (1, 2, 2),
+        (2, -1, 2), (2, 0, 3), (2, 1, 2),
+    ]),
+}
+
+# Widest reach of any kernel, used as the margin around each line buffer.
+_MARGIN = 2
+
+
+def error_diffusion_rows(rows, width, kernel='floyd-steinberg', serpentine=False, threshold=127):
+    """
+    Error-diffuse an iterable of grayscale rows, yielding one uint8 row of
+    0/255 values per input row. Only the rows the kernel reaches below the
+    current one are kept as float line buffers, so memory is O(width).
+    """
+    if kernel not in DIFFUSION_KERNELS:
+        raise ValueError(f"Unknown diffusion kernel: {kernel}")
+    divisor, taps = DIFFUSION_KERNELS[kernel]
+
+    # Errors pushed along the current row have to be applied pixel by pixel;
+    # every kernel here reaches at most two pixels ahead.
+    ahead = {dx: weight / divisor for dy, dx, weight in taps if dy == 0}
+    weight_1, weight_2 = ahead.get(1, 0.0), ahead.get(2, 0.0)
+    below = [(dy, dx, weight / divisor) for dy, dx, weight in taps if dy > 0]
+    depth = max(dy for dy, _, _ in below)
+
+    buffers = [np.zeros(width + 2 * _MARGIN) for _ in range(depth + 1)]
+    forward = range(_MARGIN, width + _MARGIN)
+    backward = range(width + _MARGIN - 1, _MARGIN - 1, -1)
+
+    for row_index, row in enumerate(rows):
+        reverse = serpentine and row_index % 2 == 1
+        step = -1 if reverse else 1
+
+        current = buffers[0]
+        current[_MARGIN:width + _MARGIN] += np.asarray(row, dtype=np.float64)
+        values = current.tolist()
+        for x in (backward if reverse else forward):
+            value = values[x]
+            error = value - 255 if value > threshold else value
+            values[x + step] += error * weight_1
+            values[x + 2 * step] += error * weight_2
+
+        values = np.array(values[_MARGIN:width + _MARGIN])
+        output = np.where(values > threshold, 255, 0).astype(np.uint8)
+        errors = values - output
+
+        for dy, dx, weight in below:
+            start = _MARGIN + dx * step
+            buffers[dy][start:start + width] += errors * weight
+
+        buffers.append(buffers.pop(0))
+        buffers[-1][:] = 0
+        yield output
+
+
+@profiled
+def advanced_halftone_array(image, kernel='floyd-steinberg', serpentine=False, out=None):
     height, width = image.shape
-    result_image = np.zeros_like(image, dtype=np.float32)
+    result_image = np.empty((height, width), dtype=np.uint8) if out is None else out
+
+    for y, row in enumerate(error_diffusion_rows(image, width, kernel, serpentine)):
+        result_image[y] = row
+        report(y + 1, height)
+
+    return result_image
+
 
-    for x in range(height - 1):
-        for y in range(1, width - 1):
-            old_pixel = image[x][y]
-            new_pixel = 255 if old_pixel > 127 else 0
-            result_image[x, y] = new_pixel
+@profiled
+@switchable('advanced-halftone')
+@cached('advanced-halftone')
+def apply_advanced_halftone(image, kernel='floyd-steinberg', serpentine=False):
+    image = np.array(image)
+    return Image.fromarray(advanced_halftone_array(image, kernel, serpentine))
 
-            error = old_pixel - new_pixel
 
-            image[x][y + 1] += error * 7 / 16
-            image[x + 1][y - 1] += error * 3 / 16
-            image[x + 1][y] += error * 5 / 16
-            image[x + 1][y + 1] += error * 1 / 16
+def halftone_file(input_path, output_path, kernel='floyd-steinberg', serpentine=False, shape=None, offset=0):
+    """
+    Error-diffuse `input_path` into `output_path` row by row.
+    .npy, PGM, uncompressed TIFF and headerless .raw input is memory-mapped
+    so rows are paged in as they are diffused; raw input needs its
+    (height, width) `shape` and optionally the `offset` of its first byte.
+    Anything else, and PGM or TIFF input that is not 8-bit grayscale, is
+    decoded by PIL as 8-bit grayscale. PBM output is written bit-packed and
+    streamed, .npy, PGM, raw and TIFF output through a memory map; other
+    formats are assembled and saved by PIL.
+    """
+    gray = open_gray(input_path, shape=shape, offset=offset)
+    height, width = gray.shape
 
-    return Image.fromarray(result_image.astype(np.uint8))
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension == '.pbm':
+        with open(output_path, 'wb') as output_file:
+            output_file.write(b'P4\n%d %d\n' % (width, height))
+            for y, row in enumerate(error_diffusion_rows(gray, width, kernel, serpentine)):
+                # PBM stores black as 1.
+                output_file.write(np.packbits(row == 0).tobytes())
+                report(y + 1, height)
+    elif extension in MAPPABLE_EXTENSIONS:
+        result_image = create_array(output_path, (height, width))
+        advanced_halftone_array(gray, kernel, serpentine, out=result_image)
+        result_image.flush()
+    else:
+        Image.fromarray(advanced_halftone_array(gray, kernel, serpentine)).save(output_path)
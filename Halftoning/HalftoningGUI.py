@@ -1,11 +1,16 @@
+import os
+import sys
 import tkinter as tk
 from tkinter import filedialog
 from PIL import Image, ImageTk, ImageOps
-from Halftoning import apply_simple_halftone, apply_advanced_halftone
-import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Halftoning.Halftoning import apply_simple_halftone, apply_advanced_halftone, apply_ordered_dither, DIFFUSION_KERNELS
+from Core.Session import Session
+from Core.Statistics import image_statistics
+from Core.Worker import Worker
 
 class HalftoningGUI:
-    def __init__(self, master):
+    def __init__(self, master, session=None):
         self.master = master
         self.master.title("Halftoning Operations")
         
@@ -27,6 +32,21 @@ class HalftoningGUI:
         
         self.advanced_btn = tk.Button(self.controls, text="Advanced Halftone", command=self.apply_advanced_halftone, state=tk.DISABLED)
         self.advanced_btn.pack(pady=5)
+
+        self.diffusion_kernel = tk.StringVar(value="floyd-steinberg")
+        self.diffusion_kernel_menu = tk.OptionMenu(self.controls, self.diffusion_kernel, *DIFFUSION_KERNELS)
+        self.diffusion_kernel_menu.pack(pady=5)
+
+        self.serpentine = tk.BooleanVar(value=False)
+        self.serpentine_check = tk.Checkbutton(self.controls, text="Serpentine Scan", variable=self.serpentine)
+        self.serpentine_check.pack(pady=5)
+
+        self.ordered_btn = tk.Button(self.controls, text="Ordered Dither", command=self.apply_ordered_dither, state=tk.DISABLED)
+        self.ordered_btn.pack(pady=5)
+
+        self.dither_method = tk.StringVar(value="bayer")
+        self.dither_method_menu = tk.OptionMenu(self.controls, self.dither_method, "bayer", "blue-noise")
+        self.dither_method_menu.pack(pady=5)
         
         self.reset_btn = tk.Button(self.controls, text="Reset to Original", bg="#000080", fg="white", command=self.reset_to_original, state=tk.DISABLED)
         self.reset_btn.pack(pady=5)
@@ -37,19 +57,27 @@ class HalftoningGUI:
         self.threshold_label = tk.Label(self.controls, text="Threshold: N/A", font=("Arial", 12))
         self.threshold_label.pack(pady=5)
         
+        self.worker = Worker(master, self.controls, self.display_image)
+
         self.image = None
         self.gray_image = None
+        self.session = session or Session()
+        self.session.subscribe(self.show_image)
 
     def upload_image(self):
         file_path = filedialog.askopenfilename(filetypes=[("Image Files", "*.png *.jpg *.jpeg *.bmp")])
         if file_path:
-            img = Image.open(file_path)
-            img.thumbnail((400, 400))
-            self.image = img
-            self.display_image(img)
-            self.grayscale_btn.config(state=tk.NORMAL)
-            self.threshold_btn.config(state=tk.NORMAL)
-            self.reset_btn.config(state=tk.NORMAL)
+            self.session.open(file_path)
+
+    def show_image(self, session):
+        self.worker.reset()
+        self.source = session.source
+        img = session.thumbnail
+        self.image = img
+        self.display_image(img)
+        self.grayscale_btn.config(state=tk.NORMAL)
+        self.threshold_btn.config(state=tk.NORMAL)
+        self.reset_btn.config(state=tk.NORMAL)
 
     def display_image(self, img):
         img_tk = ImageTk.PhotoImage(img)
@@ -60,28 +88,35 @@ class HalftoningGUI:
         if self.image:
             gray = ImageOps.grayscale(self.image)
             self.gray_image = gray
+            self.gray_source = self.session.grayscale()
             self.display_image(gray)
             self.simple_btn.config(state=tk.NORMAL)
             self.advanced_btn.config(state=tk.NORMAL)
+            self.ordered_btn.config(state=tk.NORMAL)
 
     def calculate_threshold(self):
         if self.gray_image:
-            np_image = np.array(self.gray_image)
-            threshold = np.mean(np_image)
+            threshold = image_statistics(self.gray_image).mean
             optimal = "Optimal" if threshold > 127 else "Not Optimal"
             self.threshold_label.config(text=f"Threshold: {threshold:.2f} ({optimal})")
 
     def apply_simple_halftone(self):
         if self.gray_image:
-            halftoned = apply_simple_halftone(self.gray_image)
-            self.display_image(halftoned)
+            self.worker.run_progressive(apply_simple_halftone, self.gray_image, self.gray_source, self.display_image)
 
     def apply_advanced_halftone(self):
         if self.gray_image:
-            halftoned = apply_advanced_halftone(self.gray_image)
-            self.display_image(halftoned)
+            self.worker.run_progressive(apply_advanced_halftone, self.gray_image, self.gray_source, self.display_image,
+                                        kernel=self.diffusion_kernel.get(), serpentine=self.serpentine.get())
+
+    def apply_ordered_dither(self):
+        if self.gray_image:
+            method = self.dither_method.get()
+            self.worker.run_progressive(apply_ordered_dither, self.gray_image, self.gray_source, self.display_image,
+                                        method=method, size=8 if method == "bayer" else 64)
 
     def reset_to_original(self):
+        self.worker.reset()
         if self.image:
             self.display_image(self.image)
 
@@ -1,37 +1,131 @@
+import os
+import sys
+
 import numpy as np
 from PIL import Image
 
-def compute_histogram(image):
-    pixels = np.array(image).flatten()
-    histogram = [0] * 256
-    for pixel in pixels:
-        histogram[pixel] += 1
-    return histogram
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Core.Backends import switchable
+from Core.Cache import cached
+from Core.Profiling import profiled
+from Core.Progress import report
+from Core.Statistics import image_statistics
 
-def compute_cdf(histogram):
-    cdf = [0] * 256
-    cdf[0] = histogram[0]
-    for i in range(1, 256):
-        cdf[i] = cdf[i-1] + histogram[i]
+@profiled
+def compute_histogram(image, mask=None, per_channel=False):
+    pixels = np.asarray(image)
+    has_channels = pixels.ndim == 3
+    if mask is not None:
+        pixels = pixels[np.asarray(mask, dtype=bool)]
 
-    return cdf
+    if per_channel and has_channels:
+        channels = pixels.reshape(-1, pixels.shape[-1])
+        # One bincount over all channels, each offset into its own 256 bins.
+        offsets = np.arange(channels.shape[1]) * 256
+        counts = np.bincount((channels.astype(np.intp) + offsets).ravel(), minlength=256 * channels.shape[1])
+        return counts.reshape(channels.shape[1], 256)
 
-def histogram_equalization(image):
-    image = np.array(image)
-    height,  width = image.shape
-    
-    histogram = compute_histogram(image)
-    cdf = compute_cdf(histogram)
+    return np.bincount(pixels.ravel(), minlength=256)
+
+def compute_cdf(histogram):
+    return np.cumsum(histogram, axis=-1)
 
-    area = width * height
+def equalization_lut(histogram):
+    cdf = compute_cdf(histogram)
+    area = cdf[-1]
     maximum_gray_level_value = 255
-    equalized_image = np.zeros_like(image, dtype=np.uint8)
+    return np.round(maximum_gray_level_value * cdf / area).astype(np.uint8)
+
+@profiled
+def histogram_equalization_array(image, out=None):
+    if out is None:
+        out = np.empty_like(image, dtype=np.uint8)
 
     # Apply Histogram Equalization
-    for x in range(height):
-        for y in range(width):
-            current_pixel = image[x, y]
-            new_pixel_value = int(round(maximum_gray_level_value * cdf[current_pixel] / area))
-            equalized_image[x, y] = new_pixel_value
+    if image.ndim == 3:
+        luts = equalization_lut(compute_histogram(image, per_channel=True))
+        for channel, lut in enumerate(luts):
+            np.take(lut, image[:, :, channel], out=out[:, :, channel])
+    else:
+        np.take(equalization_lut(image_statistics(image).histogram), image, out=out)
+
+    return out
+
+@profiled
+@switchable('equalize')
+@cached('equalize')
+def histogram_equalization(image):
+    return Image.fromarray(histogram_equalization_array(np.asarray(image)))
+
+def _tile_edges(length, tiles):
+    edges = np.linspace(0, length, tiles + 1).astype(np.intp)
+    centers = (edges[:-1] + edges[1:] - 1) / 2
+    return edges, centers
+
+def _interpolation_weights(length, centers):
+    # Index of the last tile centre at or below each position, the next
+    # centre above it, and the bilinear weight of that second one; outside
+    # the outer centres the nearest tile is used on its own.
+    positions = np.arange(length)
+    lower = np.clip(np.searchsorted(centers, positions, side='right') - 1, 0, len(centers) - 1)
+    upper = np.minimum(lower + 1, len(centers) - 1)
+    span = np.where(upper > lower, centers[upper] - centers[lower], 1)
+    weight = np.clip((positions - centers[lower]) / span, 0, 1).astype(np.float32)
+    return lower, upper, weight
+
+@profiled
+def clahe_array(image, tiles=(8, 8), clip_limit=2.0):
+    """
+    Contrast-limited adaptive histogram equalization of a grayscale image.
+    Every tile of the `tiles` (rows, columns) grid gets its own clipped
+    equalization LUT, and each pixel blends the LUTs of its four nearest tile
+    centres bilinearly. `clip_limit` is a multiple of the mean bin count;
+    clipped counts are spread evenly over all bins.
+    """
+    image = np.asarray(image)
+    height, width = image.shape
+    tile_rows, tile_cols = tiles
+    row_edges, row_centers = _tile_edges(height, tile_rows)
+    col_edges, col_centers = _tile_edges(width, tile_cols)
+
+    # All tile histograms in a single bincount pass.
+    row_tile = np.repeat(np.arange(tile_rows), np.diff(row_edges))
+    col_tile = np.repeat(np.arange(tile_cols), np.diff(col_edges))
+    tile_index = row_tile[:, None] * tile_cols + col_tile[None, :]
+    histograms = np.bincount((tile_index * 256 + image).ravel(), minlength=tile_rows * tile_cols * 256)
+    histograms = histograms.reshape(tile_rows * tile_cols, 256).astype(np.float64)
+
+    areas = histograms.sum(axis=1, keepdims=True)
+    if clip_limit is not None:
+        limits = np.maximum(clip_limit * areas / 256, 1)
+        excess = np.maximum(histograms - limits, 0).sum(axis=1, keepdims=True)
+        histograms = np.minimum(histograms, limits) + excess / 256
+
+    luts = (compute_cdf(histograms) * 255 / np.maximum(areas, 1)).astype(np.float32).ravel()
+
+    top, bottom, row_weight = _interpolation_weights(height, row_centers)
+    left, right, col_weight = _interpolation_weights(width, col_centers)
+
+    result = np.empty_like(image, dtype=np.uint8)
+    band_height = max(1, height // tile_rows)
+    for start in range(0, height, band_height):
+        rows = slice(start, start + band_height)
+        pixels = image[rows].astype(np.intp)
+        wy = row_weight[rows, None]
+        top_row = top[rows, None] * tile_cols
+        bottom_row = bottom[rows, None] * tile_cols
+
+        upper_blend = ((1 - col_weight) * luts[(top_row + left) * 256 + pixels]
+                       + col_weight * luts[(top_row + right) * 256 + pixels])
+        lower_blend = ((1 - col_weight) * luts[(bottom_row + left) * 256 + pixels]
+                       + col_weight * luts[(bottom_row + right) * 256 + pixels])
+        result[rows] = np.clip(np.rint((1 - wy) * upper_blend + wy * lower_blend), 0, 255)
+        report(min(start + band_height, height), height)
+
+    return result
 
-    return Image.fromarray(equalized_image)
+@profiled
+@switchable('clahe')
+@cached('clahe')
+def clahe(image, tiles=(8, 8), clip_limit=2.0):
+    return Image.fromarray(clahe_array(np.asarray(image), tiles, clip_limit))
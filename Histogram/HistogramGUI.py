@@ -1,12 +1,19 @@
+import os
+import sys
 import tkinter as tk
 from tkinter import filedialog
 from PIL import Image, ImageTk, ImageOps
-from Histogram import compute_histogram, histogram_equalization
-import matplotlib.pyplot as plt
-import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Histogram.Histogram import compute_histogram, histogram_equalization, clahe
+from Core.Lazy import lazy_import
+from Core.Session import Session
+from Core.Statistics import image_statistics
+from Core.Worker import Worker
+
+plt = lazy_import('matplotlib.pyplot')
 
 class HistogramGUI:
-    def __init__(self, master):
+    def __init__(self, master, session=None):
         self.master = master
         self.master.title("Histogram Operations")
         
@@ -28,6 +35,9 @@ class HistogramGUI:
         
         self.equalize_btn = tk.Button(self.controls, text="Equalize Histogram", command=self.equalize_histogram, state=tk.DISABLED)
         self.equalize_btn.pack(pady=5)
+
+        self.clahe_btn = tk.Button(self.controls, text="CLAHE", command=self.apply_clahe, state=tk.DISABLED)
+        self.clahe_btn.pack(pady=5)
         
         self.equalized_histogram_btn = tk.Button(self.controls, text="Show Equalized Histogram", command=self.show_equalized_histogram, state=tk.DISABLED)
         self.equalized_histogram_btn.pack(pady=5)
@@ -47,20 +57,29 @@ class HistogramGUI:
         self.reset_btn = tk.Button(self.controls, text="Reset to Original", bg="#000080", fg="white", command=self.reset_to_original, state=tk.DISABLED)
         self.reset_btn.pack(pady=5)
         
+        self.worker = Worker(master, self.controls, self.display_image, on_move=self.forget_equalized)
+
         self.image = None
         self.gray_image = None
         self.equalized_image = None
+        self.session = session or Session()
+        self.session.subscribe(self.show_image)
 
     def upload_image(self):
         file_path = filedialog.askopenfilename(filetypes=[("Image Files", "*.png *.jpg *.jpeg *.bmp")])
         if file_path:
-            img = Image.open(file_path)
-            img.thumbnail((400, 400))
-            self.image = img
-            self.display_image(img)
-            self.grayscale_btn.config(state=tk.NORMAL)
-            self.threshold_btn.config(state=tk.NORMAL)
-            self.reset_btn.config(state=tk.NORMAL)
+            self.session.open(file_path)
+
+    def show_image(self, session):
+        self.worker.reset()
+        self.forget_equalized()
+        self.source = session.source
+        img = session.thumbnail
+        self.image = img
+        self.display_image(img)
+        self.grayscale_btn.config(state=tk.NORMAL)
+        self.threshold_btn.config(state=tk.NORMAL)
+        self.reset_btn.config(state=tk.NORMAL)
 
     def display_image(self, img):
         img_tk = ImageTk.PhotoImage(img)
@@ -71,33 +90,45 @@ class HistogramGUI:
         if self.image:
             gray = ImageOps.grayscale(self.image)
             self.gray_image = gray
+            self.gray_source = self.session.grayscale()
             self.display_image(gray)
             self.histogram_btn.config(state=tk.NORMAL)
             self.equalize_btn.config(state=tk.NORMAL)
+            self.clahe_btn.config(state=tk.NORMAL)
             self.analyze_histogram_btn.config(state=tk.NORMAL)
 
     def calculate_threshold(self):
         if self.gray_image:
-            np_image = np.array(self.gray_image)
-            threshold = np.mean(np_image)
+            threshold = image_statistics(self.gray_image).mean
             optimal = "Optimal" if threshold > 127 else "Not Optimal"
             self.threshold_label.config(text=f"Threshold: {threshold:.2f} ({optimal})")
 
     def show_histogram(self):
         if self.gray_image:
-            histogram = compute_histogram(self.gray_image)
+            histogram = image_statistics(self.gray_image).histogram
             plt.bar(range(256), histogram, color='gray')
             plt.title("Original Histogram")
             plt.xlabel("Pixel Intensity")
             plt.ylabel("Frequency")
             plt.show()
 
+    def show_equalized(self, equalized):
+        self.equalized_image = equalized
+        self.display_image(equalized)
+        self.equalized_histogram_btn.config(state=tk.NORMAL)
+
+    def forget_equalized(self):
+        # The equalized image is only known again once a step showing one is current.
+        self.equalized_image = None
+        self.equalized_histogram_btn.config(state=tk.DISABLED)
+
     def equalize_histogram(self):
         if self.gray_image:
-            equalized = histogram_equalization(self.gray_image)
-            self.equalized_image = equalized
-            self.display_image(equalized)
-            self.equalized_histogram_btn.config(state=tk.NORMAL)
+            self.worker.run_progressive(histogram_equalization, self.gray_image, self.gray_source, self.show_equalized)
+
+    def apply_clahe(self):
+        if self.gray_image:
+            self.worker.run_progressive(clahe, self.gray_image, self.gray_source, self.show_equalized)
 
     def show_equalized_histogram(self):
         if self.equalized_image:
@@ -110,7 +141,7 @@ class HistogramGUI:
 
     def analyze_histogram(self):
         if self.gray_image:
-            histogram = compute_histogram(self.gray_image)
+            histogram = image_statistics(self.gray_image).histogram
             total_pixels = sum(histogram)
             uniformity = sum(1 for count in histogram if count > total_pixels * 0.01) / 256
             
@@ -122,6 +153,7 @@ class HistogramGUI:
             self.analysis_label.config(text=analysis)
 
     def reset_to_original(self):
+        self.worker.reset()
         if self.image:
             self.display_image(self.image)
             self.gray_image = None
@@ -129,6 +161,7 @@ class HistogramGUI:
             # Reset button states
             self.histogram_btn.config(state=tk.DISABLED)
             self.equalize_btn.config(state=tk.DISABLED)
+            self.clahe_btn.config(state=tk.DISABLED)
             self.equalized_histogram_btn.config(state=tk.DISABLED)
             self.analyze_histogram_btn.config(state=tk.DISABLED)
             self.threshold_label.config(text="Threshold: N/A")
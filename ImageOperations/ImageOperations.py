@@ -1,49 +1,230 @@
+import functools
+import os
+import sys
+
 import numpy as np
 from PIL import Image, ImageOps
 
-def add_images(image):
-    np_image = np.array(image, dtype=np.float32)
-    np_copy = np.copy(np_image)
-    height, width = np_image.shape[:2]
-    
-    result = np.zeros_like(np_image)
-    for i in range(height):
-        for j in range(width):
-            if len(np_image.shape) == 3:
-                for c in range(3):  # RGB channels
-                    result[i,j,c] = min(np_image[i,j,c] + np_copy[i,j,c], 255)
-            else:
-                result[i,j] = min(np_image[i,j] + np_copy[i,j], 255)
-                
-    return Image.fromarray(result.astype(np.uint8))
-
-def subtract_images(image):
-    np_image = np.array(image, dtype=np.float32)
-    np_copy = np.copy(np_image)
-    height, width = np_image.shape[:2]
-    
-    result = np.zeros_like(np_image)
-    for i in range(height):
-        for j in range(width):
-            if len(np_image.shape) == 3:
-                for c in range(3):
-                    result[i,j,c] = max(np_image[i,j,c] - np_copy[i,j,c], 0)
-            else:
-                result[i,j] = max(np_image[i,j] - np_copy[i,j], 0)
-                
-    return Image.fromarray(result.astype(np.uint8))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Core.Backends import switchable
+from Core.Cache import cached
+from Core.Profiling import profiled
+from Core.Progress import report
+
+# Pixels (times channels) per band of the operations that need a uint16
+# intermediate, which bounds that temporary at twice this many bytes.
+BAND_PIXELS = 2 ** 20
+
+
+def _operands(first, second, out):
+    """
+    uint8 operands broadcast against each other, with a single-channel image
+    repeated over the channels of the other, and the uint8 output buffer.
+    """
+    first, second = np.asarray(first), np.asarray(second)
+    if first.dtype != np.uint8 or second.dtype != np.uint8:
+        raise ValueError(f"Image arithmetic needs uint8 operands, got {first.dtype} and {second.dtype}")
+    if first.ndim == 2 and second.ndim == 3:
+        first = first[:, :, np.newaxis]
+    elif second.ndim == 2 and first.ndim == 3:
+        second = second[:, :, np.newaxis]
+    try:
+        shape = np.broadcast(first, second).shape
+    except ValueError:
+        raise ValueError(f"Cannot combine images of shapes {first.shape} and {second.shape}") from None
+
+    if out is None:
+        out = np.empty(shape, dtype=np.uint8)
+    elif np.may_share_memory(out, second):
+        # Only the first operand may be overwritten while it is still read.
+        second = second.copy()
+    return first, second, out
+
+
+def _bands(shape):
+    # Row slices of about BAND_PIXELS values each, reporting progress.
+    height = shape[0]
+    band_height = max(BAND_PIXELS // max(int(np.prod(shape[1:])), 1), 1)
+    for top in range(0, height, band_height):
+        yield slice(top, min(top + band_height, height))
+        report(min(top + band_height, height), height)
+
+
+def _divide_by_255(values, out):
+    # round(values / 255) for uint16 values up to 255 * 255 + 127, exactly,
+    # with shifts instead of a division.
+    values += 128
+    values += values >> 8
+    np.right_shift(values, 8, out=out, casting='unsafe')
+
+
+@profiled
+def add_array(first, second, out=None):
+    """
+    first + second, saturating at 255. The result is written into `out`
+    when one is given, which may be `first` itself.
+    """
+    first, second, out = _operands(first, second, out)
+    # min(a + b, 255) == 255 - max(255 - a - b, 0), with no wider type.
+    np.invert(first, out=out)
+    np.maximum(out, second, out=out)
+    np.subtract(out, second, out=out)
+    np.invert(out, out=out)
+    return out
+
+
+@profiled
+def subtract_array(first, second, out=None):
+    """
+    first - second, saturating at 0.
+    """
+    first, second, out = _operands(first, second, out)
+    np.maximum(first, second, out=out)
+    np.subtract(out, second, out=out)
+    return out
+
+
+@profiled
+def absdiff_array(first, second, out=None):
+    """
+    |first - second|, as used for frame differencing.
+    """
+    first, second, out = _operands(first, second, out)
+    smaller = np.minimum(first, second)
+    np.maximum(first, second, out=out)
+    np.subtract(out, smaller, out=out)
+    return out
+
+
+@profiled
+def multiply_array(first, second, out=None):
+    """
+    first * second / 255, rounded: multiplying by white keeps an image and
+    by black clears it.
+    """
+    first, second, out = _operands(first, second, out)
+    for band in _bands(out.shape):
+        product = np.multiply(first[band], second[band], dtype=np.uint16)
+        _divide_by_255(product, out[band])
+    return out
+
+
+@profiled
+def blend_array(first, second, alpha=0.5, out=None):
+    """
+    (1 - alpha) * first + alpha * second, rounded, with `alpha` between 0
+    and 1 quantised to 1/255.
+    """
+    if not 0 <= alpha <= 1:
+        raise ValueError(f"Blend weight must be between 0 and 1, got {alpha}")
+    weight = round(alpha * 255)
+    first, second, out = _operands(first, second, out)
+    for band in _bands(out.shape):
+        mixed = np.empty(out[band].shape, dtype=np.uint16)
+        np.multiply(first[band], np.uint16(255 - weight), out=mixed)
+        mixed += np.multiply(second[band], np.uint16(weight), dtype=np.uint16)
+        _divide_by_255(mixed, out[band])
+    return out
+
+
+@profiled
+def invert_array(image, out=None):
+    """
+    255 - image.
+    """
+    return np.invert(np.asarray(image, dtype=np.uint8), out=out)
+
+
+def _as_array(image):
+    if image.mode not in ('L', 'RGB', 'RGBA'):
+        image = image.convert('RGB' if image.mode == 'P' or len(image.getbands()) > 1 else 'L')
+    return np.asarray(image)
+
+
+def _image_operands(image, other):
+    """
+    The arrays of `image` and `other`, or of the image twice when there is
+    no `other`.
+    """
+    first = _as_array(image)
+    return first, (first if other is None else _as_array(other))
+
+
+def _opens_other(function):
+    """
+    Open `other` when it is a path and resize it to match the image before
+    calling the decorated operator, so the result cache keys on its pixels
+    rather than on a path whose file may change.
+    """
+    @functools.wraps(function)
+    def wrapper(image, other=None, *args, **kwargs):
+        if isinstance(other, (str, os.PathLike)):
+            other = Image.open(other)
+        if other is not None and other.size != image.size:
+            other = other.resize(image.size, Image.BILINEAR)
+        return function(image, other, *args, **kwargs)
+    return wrapper
+
+
+@profiled
+@_opens_other
+@switchable('add')
+@cached('add')
+def add_images(image, other=None):
+    """
+    Add `other` to the image, clipping at white. Without `other` the image
+    is added to a copy of itself.
+    """
+    return Image.fromarray(add_array(*_image_operands(image, other)))
+
+
+@profiled
+@_opens_other
+@switchable('subtract')
+@cached('subtract')
+def subtract_images(image, other=None):
+    """
+    Subtract `other` from the image, clipping at black, e.g. to remove a
+    background. Without `other` the image is subtracted from a copy of itself.
+    """
+    return Image.fromarray(subtract_array(*_image_operands(image, other)))
+
+
+@profiled
+@_opens_other
+@switchable('absdiff')
+@cached('absdiff')
+def absdiff_images(image, other=None):
+    """
+    Absolute difference between the image and `other`.
+    """
+    return Image.fromarray(absdiff_array(*_image_operands(image, other)))
+
+
+@profiled
+@_opens_other
+@switchable('multiply')
+@cached('multiply')
+def multiply_images(image, other=None):
+    """
+    Multiply the image by `other`, both taken as fractions of white.
+    """
+    return Image.fromarray(multiply_array(*_image_operands(image, other)))
+
+
+@profiled
+@_opens_other
+@switchable('blend')
+@cached('blend')
+def blend_images(image, other=None, alpha=0.5):
+    """
+    Mix the image with `other`, `alpha` being the weight of `other`.
+    """
+    return Image.fromarray(blend_array(*_image_operands(image, other), alpha))
+
 
+@profiled
+@switchable('invert')
+@cached('invert')
 def invert_image(image):
-    np_image = np.array(image, dtype=np.float32)
-    height, width = np_image.shape[:2]
-    
-    result = np.zeros_like(np_image)
-    for i in range(height):
-        for j in range(width):
-            if len(np_image.shape) == 3:
-                for c in range(3):
-                    result[i,j,c] = 255 - np_image[i,j,c]
-            else:
-                result[i,j] = 255 - np_image[i,j]
-                
-    return Image.fromarray(result.astype(np.uint8))
+    return Image.fromarray(invert_array(_as_array(image)))
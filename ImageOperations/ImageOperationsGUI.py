@@ -1,11 +1,17 @@
+import os
+import sys
 import tkinter as tk
 from tkinter import filedialog
 from PIL import Image, ImageTk, ImageOps
-import numpy as np
-from ImageOperations import add_images, subtract_images, invert_image
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ImageOperations.ImageOperations import (add_images, subtract_images, absdiff_images, multiply_images,
+                                             blend_images, invert_image)
+from Core.Session import Session
+from Core.Statistics import image_statistics
+from Core.Worker import Worker
 
 class ImageOperationsGUI:
-    def __init__(self, master):
+    def __init__(self, master, session=None):
         self.master = master
         self.master.title("Image Operations")
 
@@ -19,12 +25,33 @@ class ImageOperationsGUI:
         self.upload_btn = tk.Button(self.controls, text="+ Upload Image", bg="green", fg="white", command=self.upload_image)
         self.upload_btn.pack(pady=5)
 
-        self.add_btn = tk.Button(self.controls, text="Add Image to Copy", command=self.add_image, state=tk.DISABLED)
+        # Without a second image, the two-image operations use a copy of the first.
+        self.second_btn = tk.Button(self.controls, text="+ Second Image", command=self.upload_second_image)
+        self.second_btn.pack(pady=5)
+
+        self.second_label = tk.Label(self.controls, text="Second image: copy", font=("Arial", 10))
+        self.second_label.pack(pady=5)
+
+        self.add_btn = tk.Button(self.controls, text="Add", command=self.add_image, state=tk.DISABLED)
         self.add_btn.pack(pady=5)
 
-        self.subtract_btn = tk.Button(self.controls, text="Subtract Image from Copy", command=self.subtract_image, state=tk.DISABLED)
+        self.subtract_btn = tk.Button(self.controls, text="Subtract", command=self.subtract_image, state=tk.DISABLED)
         self.subtract_btn.pack(pady=5)
 
+        self.absdiff_btn = tk.Button(self.controls, text="Absolute Difference", command=self.absdiff_image, state=tk.DISABLED)
+        self.absdiff_btn.pack(pady=5)
+
+        self.multiply_btn = tk.Button(self.controls, text="Multiply", command=self.multiply_image, state=tk.DISABLED)
+        self.multiply_btn.pack(pady=5)
+
+        self.blend_btn = tk.Button(self.controls, text="Blend", command=self.blend_image, state=tk.DISABLED)
+        self.blend_btn.pack(pady=5)
+
+        self.blend_alpha = tk.DoubleVar(value=0.5)
+        self.blend_scale = tk.Scale(self.controls, from_=0.0, to=1.0, resolution=0.05, orient=tk.HORIZONTAL,
+                                    label="Blend weight", variable=self.blend_alpha)
+        self.blend_scale.pack(pady=5)
+
         self.invert_btn = tk.Button(self.controls, text="Invert Image", command=self.invert_image, state=tk.DISABLED)
         self.invert_btn.pack(pady=5)
 
@@ -37,23 +64,42 @@ class ImageOperationsGUI:
         self.threshold_label = tk.Label(self.controls, text="Threshold: N/A", font=("Arial", 12))
         self.threshold_label.pack(pady=5)
 
+        self.worker = Worker(master, self.controls, self.display_image)
+
         self.image = None
         self.original_image = None
         self.gray_image = None
+        self.second_image = None
+        self.session = session or Session()
+        self.session.subscribe(self.show_image)
 
     def upload_image(self):
         file_path = filedialog.askopenfilename(filetypes=[("Image Files", "*.png *.jpg *.jpeg *.bmp")])
         if file_path:
-            img = Image.open(file_path)
-            img.thumbnail((400, 400))
-            self.image = img
-            self.original_image = img.copy()
-            self.display_image(img)
-            self.add_btn.config(state=tk.NORMAL)
-            self.subtract_btn.config(state=tk.NORMAL)
-            self.invert_btn.config(state=tk.NORMAL)
-            self.reset_btn.config(state=tk.NORMAL)
-            self.threshold_btn.config(state=tk.NORMAL)
+            self.session.open(file_path)
+
+    def upload_second_image(self):
+        file_path = filedialog.askopenfilename(filetypes=[("Image Files", "*.png *.jpg *.jpeg *.bmp")])
+        if file_path:
+            self.second_image = Image.open(file_path)
+            self.second_image.load()
+            self.second_label.config(text=f"Second image: {os.path.basename(file_path)}")
+
+    def show_image(self, session):
+        self.worker.reset()
+        self.source = session.source
+        img = session.thumbnail
+        self.image = img
+        self.original_image = img.copy()
+        self.display_image(img)
+        self.add_btn.config(state=tk.NORMAL)
+        self.subtract_btn.config(state=tk.NORMAL)
+        self.absdiff_btn.config(state=tk.NORMAL)
+        self.multiply_btn.config(state=tk.NORMAL)
+        self.blend_btn.config(state=tk.NORMAL)
+        self.invert_btn.config(state=tk.NORMAL)
+        self.reset_btn.config(state=tk.NORMAL)
+        self.threshold_btn.config(state=tk.NORMAL)
 
     def display_image(self, img):
         img_tk = ImageTk.PhotoImage(img)
@@ -62,28 +108,42 @@ class ImageOperationsGUI:
 
     def add_image(self):
         if self.image:
-            added_image = add_images(self.image)
-            self.display_image(added_image)
+            self.worker.run_progressive(add_images, self.image, self.source, self.display_image,
+                                        other=self.second_image)
 
     def subtract_image(self):
         if self.image:
-            subtracted_image = subtract_images(self.image)
-            self.display_image(subtracted_image)
+            self.worker.run_progressive(subtract_images, self.image, self.source, self.display_image,
+                                        other=self.second_image)
+
+    def absdiff_image(self):
+        if self.image:
+            self.worker.run_progressive(absdiff_images, self.image, self.source, self.display_image,
+                                        other=self.second_image)
+
+    def multiply_image(self):
+        if self.image:
+            self.worker.run_progressive(multiply_images, self.image, self.source, self.display_image,
+                                        other=self.second_image)
+
+    def blend_image(self):
+        if self.image:
+            self.worker.run_progressive(blend_images, self.image, self.source, self.display_image,
+                                        other=self.second_image, alpha=self.blend_alpha.get())
 
     def invert_image(self):
         if self.image:
-            inverted_image = invert_image(self.image)
-            self.display_image(inverted_image)
+            self.worker.run_progressive(invert_image, self.image, self.source, self.display_image)
 
     def reset_image(self):
+        self.worker.reset()
         if self.original_image:
             self.image = self.original_image.copy()
             self.display_image(self.image)
 
     def calculate_threshold(self):
         if self.image:
-            np_image = np.array(self.image)
-            threshold = np.mean(np_image)
+            threshold = image_statistics(self.image).mean
             optimal = "Optimal" if threshold > 127 else "Not Optimal"
             self.threshold_label.config(text=f"Threshold: {threshold:.2f} ({optimal})")
 
@@ -1,6 +1,24 @@
+import importlib
 import tkinter as tk
 from tkinter import messagebox
-import subprocess
+
+from Core.Session import Session
+
+# Label, module and class of every tool. A tool's module is only imported
+# the first time it is opened.
+TOOLS = [
+    ("Basic Operations", "BasicOperations.BasicGUI", "BasicGUI"),
+    ("Simple Edge Detection", "SimpleEdgeDetection.EdgeDetectionGUI", "EdgeDetectionGUI"),
+    ("Segmentation", "Segmentation.SegmentationGUI", "SegmentationGUI"),
+    ("Image Operations", "ImageOperations.ImageOperationsGUI", "ImageOperationsGUI"),
+    ("Histogram", "Histogram.HistogramGUI", "HistogramGUI"),
+    ("Halftoning", "Halftoning.HalftoningGUI", "HalftoningGUI"),
+    ("Filtering", "Filtering.FilterGUI", "FilterGUI"),
+    ("Advanced Edge Detection 1\n(Contrast-based edge detection, DoG 7*7 & 9*9)",
+     "AdvancedEdgeDetection.EdgeDetectionGUI", "EdgeDetectionGUI"),
+    ("Advanced Edge Detection 2\n(Homogeneity operator, Difference operator, Variance, Range)",
+     "AdvancedEdgeDetection.EdgeDetection2GUI", "EdgeDetectionGUI"),
+]
 
 class MainGUI:
     def __init__(self, master):
@@ -34,20 +52,14 @@ class MainGUI:
         self.button_frame = tk.Frame(self.master, bg=bg_color)
         self.button_frame.pack(fill="both", expand=True, padx=20, pady=10)
         
-        buttons = [
-            ("Basic Operations", self.open_basic_gui),
-            ("Simple Edge Detection", self.open_simple_edge_gui),
-            ("Segmentation", self.open_segmentation_gui),
-            ("Image Operations", self.open_image_operations_gui),
-            ("Histogram", self.open_histogram_gui),
-            ("Halftoning", self.open_halftoning_gui),
-            ("Filtering", self.open_filtering_gui),
-            ("Advanced Edge Detection 1\n(Contrast-based edge detection, DoG 7*7 & 9*9)", self.open_advanced_edge_gui),
-            ("Advanced Edge Detection 2\n(Homogeneity operator, Difference operator, Variance, Range)", self.open_advanced_edge2_gui)
-        ]
-        
-        for idx, (text, command) in enumerate(buttons):
-            self.create_button(text, command, "#000080", idx)
+        # Every tool runs in this process as a window of its own, and they
+        # all work on the image loaded into the shared session.
+        self.session = Session()
+        self.tools = {}
+
+        for idx, (text, module_name, class_name) in enumerate(TOOLS):
+            self.create_button(text, lambda module_name=module_name, class_name=class_name:
+                               self.open_tool(module_name, class_name), "#000080", idx)
 
     def create_button(self, text, command, color, row):
         button = tk.Button(self.button_frame, 
@@ -66,33 +78,30 @@ class MainGUI:
     def on_frame_configure(self, event):
         self.canvas.configure(scrollregion=self.canvas.bbox("all"))
 
-    # GUI files
-    def open_basic_gui(self):
-        subprocess.Popen(["python", "BasicOperations/BasicGUI.py"])
-
-    def open_simple_edge_gui(self):
-        subprocess.Popen(["python", "SimpleEdgeDetection/EdgeDetectionGUI.py"])
-
-    def open_segmentation_gui(self):
-        subprocess.Popen(["python", "Segmentation/SegmentationGUI.py"])
-
-    def open_image_operations_gui(self):
-        subprocess.Popen(["python", "ImageOperations/ImageOperationsGUI.py"])
-
-    def open_histogram_gui(self):
-        subprocess.Popen(["python", "Histogram/HistogramGUI.py"])
-
-    def open_halftoning_gui(self):
-        subprocess.Popen(["python", "Halftoning/HalftoningGUI.py"])
-
-    def open_filtering_gui(self):
-        subprocess.Popen(["python", "Filtering/FilterGUI.py"])
+    def open_tool(self, module_name, class_name):
+        # A tool that is already open is brought to the front instead.
+        if module_name in self.tools:
+            window, _ = self.tools[module_name]
+            window.deiconify()
+            window.lift()
+            return
 
-    def open_advanced_edge_gui(self):
-        subprocess.Popen(["python", "AdvancedEdgeDetection/EdgeDetectionGUI.py"])
+        try:
+            tool_class = getattr(importlib.import_module(module_name), class_name)
+        except ImportError as error:
+            messagebox.showerror("Cannot open tool", str(error), parent=self.master)
+            return
+        window = tk.Toplevel(self.master)
+        tool = tool_class(window, session=self.session)
+        window.protocol("WM_DELETE_WINDOW", lambda: self.close_tool(module_name))
+        self.tools[module_name] = (window, tool)
 
-    def open_advanced_edge2_gui(self):
-        subprocess.Popen(["python", "AdvancedEdgeDetection/EdgeDetection2GUI.py"])
+    def close_tool(self, module_name):
+        window, tool = self.tools.pop(module_name)
+        self.session.unsubscribe(tool.show_image)
+        if hasattr(tool, "worker"):
+            tool.worker.close()
+        window.destroy()
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -1,109 +1,172 @@
+import os
+import sys
+
 import numpy as np
 from PIL import Image
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Core.Backends import switchable
+from Core.Cache import cached
+from Core.MemoryMapped import map_operator_file, open_gray
+from Core.Profiling import profiled
+from Core.Statistics import image_statistics
+
+@profiled
+def binarize(np_image, threshold, out=None):
+    """
+    Set values above `threshold` to 255 and the rest to 0, as uint8.
+    The result is written into `out` when one is given.
+    """
+    if out is None:
+        out = np.empty(np_image.shape, dtype=np.uint8)
+    np.greater(np_image, threshold, out=out.view(bool))
+    np.multiply(out, 255, out=out)
+    return out
+
+@profiled
+def manual_threshold_array(np_image, threshold=128, out=None):
+    return binarize(np_image, threshold, out)
+
+@profiled
+@switchable('manual-threshold')
+@cached('manual-threshold')
 def manual_threshold(image, threshold=128):
     """
     Apply manual thresholding technique.
     Threshold values above `threshold` are set to 255, others to 0.
     """
-    np_image = np.array(image)
-    segmented_image = np.where(np_image > threshold, 255, 0)
-    return Image.fromarray(segmented_image.astype(np.uint8))
+    return Image.fromarray(manual_threshold_array(np.array(image), threshold))
+
+@profiled
+def histogram_peak_threshold_array(np_image, out=None):
+    return binarize(np_image, image_statistics(np_image).peak, out)
 
+@profiled
+@switchable('peak-threshold')
+@cached('peak-threshold')
 def histogram_peak_threshold(image):
     """
     Apply histogram peak technique for segmentation.
     The peak of the histogram is found and used as the threshold.
     """
-    np_image = np.array(image)
-    
-    hist = np.zeros(256)
-    for pixel in np_image.flatten():
-        hist[pixel] += 1
-    
-    peak = 0
-    max_count = 0
-    for i in range(256):
-        if hist[i] > max_count:
-            max_count = hist[i]
-            peak = i
-
-    segmented_image = np.where(np_image > peak, 255, 0)
-    return Image.fromarray(segmented_image.astype(np.uint8))
+    return Image.fromarray(histogram_peak_threshold_array(np.array(image)))
+
+@profiled
+def histogram_valley_threshold_array(np_image, out=None):
+    return binarize(np_image, image_statistics(np_image).valley, out)
 
+@profiled
+@switchable('valley-threshold')
+@cached('valley-threshold')
 def histogram_valley_threshold(image):
     """
     Apply histogram valley technique for segmentation.
-    Find valleys in the histogram and use them as threshold.
+    Find valleys in the smoothed histogram and use the first as threshold.
     """
-    np_image = np.array(image)
-    
-    hist = np.zeros(256)
-    for pixel in np_image.flatten():
-        hist[pixel] += 1
-    
-    # Smooth histogram to reduce noise
-    window_size = 5
-    smoothed_hist = np.zeros(256)
-    for i in range(256):
-        start = max(0, i - window_size//2)
-        end = min(256, i + window_size//2 + 1)
-        smoothed_hist[i] = np.mean(hist[start:end])
-    
-    valleys = []
-    for i in range(1, 255):
-        if smoothed_hist[i-1] > smoothed_hist[i] < smoothed_hist[i+1]:
-            valleys.append(i)
-    
-    valley_threshold = valleys[0] if valleys else 0
-
-    segmented_image = np.where(np_image > valley_threshold, 255, 0)
-    return Image.fromarray(segmented_image.astype(np.uint8))
-
-def adaptive_histogram_threshold(image):
+    return Image.fromarray(histogram_valley_threshold_array(np.array(image)))
+
+@profiled
+def otsu_threshold_array(np_image, out=None):
+    return binarize(np_image, image_statistics(np_image).otsu, out)
+
+@profiled
+@switchable('otsu-threshold')
+@cached('otsu-threshold')
+def otsu_threshold(image):
+    """
+    Apply Otsu's method for segmentation.
+    The threshold maximizes the between-class variance of the histogram.
+    """
+    return Image.fromarray(otsu_threshold_array(np.array(image)))
+
+def _window_sums(np_image, window_size):
+    """
+    Window sum and sum of squares around every pixel, read from summed-area
+    tables of the reflect-padded image. Each lookup is O(1) per pixel
+    whatever the window size.
+    """
+    padding = window_size // 2
+    pad_width = [(padding, padding), (padding, padding)] + [(0, 0)] * (np_image.ndim - 2)
+    padded_image = np.pad(np_image.astype(np.int64), pad_width, mode='reflect')
+
+    height, width = np_image.shape[:2]
+    sums = []
+    for values in (padded_image, padded_image * padded_image):
+        table = np.zeros((values.shape[0] + 1, values.shape[1] + 1) + values.shape[2:], dtype=np.int64)
+        np.cumsum(np.cumsum(values, axis=0), axis=1, out=table[1:, 1:])
+        sums.append(table[window_size:window_size + height, window_size:window_size + width]
+                    - table[:height, window_size:window_size + width]
+                    - table[window_size:window_size + height, :width]
+                    + table[:height, :width])
+    return sums
+
+@profiled
+def adaptive_histogram_threshold_array(np_image, window_size=35, offset=-10, method='mean', k=None, r=128):
     """
     Apply adaptive histogram technique for segmentation.
-    Uses local mean for adaptive thresholding.
+    The local threshold is computed over a `window_size` x `window_size`
+    window and `offset` is added to it:
+      - 'mean':    local mean
+      - 'niblack': mean + k * std (k defaults to -0.2)
+      - 'sauvola': mean * (1 + k * (std / r - 1)) (k defaults to 0.5)
+    Pixels above the threshold keep their value, others are set to 0.
+    RGB images are thresholded per channel.
     """
+    if window_size < 1 or window_size % 2 == 0:
+        raise ValueError(f"Window size must be a positive odd number, got {window_size}")
+
+    area = window_size * window_size
+    window_sum, window_square_sum = _window_sums(np_image, window_size)
+    mean = window_sum / area
+
+    if method == 'mean':
+        threshold = mean
+    elif method in ('niblack', 'sauvola'):
+        variance = np.maximum(window_square_sum / area - mean * mean, 0)
+        std = np.sqrt(variance)
+        if method == 'niblack':
+            threshold = mean + (-0.2 if k is None else k) * std
+        else:
+            threshold = mean * (1 + (0.5 if k is None else k) * (std / r - 1))
+    else:
+        raise ValueError(f"Unknown adaptive threshold method: {method}")
+
+    threshold += offset
+    segmented_image = np.where(np_image > threshold, np_image, 0)
+    return segmented_image.astype(np.uint8)
+
+@profiled
+@switchable('adaptive-threshold')
+@cached('adaptive-threshold')
+def adaptive_histogram_threshold(image, window_size=35, offset=-10, method='mean', k=None, r=128):
     np_image = np.array(image)
-    
-    # Handle RGB images
-    if len(np_image.shape) == 3:
-        height, width, channels = np_image.shape
-        window_size = 35
-        padding = window_size // 2
-        
-        # Process each channel separately
-        segmented_image = np.zeros_like(np_image)
-        
-        for channel in range(channels):
-            channel_data = np_image[:,:,channel]
-            padded_channel = np.pad(channel_data, padding, mode='reflect')
-            
-            for y in range(height):
-                for x in range(width):
-                    window = padded_channel[y:y+window_size, x:x+window_size]
-                    threshold = np.mean(window) - 10
-                    # Keep original pixel value if above threshold
-                    segmented_image[y, x, channel] = channel_data[y, x] if channel_data[y, x] > threshold else 0
-        
-    else:  # Grayscale image
-        height, width = np_image.shape
-        window_size = 35
-        padding = window_size // 2
-        
-        segmented_image = np.zeros_like(np_image)
-        padded_image = np.pad(np_image, padding, mode='reflect')
-        
-        for y in range(height):
-            for x in range(width):
-                window = padded_image[y:y+window_size, x:x+window_size]
-                threshold = np.mean(window) - 10
-                segmented_image[y, x] = np_image[y, x] if np_image[y, x] > threshold else 0
-    
-    return Image.fromarray(segmented_image.astype(np.uint8))
+    return Image.fromarray(adaptive_histogram_threshold_array(np_image, window_size, offset, method, k, r))
 
+@profiled
 def calculate_threshold(image):
-    np_image = np.array(image)
-    threshold = np.mean(np_image)  # Mean intensity as threshold
+    np_image = np.asarray(image)
+    if np_image.dtype != np.uint8:
+        # Beyond 8 bits the histogram would clip, so take the exact mean.
+        return float(np.mean(np_image))
+    threshold = image_statistics(np_image).mean  # Mean intensity as threshold
     return threshold
+
+# Thresholds found from the histogram of the whole image, by operator name.
+HISTOGRAM_THRESHOLDS = {'peak-threshold': 'peak', 'valley-threshold': 'valley', 'otsu-threshold': 'otsu'}
+
+
+def threshold_file(input_path, output_path, operator='otsu-threshold', band_height=1024, shape=None, **params):
+    """
+    Threshold an image file into `output_path` with `operator`:
+    'manual-threshold', 'adaptive-threshold' (with their usual parameters)
+    or the histogram-based 'peak-threshold', 'valley-threshold' and
+    'otsu-threshold', whose threshold is found from a histogram counted
+    over the whole file first. Memory-mapped input and output (see
+    Core.MemoryMapped.open_gray) are processed in row bands.
+    """
+    if operator in HISTOGRAM_THRESHOLDS:
+        statistics = image_statistics(open_gray(input_path, shape=shape))
+        operator, params = 'manual-threshold', {'threshold': getattr(statistics, HISTOGRAM_THRESHOLDS[operator])}
+    if operator not in ('manual-threshold', 'adaptive-threshold'):
+        raise ValueError(f"Unknown threshold operator: {operator}")
+    map_operator_file(operator, input_path, output_path, band_height, shape, **params)
@@ -1,13 +1,18 @@
+import os
+import sys
 import tkinter as tk
 from tkinter import filedialog
 from PIL import Image, ImageTk, ImageOps
 import numpy as np
-from Segmentation import (manual_threshold, histogram_peak_threshold, 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Segmentation.Segmentation import (manual_threshold, histogram_peak_threshold, 
                           histogram_valley_threshold, adaptive_histogram_threshold, 
-                          calculate_threshold)
+                          otsu_threshold, calculate_threshold)
+from Core.Session import Session
+from Core.Worker import Worker
 
 class SegmentationGUI:
-    def __init__(self, master):
+    def __init__(self, master, session=None):
         self.master = master
         self.master.title("Histogram-Based Segmentation")
 
@@ -30,9 +35,16 @@ class SegmentationGUI:
         self.valley_btn = tk.Button(self.controls, text="Histogram Valley Threshold", command=self.apply_valley_threshold, state=tk.DISABLED)
         self.valley_btn.pack(pady=5)
 
+        self.otsu_btn = tk.Button(self.controls, text="Otsu Threshold", command=self.apply_otsu_threshold, state=tk.DISABLED)
+        self.otsu_btn.pack(pady=5)
+
         self.adaptive_btn = tk.Button(self.controls, text="Adaptive Histogram Threshold", command=self.apply_adaptive_threshold, state=tk.DISABLED)
         self.adaptive_btn.pack(pady=5)
 
+        self.adaptive_method = tk.StringVar(value="mean")
+        self.adaptive_method_menu = tk.OptionMenu(self.controls, self.adaptive_method, "mean", "niblack", "sauvola")
+        self.adaptive_method_menu.pack(pady=5)
+
         self.reset_btn = tk.Button(self.controls, text="Reset to Original", bg="#000080", fg="white", command=self.reset_image, state=tk.DISABLED)
         self.reset_btn.pack(pady=5)
 
@@ -42,23 +54,32 @@ class SegmentationGUI:
         self.threshold_label = tk.Label(self.controls, text="Threshold: N/A", font=("Arial", 12))
         self.threshold_label.pack(pady=5)
 
+        self.worker = Worker(master, self.controls, self.display_image)
+
         self.image = None
         self.original_image = None
+        self.session = session or Session()
+        self.session.subscribe(self.show_image)
 
     def upload_image(self):
         file_path = filedialog.askopenfilename(filetypes=[("Image Files", "*.png *.jpg *.jpeg *.bmp")])
         if file_path:
-            img = Image.open(file_path)
-            img.thumbnail((400, 400))
-            self.image = img
-            self.original_image = img.copy()
-            self.display_image(img)
-            self.manual_btn.config(state=tk.NORMAL)
-            self.peak_btn.config(state=tk.NORMAL)
-            self.valley_btn.config(state=tk.NORMAL)
-            self.adaptive_btn.config(state=tk.NORMAL)
-            self.reset_btn.config(state=tk.NORMAL)
-            self.calculate_threshold_btn.config(state=tk.NORMAL)
+            self.session.open(file_path)
+
+    def show_image(self, session):
+        self.worker.reset()
+        self.source = session.source
+        img = session.thumbnail
+        self.image = img
+        self.original_image = img.copy()
+        self.display_image(img)
+        self.manual_btn.config(state=tk.NORMAL)
+        self.peak_btn.config(state=tk.NORMAL)
+        self.valley_btn.config(state=tk.NORMAL)
+        self.otsu_btn.config(state=tk.NORMAL)
+        self.adaptive_btn.config(state=tk.NORMAL)
+        self.reset_btn.config(state=tk.NORMAL)
+        self.calculate_threshold_btn.config(state=tk.NORMAL)
 
     def display_image(self, img):
         img_tk = ImageTk.PhotoImage(img)
@@ -67,25 +88,28 @@ class SegmentationGUI:
 
     def apply_manual_threshold(self):
         if self.image:
-            threshold_image = manual_threshold(self.image, threshold=128)  # 128 as example threshold
-            self.display_image(threshold_image)
+            # 128 as example threshold
+            self.worker.run_progressive(manual_threshold, self.image, self.source, self.display_image, threshold=128)
 
     def apply_peak_threshold(self):
         if self.image:
-            peak_threshold_image = histogram_peak_threshold(self.image)
-            self.display_image(peak_threshold_image)
+            self.worker.run_progressive(histogram_peak_threshold, self.image, self.source, self.display_image)
 
     def apply_valley_threshold(self):
         if self.image:
-            valley_threshold_image = histogram_valley_threshold(self.image)
-            self.display_image(valley_threshold_image)
+            self.worker.run_progressive(histogram_valley_threshold, self.image, self.source, self.display_image)
+
+    def apply_otsu_threshold(self):
+        if self.image:
+            self.worker.run_progressive(otsu_threshold, self.image, self.source, self.display_image)
 
     def apply_adaptive_threshold(self):
         if self.image:
-            adaptive_threshold_image = adaptive_histogram_threshold(self.image)
-            self.display_image(adaptive_threshold_image)
+            self.worker.run_progressive(adaptive_histogram_threshold, self.image, self.source, self.display_image,
+                                        method=self.adaptive_method.get())
 
     def reset_image(self):
+        self.worker.reset()
         if self.original_image:
             self.image = self.original_image.copy()
             self.display_image(self.image)
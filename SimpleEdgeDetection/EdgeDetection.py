@@ -1,125 +1,217 @@
+import os
+import sys
+
 import numpy as np
-import cv2
 from PIL import Image, ImageOps
 
-def sobel_operator(image):
-    image = np.array(image, dtype=np.float32)
-    result_image = np.zeros_like(image, dtype=np.float32)
-    height, width = image.shape
-
-    sobel_x_mask = np.array([
-        [-1, 0, 1],
-        [-2, 0, 2],
-        [-1, 0, 1]
-    ])
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Core.Backends import switchable
+from Core.Cache import cached
+from Core.Lazy import lazy_import
+from Core.Profiling import profiled
 
-    sobel_y_mask = np.array([
-        [-1, -2, -1],
-        [0, 0, 0],
-        [1, 2, 1]
-    ])
+cv2 = lazy_import('cv2')
 
-    ix = cv2.filter2D(image, -1, sobel_x_mask).astype(np.float32)
-    iy = cv2.filter2D(image, -1, sobel_y_mask).astype(np.float32)
-
-    magnitude = np.sqrt(ix ** 2 + iy ** 2).astype(np.float32)
-    threshold = np.mean(magnitude)
+GRADIENT_MASKS = {
+    'sobel': (
+        np.array([
+            [-1, 0, 1],
+            [-2, 0, 2],
+            [-1, 0, 1]
+        ], dtype=np.float32),
+        np.array([
+            [-1, -2, -1],
+            [0, 0, 0],
+            [1, 2, 1]
+        ], dtype=np.float32),
+    ),
+    'prewitt': (
+        np.array([
+            [-1, 0, 1],
+            [-1, 0, 1],
+            [-1, 0, 1]
+        ], dtype=np.float32),
+        np.array([
+            [-1, -1, -1],
+            [0, 0, 0],
+            [1, 1, 1]
+        ], dtype=np.float32),
+    ),
+}
+
+
+class Gradients:
+    """
+    Gradient fields of one image: the x and y derivatives, the gradient
+    magnitude and optionally the quantized direction. Pass it back as `out`
+    to compute_gradients to reuse its buffers for the next image of the
+    same size.
+    """
+
+    def __init__(self, shape):
+        self.ix = np.empty(shape, dtype=np.float32)
+        self.iy = np.empty(shape, dtype=np.float32)
+        self.magnitude = np.empty(shape, dtype=np.float32)
+        self.direction = None
+        self._scratch = np.empty(shape, dtype=np.float32)
+
+
+@profiled
+def compute_gradients(image, operator='sobel', norm='l2', direction_bins=None, out=None):
+    """
+    Both derivatives of `image` for the 'sobel' or 'prewitt' masks, and the
+    gradient magnitude with the 'l2', 'l1' or 'max' norm.
+    With `direction_bins` set, `direction` holds the gradient angle quantized
+    into that many equal sectors of the full circle, sector 0 centred on the
+    +x axis and counting towards +y.
+    """
+    if operator not in GRADIENT_MASKS:
+        raise ValueError(f"Unknown gradient operator: {operator}")
+    image = np.asarray(image)
+    if image.dtype not in (np.uint8, np.float32):
+        image = image.astype(np.float32)
+
+    gradients = out if out is not None and out.ix.shape == image.shape else Gradients(image.shape)
+    ix, iy, magnitude, scratch = gradients.ix, gradients.iy, gradients.magnitude, gradients._scratch
+
+    x_mask, y_mask = GRADIENT_MASKS[operator]
+    cv2.filter2D(image, cv2.CV_32F, x_mask, dst=ix)
+    cv2.filter2D(image, cv2.CV_32F, y_mask, dst=iy)
+
+    if norm == 'l2':
+        np.multiply(ix, ix, out=magnitude)
+        np.multiply(iy, iy, out=scratch)
+        magnitude += scratch
+        np.sqrt(magnitude, out=magnitude)
+    elif norm == 'l1':
+        np.abs(ix, out=magnitude)
+        np.abs(iy, out=scratch)
+        magnitude += scratch
+    elif norm == 'max':
+        np.abs(ix, out=magnitude)
+        np.abs(iy, out=scratch)
+        np.maximum(magnitude, scratch, out=magnitude)
+    else:
+        raise ValueError(f"Unknown gradient norm: {norm}")
+
+    if direction_bins:
+        if gradients.direction is None:
+            gradients.direction = np.empty(image.shape, dtype=np.uint8)
+        np.arctan2(iy, ix, out=scratch)
+        scratch *= direction_bins / (2 * np.pi)
+        np.rint(scratch, out=scratch)
+        np.mod(scratch, direction_bins, out=scratch)
+        gradients.direction[...] = scratch
+    else:
+        gradients.direction = None
+
+    return gradients
+
+
+@profiled
+def threshold_magnitude_array(magnitude, threshold=None, out=None):
+    # Binarizes like int(magnitude) > threshold, with the mean as default.
+    if threshold is None:
+        threshold = np.mean(magnitude)
+    if out is None:
+        out = np.empty(magnitude.shape, dtype=np.uint8)
+    np.greater_equal(magnitude, np.floor(threshold) + 1, out=out.view(bool))
+    np.multiply(out, 255, out=out)
+    return out
+
+
+@profiled
+def threshold_magnitude(magnitude, threshold=None):
+    return Image.fromarray(threshold_magnitude_array(magnitude, threshold))
+
+
+@profiled
+def sobel_operator_array(image, out=None):
+    return threshold_magnitude_array(compute_gradients(image, 'sobel').magnitude, out=out)
+
+
+@profiled
+@switchable('sobel')
+@cached('sobel')
+def sobel_operator(image):
+    return Image.fromarray(sobel_operator_array(np.asarray(image)))
 
-    for x in range(height):
-        for y in range(width):
-            if int(magnitude[x, y]) > threshold:
-                result_image[x, y] = 255
 
-    return Image.fromarray(result_image.astype(np.uint8))
+@profiled
+def prewitt_operator_array(image, out=None):
+    return threshold_magnitude_array(compute_gradients(image, 'prewitt').magnitude, out=out)
 
 
+@profiled
+@switchable('prewitt')
+@cached('prewitt')
 def prewitt_operator(image):
-    image = np.array(image, dtype=np.float32)
-    result_image = np.zeros_like(image, dtype=np.float32)
-    height, width = image.shape
-
-    prewitt_x_mask = np.array([
-        [-1, 0, 1],
-        [-1, 0, 1],
-        [-1, 0, 1]
-    ])
-
-    prewitt_y_mask = np.array([
-        [-1, -1, -1],
-        [0, 0, 0],
-        [1, 1, 1]
-    ])
+    return Image.fromarray(prewitt_operator_array(np.asarray(image)))
 
-    ix = cv2.filter2D(image, -1, prewitt_x_mask).astype(np.float32)
-    iy = cv2.filter2D(image, -1, prewitt_y_mask).astype(np.float32)
 
-    magnitude = np.sqrt(ix ** 2 + iy ** 2).astype(np.float32)
-    threshold = np.mean(magnitude)
+# Kirsch directions in mask order. Each mask weights three consecutive pixels
+# of the ring around the centre with 5 and the other five with -3.
+KIRSCH_DIRECTIONS = ['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW']
 
-    for x in range(height):
-        for y in range(width):
-            if int(magnitude[x, y]) > threshold:
-                result_image[x, y] = 255
+# Ring offsets clockwise from the north-west corner; mask k covers ring
+# positions k, k + 1 and k + 2.
+_KIRSCH_RING = [(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)]
 
-    return Image.fromarray(result_image.astype(np.uint8))
 
-
-def kirsch_compass_masks(image):
-    image = np.array(image, dtype=np.float32)
-    result_image = np.zeros_like(image, dtype=np.float32)
+@profiled
+def kirsch_compass_response(image):
+    """
+    Maximum Kirsch compass response and the index into KIRSCH_DIRECTIONS of
+    the mask that produced it, as (int16, uint8) arrays.
+    Since mask k + 1 is mask k rotated by one ring position, its response is
+    the previous one plus 8 * (entering pixel - leaving pixel), so only the
+    running maximum is kept instead of all eight responses.
+    """
+    image = np.asarray(image, dtype=np.uint8)
     height, width = image.shape
 
-    kirsch_masks = [
-        np.array([
-            [5, 5, 5],
-            [-3, 0, -3],
-            [-3, -3, -3]
-        ]),  # North
-        np.array([
-            [-3, 5, 5],
-            [-3, 0, 5],
-            [-3, -3, -3]
-        ]),  # Northeast
-        np.array([
-            [-3, -3, 5],
-            [-3, 0, 5],
-            [-3, -3, 5]
-        ]),  # East
-        np.array([
-            [-3, -3, -3],
-            [-3, 0, 5],
-            [-3, 5, 5]
-        ]),  # Southeast
-        np.array([
-            [-3, -3, -3],
-            [-3, 0, -3],
-            [5, 5, 5]
-        ]),  # South
-        np.array([
-            [-3, -3, -3],
-            [5, 0, -3],
-            [5, 5, -3]
-        ]),  # Southwest
-        np.array([
-            [5, -3, -3],
-            [5, 0, -3],
-            [5, -3, -3]
-        ]),  # West
-        np.array([
-            [5, 5, -3],
-            [5, 0, -3],
-            [-3, -3, -3]
-        ])  # Northwest
-    ]
-
-    edges = np.array([cv2.filter2D(image, -1, mask) for mask in kirsch_masks])
-
-    magnitude = np.max(edges, axis=0)
-    threshold = np.mean(magnitude)
-
-    for x in range(height):
-        for y in range(width):
-            if int(magnitude[x, y]) > threshold:
-                result_image[x, y] = 255
-
-    return Image.fromarray(result_image.astype(np.uint8))
+    # Reflect-101 borders, the cv2.filter2D default.
+    padded = np.pad(image.astype(np.int16), 1, mode='reflect')
+    ring = [padded[1 + dy:height + 1 + dy, 1 + dx:width + 1 + dx] for dy, dx in _KIRSCH_RING]
+
+    total = ring[0].copy()
+    for pixels in ring[1:]:
+        total += pixels
+    response = ring[0] + ring[1]
+    response += ring[2]
+    response *= 8
+    total *= 3
+    response -= total
+
+    magnitude = response.copy()
+    direction = np.zeros((height, width), dtype=np.uint8)
+    change, stronger = total, np.empty((height, width), dtype=bool)
+
+    for k in range(1, 8):
+        np.subtract(ring[(k + 2) % 8], ring[k - 1], out=change)
+        change *= 8
+        response += change
+        np.greater(response, magnitude, out=stronger)
+        np.copyto(magnitude, response, where=stronger)
+        np.copyto(direction, k, where=stronger)
+
+    return magnitude, direction
+
+
+@profiled
+def kirsch_compass_masks_array(image, out=None):
+    magnitude, _ = kirsch_compass_response(image)
+    return threshold_magnitude_array(magnitude, np.mean(magnitude, dtype=np.float32), out)
+
+
+@profiled
+@switchable('kirsch')
+@cached('kirsch')
+def kirsch_compass_masks(image, return_direction=False):
+    magnitude, direction = kirsch_compass_response(image)
+    threshold = np.mean(magnitude, dtype=np.float32)
+
+    result_image = threshold_magnitude(magnitude, threshold)
+    if return_direction:
+        return result_image, direction
+    return result_image